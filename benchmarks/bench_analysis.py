@@ -0,0 +1,95 @@
+"""
+Analysis frame on a synthetic database (benchmarks/synthetic.py): the vectorized derived columns against
+the notebooks' row-wise apply, the first refresh (song_analysis + lyrics languages), a refresh with nothing
+changed, one after 1% of the songs / lyrics changed, and build_analysis_frame against get_data_full.
+
+Run from the repository root:
+    python -m benchmarks.bench_analysis --size 300k
+"""
+import argparse
+import os
+import shutil
+import tempfile
+from bisect import bisect_right
+from datetime import datetime
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import PRESETS, generate
+from db_management import analysis
+from db_management.db import SongsDB
+from db_management.genres import GenreClassifier
+
+
+
+def timed(label: str, function):
+    start = perf_counter()
+    result = function()
+    print(f"   {label:44s} {perf_counter() - start:8.2f}s")
+    return result
+
+
+def weekday(date):
+    try:
+        return datetime.strptime(date, "%Y-%m-%d").isoweekday() % 7
+    except (TypeError, ValueError):
+        return None
+
+
+def python_level(value, feature: str):
+    bounds, labels = analysis.LEVELS[feature]
+    if value is None or value != value:
+        return None
+    return labels[min(max(bisect_right(bounds, value) - 1, 0), len(labels) - 1)]
+
+
+def row_wise(songs: pd.DataFrame, classifier: GenreClassifier) -> None:
+    # the notebooks' way: one Python call per row and column
+    songs["release_date"].apply(lambda date: int(date[:4]) if isinstance(date, str) else None)
+    songs["release_date"].apply(weekday)
+    songs["duration_ms"].apply(lambda value: value / 1000)
+    for feature in analysis.LEVELS:
+        songs[feature].apply(python_level, args=(feature,))
+    songs["artist_genres"].apply(classifier.classify)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", choices=PRESETS, default="300k")
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "songs.db")
+        shutil.copy(generate(os.path.join(tmp, "synthetic.db"), PRESETS[args.size]), path)
+        db = SongsDB(path)
+        print(f"{PRESETS[args.size]} songs")
+
+        songs = pd.concat(list(analysis._source_chunks(db)))
+        timed("derived columns, row-wise apply", lambda: row_wise(songs, GenreClassifier()))
+        timed("derived columns, vectorized", lambda: analysis.derive(songs, GenreClassifier()))
+
+        timed("first song_analysis refresh", lambda: analysis.refresh_song_analysis(db))
+        timed("first lyrics languages refresh", lambda: analysis.refresh_lyrics_languages(db, args.processes))
+        timed("refresh, nothing changed", lambda: db.refresh_analysis(processes=args.processes))
+
+        rng = np.random.default_rng(7)
+        song_ids = [row[0] for row in db.conn.execute("SELECT song_spotify_id FROM lyrics")]
+        changed = [song_ids[idx] for idx in rng.choice(len(song_ids), len(song_ids) // 100, replace=False)]
+        db.conn.executemany("UPDATE songs_features SET energy = 1 - energy WHERE song_spotify_id = ?", ((song_id,) for song_id in changed))
+        db.conn.executemany("UPDATE lyrics SET lyrics = lyrics WHERE song_spotify_id = ?", ((song_id,) for song_id in changed))
+        db.conn.commit()
+        counts = timed(f"refresh, {len(changed)} songs and lyrics changed", lambda: db.refresh_analysis(processes=args.processes))
+        print(f"   recomputed {counts['songs']} songs, {counts['lyrics']} lyrics")
+
+        timed("get_data_full(lyrics=False)", lambda: db.get_data_full(lyrics=False))
+        frame = timed("build_analysis_frame(refresh=False)", lambda: db.build_analysis_frame(refresh=False))
+        print(frame["lyrics_language"].value_counts(dropna=False).head().to_string())
+        db.close_connection()
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Timing of the get_distinct_*_id backlog queries on a synthetic database,
+compared with the previous NOT IN (SELECT ...) formulation.
+
+Run from the repository root:
+    python -m benchmarks.bench_backlog_queries --rows 1000000
+"""
+import argparse
+import os
+import tempfile
+from time import perf_counter
+
+from db_management.db import SongsDB, IDSongInfo, ArtistInfo, AlbumInfo, SongFeatures
+
+
+
+LEGACY_QUERIES = {
+    "artists": """SELECT DISTINCT artist_spotify_id FROM songs
+                  WHERE artist_spotify_id NOT IN (SELECT artist_spotify_id FROM artists);""",
+    "albums": """SELECT DISTINCT album_spotify_id FROM songs
+                 WHERE album_spotify_id NOT IN (SELECT album_spotify_id FROM albums);""",
+    "features": """SELECT DISTINCT song_spotify_id FROM songs
+                   WHERE song_spotify_id NOT IN (SELECT song_spotify_id FROM songs_features);""",
+}
+
+QUERIES = {
+    "artists": SongsDB.MISSING_ARTISTS_QUERY,
+    "albums": SongsDB.MISSING_ALBUMS_QUERY,
+    "features": SongsDB.MISSING_FEATURES_QUERY,
+}
+
+
+def populate(db: SongsDB, n: int, done_ratio: float) -> None:
+    n_artists, n_albums = max(n // 40, 1), max(n // 12, 1)
+    with db.bulk_load():
+        db.songs_insert_many(IDSongInfo(f"song{idx:08d}", f"album{idx % n_albums:07d}", f"artist{idx % n_artists:06d}",
+                                        f"Title {idx}", "1999-01-01", idx % 2, idx % 100) for idx in range(n))
+        db.artists_insert_many(ArtistInfo(f"artist{idx:06d}", f"Artist {idx}", "pop", 50, 1000)
+                               for idx in range(int(n_artists * done_ratio)))
+        db.albums_insert_many(AlbumInfo(f"album{idx:07d}", f"Album {idx}", "1999-01-01", 12, "", 50)
+                              for idx in range(int(n_albums * done_ratio)))
+        db.songs_features_insert_many(SongFeatures({"id": f"song{idx:08d}", "acousticness": 0.5, "danceability": 0.5,
+                                                    "energy": 0.5, "instrumentalness": 0.0, "liveness": 0.1,
+                                                    "loudness": -6.0, "speechiness": 0.05, "tempo": 120.0,
+                                                    "valence": 0.5, "mode": 1, "key": 5, "duration_ms": 200000})
+                                      for idx in range(int(n * done_ratio)))
+
+
+def timed(db: SongsDB, query: str) -> tuple:
+    start = perf_counter()
+    rows = db.get_query_database(query)
+    return perf_counter() - start, len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--done-ratio", type=float, default=0.9, help="fraction of entities already enriched")
+    parser.add_argument("--legacy", action="store_true", help="also time the NOT IN queries (slow on large tables)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = SongsDB(os.path.join(tmp, "songs.db"))
+        start = perf_counter()
+        populate(db, args.rows, args.done_ratio)
+        print(f"populated {args.rows} songs in {perf_counter() - start:.1f}s")
+
+        for name, query in QUERIES.items():
+            seconds, found = timed(db, query)
+            print(f"\nmissing {name:9s} {seconds * 1000:10.1f} ms  ({found} rows)")
+            for step in db.explain(query):
+                print(f"    {step}")
+            if args.legacy:
+                seconds, found = timed(db, LEGACY_QUERIES[name])
+                print(f"  legacy NOT IN  {seconds * 1000:10.1f} ms  ({found} rows)")
+        db.close_connection()
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Chart stage against the local MockAPIServer (with --latency seconds per answer, as a stand-in for the network):
+
+    parse     BeautifulSoup html.parser (the notebook, skipped when bs4 is not installed) against parse_chart
+    scrape    the notebook's loop (one week after the other, requests.get + the notebook's parser),
+              the first ChartScraper run on --workers threads, then a second run over the same range
+              (only the recent weeks, revalidated with conditional requests) and a revalidate=True run
+
+Run from the repository root:
+    python -m benchmarks.bench_charts --weeks 520 --workers 16 --latency 0.05
+"""
+import argparse
+import os
+import tempfile
+from datetime import date, timedelta
+from time import perf_counter
+
+import requests
+
+from db_management.charts import CHART_PATH, ChartClient, ChartScraper, parse_chart, week_dates
+from db_management.db import SongsDB, SongsContainer, SongInfo
+from db_management.mock_api import MockAPIServer, synthetic_chart_page
+from db_management.pipeline import RateLimiter
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+
+
+def notebook_chart(page: str) -> list:
+    # retrieve_top_songs() of dataset-creator.ipynb
+    entries = []
+    for item in BeautifulSoup(page, "html.parser").find_all("div", {"class": "chart-item"}):
+        try:
+            song = item.find("a", {"class": "chart-name"}).find("span", {"class": None})
+            artist = item.find("a", {"class": "chart-artist"}).find("span", {"class": None})
+            entries.append((song.text, artist.text))
+        except AttributeError:
+            continue
+    return entries
+
+
+def bench_parse(pages: list) -> None:
+    parsers = [("parse_chart", parse_chart)]
+    if BeautifulSoup is not None:
+        parsers.insert(0, ("BeautifulSoup html.parser", notebook_chart))
+    else:
+        print("BeautifulSoup baseline skipped (bs4 not installed)")
+    megabytes = sum(len(page) for page in pages) / 1e6
+    for name, parse in parsers:
+        start = perf_counter()
+        for page in pages:
+            parse(page)
+        seconds = perf_counter() - start
+        print(f"{name:28s} {len(pages) / seconds:8.0f} pages/s {megabytes / seconds:7.1f} MB/s")
+
+
+def sequential(url: str, weeks: list) -> SongsContainer:
+    parse = notebook_chart if BeautifulSoup is not None else parse_chart
+    songs = SongsContainer()
+    with requests.Session() as session:
+        for week in weeks:
+            response = session.get(url + CHART_PATH % week)
+            response.raise_for_status()
+            for title, artist in parse(response.text):
+                songs.add_song(SongInfo(artist, title))
+    return songs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--weeks", type=int, default=520)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    end = date(2024, 12, 31)
+    first = end - timedelta(weeks=args.weeks - 1)
+    weeks = week_dates(first, end)
+    bench_parse([synthetic_chart_page(week) for week in weeks[:200]])
+
+    with tempfile.TemporaryDirectory() as tmp, MockAPIServer(latency=args.latency) as server:
+        path = os.path.join(tmp, "songs.db")
+        start = perf_counter()
+        songs = sequential(server.url, weeks)
+        print(f"\n{'notebook loop, sequential':40s} {perf_counter() - start:7.2f}s {len(weeks):6d} requests {len(songs):7d} songs")
+
+        scraper = ChartScraper(path, ChartClient(server.url, limiter=RateLimiter(10000)), workers=args.workers)
+        runs = [(f"ChartScraper, {args.workers} workers", {}), ("second run (recent weeks only)", {}),
+                ("revalidate=True (conditional requests)", {"revalidate": True})]
+        for name, kwargs in runs:
+            not_modified = server.not_modified_count
+            stats = scraper.run(first, end, **kwargs)
+            print(f"{name:40s} {stats['seconds']:7.2f}s {stats['requests']:6d} requests {stats['new_songs']:7d} new songs "
+                  f"{server.not_modified_count - not_modified:6d} not modified {stats['failed']:4d} failed")
+
+        db = SongsDB(path)
+        print(f"\nchart_positions rows: {db.conn.execute('SELECT COUNT(*) FROM chart_positions').fetchone()[0]}, "
+              f"chart songs: {len(db.get_chart_songs())} (notebook loop: {len(songs)})")
+        db.close_connection()
+
+
+
+if __name__ == "__main__":
+    main()
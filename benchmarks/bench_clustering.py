@@ -0,0 +1,95 @@
+"""
+Peak RSS and time of the audio-feature clustering: SongClusterer (streamed chunks, MiniBatchKMeans)
+against the in-memory notebook way (get_data() + StandardScaler + KMeans + PCA), plus the parallel
+elbow sweep. Every mode runs in its own subprocess so ru_maxrss is not shared between them.
+
+Run from the repository root:
+    python -m benchmarks.bench_clustering --rows 300000
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+import numpy as np
+
+from db_management.db import SongsDB, SongFeaturesBatch
+from benchmarks.bench_backlog_queries import populate
+
+
+
+MODES = ["streaming", "in-memory", "elbow"]
+
+
+def build(path: str, rows: int) -> None:
+    db = SongsDB(path)
+    populate(db, rows, 0.0)
+    rng = np.random.default_rng(42)
+    centers = rng.uniform(0, 1, (5, 9))
+    with db.bulk_load():
+        for start in range(0, rows, 50000):
+            size = min(50000, rows - start)
+            values = np.clip(centers[rng.integers(0, 5, size)] + rng.normal(0, 0.1, (size, 9)), 0, 1)
+            batch = SongFeaturesBatch.from_dicts(
+                {"id": f"song{start + idx:08d}", "acousticness": row[0], "danceability": row[1], "energy": row[2],
+                 "instrumentalness": row[3], "liveness": row[4], "loudness": -60 * row[5], "speechiness": row[6],
+                 "tempo": 60 + 140 * row[7], "valence": row[8], "mode": int(idx % 2), "key": int(idx % 12),
+                 "duration_ms": int(120000 + 240000 * row[0])} for idx, row in enumerate(values))
+            db.songs_features_insert_many(batch)
+    db.close_connection()
+
+
+def run(path: str, mode: str, chunksize: int, processes: int) -> None:
+    start = perf_counter()
+    if mode == "streaming":
+        from db_management.clustering import SongClusterer
+        clusterer = SongClusterer(path, n_clusters=5, chunksize=chunksize).fit()
+        inertia = clusterer.inertia()
+        clusterer.save()
+        clusterer.assign()
+        detail = f"inertia {inertia:.0f}"
+    elif mode == "in-memory":
+        from sklearn.cluster import KMeans
+        from sklearn.decomposition import PCA
+        from sklearn.preprocessing import StandardScaler
+        data = SongsDB(path).get_data(lyrics=False)
+        scaled = StandardScaler().fit_transform(data[list(SongsDB.AUDIO_FEATURES)].dropna())
+        kmeans = KMeans(n_clusters=5, n_init=3, random_state=42).fit(scaled)
+        PCA(n_components=3).fit_transform(scaled)
+        detail = f"inertia {kmeans.inertia_:.0f}"
+    else:
+        from db_management.clustering import elbow
+        inertias = elbow(path, range(1, 11), processes=processes, chunksize=chunksize, epochs=2)
+        detail = "k=1..10"
+        print("   " + ", ".join(f"{k}: {inertia:.0f}" for k, inertia in inertias.items()))
+    seconds = perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{mode:10s} {seconds:7.2f}s  peak RSS {peak_mb:8.1f} MB  {detail}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=300000)
+    parser.add_argument("--chunksize", type=int, default=50000)
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--run", nargs=2, metavar=("DB_PATH", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run(args.run[0], args.run[1], args.chunksize, args.processes)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "songs.db")
+        build(path, args.rows)
+        for mode in MODES:
+            subprocess.run([sys.executable, "-m", "benchmarks.bench_clustering", "--chunksize", str(args.chunksize),
+                            "--processes", str(args.processes), "--run", path, mode], check=True)
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Fuzzy duplicate detection on synthetic songs: time of refresh_duplicates and precision / recall against
+the planted duplicates (remaster / live / feat. copies with slightly different features) and decoys
+(another song of the artist with the same title), then get_data with and without collapse_duplicates.
+
+Run from the repository root:
+    python -m benchmarks.bench_duplicates --rows 300000
+"""
+import argparse
+import os
+import tempfile
+from time import perf_counter
+
+import numpy as np
+
+from db_management.db import SongsDB
+from db_management.mock_api import WORDS
+
+
+
+SUFFIXES = [" - Remastered 2011", " - Live", " (Live at Wembley)", " - 2009 Remaster", " (feat. Someone)",
+            " - Single Version", " [Deluxe Edition]", ""]
+
+
+def build(path: str, rows: int, duplicate_ratio: float, decoy_ratio: float) -> set:
+    """
+    Fills the database, returns the planted duplicate pairs (original id, copy id).
+    """
+    rng = np.random.default_rng(42)
+    words = np.array([word.capitalize() for word in WORDS if word.isalpha()])
+    n_artists = max(rows // 40, 1)
+    n_copies, n_decoys = int(rows * duplicate_ratio), int(rows * decoy_ratio)
+    n_originals = rows - n_copies - n_decoys
+
+    titles = [" ".join(rng.choice(words, rng.integers(1, 5))) + f" {idx}" * (idx % 3 == 0) for idx in range(n_originals)]
+    artists = rng.integers(0, n_artists, n_originals)
+    features = rng.uniform(0, 1, (n_originals, 9))
+    songs, planted = [], set()
+    for idx in range(n_originals):
+        songs.append((f"song{idx:08d}", titles[idx], artists[idx], features[idx]))
+    for copy in range(n_copies):
+        original = int(rng.integers(0, n_originals))
+        song_id = f"copy{copy:08d}"
+        planted.add((f"song{original:08d}", song_id))
+        songs.append((song_id, titles[original] + SUFFIXES[copy % len(SUFFIXES)], artists[original],
+                      np.clip(features[original] + rng.normal(0, 0.01, 9), 0, 1)))
+    for decoy in range(n_decoys):
+        original = int(rng.integers(0, n_originals))
+        songs.append((f"decoy{decoy:07d}", titles[original], artists[original], rng.uniform(0, 1, 9)))
+
+    db = SongsDB(path)
+    columns = "acousticness, danceability, energy, instrumentalness, speechiness, tempo, valence, mode, key"
+    with db.bulk_load():
+        db.conn.executemany("INSERT INTO songs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            ((song_id, f"album{idx // 12:07d}", f"artist{artist:06d}", title, f"{1960 + idx % 64}-01-01", 0, idx % 100)
+                             for idx, (song_id, title, artist, _) in enumerate(songs)))
+        db.conn.executemany(f"INSERT INTO songs_features (song_spotify_id, {columns}) VALUES (?, {', '.join('?' * 9)})",
+                            ((song_id, *values[:5], 60 + 140 * values[5], values[6], int(values[7] > 0.5), int(values[8] * 12))
+                             for song_id, _, _, values in songs))
+        db.conn.commit()
+    db.close_connection()
+    return planted
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=300000)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.1)
+    parser.add_argument("--decoy-ratio", type=float, default=0.02)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "songs.db")
+        planted = build(path, args.rows, args.duplicate_ratio, args.decoy_ratio)
+        db = SongsDB(path)
+
+        start = perf_counter()
+        collapsed = db.refresh_duplicates()
+        seconds = perf_counter() - start
+
+        clusters = dict(db.conn.execute("SELECT song_spotify_id, canonical_spotify_id FROM song_duplicates").fetchall())
+        found = sum(1 for original, copy in planted if original in clusters and clusters[original] == clusters.get(copy))
+        # a cluster is pure when all its songs are copies of the same original
+        truth = {copy: original for original, copy in planted}
+        roots = {}
+        for song_id, canonical in clusters.items():
+            roots.setdefault(canonical, set()).add(truth.get(song_id, song_id))
+        impure = sum(1 for members in roots.values() if len(members) > 1)
+        decoys = sum(1 for song_id in clusters if song_id.startswith("decoy"))
+        print(f"{args.rows} songs: refresh_duplicates {seconds:.2f}s, {collapsed} songs collapsed into {len(roots)} clusters")
+        print(f"recall {found / max(len(planted), 1):.3f} of {len(planted)} planted duplicates, "
+              f"{impure} clusters mixing different songs ({decoys} decoys merged)")
+
+        start = perf_counter()
+        full, collapsed_rows = len(db.get_data(lyrics=False)), len(db.get_data(lyrics=False, collapse_duplicates=True))
+        print(f"get_data {full} rows, collapse_duplicates=True {collapsed_rows} rows ({perf_counter() - start:.2f}s for both)")
+        db.close_connection()
+
+
+
+if __name__ == "__main__":
+    main()
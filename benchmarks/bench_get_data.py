@@ -0,0 +1,66 @@
+"""
+Peak RSS and time of a full scan of the joined dataset: get_data() against get_data(chunksize=...).
+Every mode runs in its own subprocess so ru_maxrss is not shared between them.
+
+Run from the repository root:
+    python -m benchmarks.bench_get_data --rows 300000
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+from db_management.db import SongsDB, LyricsInfo
+from benchmarks.bench_backlog_queries import populate
+
+
+
+MODES = ["full", "full-no-lyrics", "chunked", "chunked-no-lyrics"]
+
+
+def build(path: str, rows: int) -> None:
+    db = SongsDB(path)
+    populate(db, rows, 1.0)
+    with db.bulk_load():
+        db.lyrics_insert_many(LyricsInfo(f"song{idx:08d}", "na " * 400) for idx in range(0, rows, 3))
+    db.close_connection()
+
+
+def scan(path: str, mode: str, chunksize: int) -> None:
+    db = SongsDB(path)
+    lyrics = not mode.endswith("no-lyrics")
+    start = perf_counter()
+    if mode.startswith("chunked"):
+        total = sum(len(chunk) for chunk in db.get_data(chunksize=chunksize, lyrics=lyrics))
+    else:
+        total = len(db.get_data(lyrics=lyrics))
+    seconds = perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{mode:18s} {total:9d} rows  {seconds:6.2f}s  peak RSS {peak_mb:8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=300000)
+    parser.add_argument("--chunksize", type=int, default=20000)
+    parser.add_argument("--scan", nargs=2, metavar=("DB_PATH", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scan:
+        scan(args.scan[0], args.scan[1], args.chunksize)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "songs.db")
+        build(path, args.rows)
+        for mode in MODES:
+            subprocess.run([sys.executable, "-m", "benchmarks.bench_get_data", "--chunksize", str(args.chunksize),
+                            "--scan", path, mode], check=True)
+
+
+
+if __name__ == "__main__":
+    main()
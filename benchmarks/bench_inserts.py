@@ -0,0 +1,61 @@
+"""
+Rows/sec of the per-row SongsDB inserts against the batched *_insert_many variants.
+
+Run from the repository root:
+    python -m benchmarks.bench_inserts --rows 20000
+"""
+import argparse
+import os
+import tempfile
+from time import perf_counter
+
+from db_management.db import SongsDB, IDSongInfo, DBException
+
+
+
+def make_songs(n: int) -> list:
+    return [IDSongInfo(f"song{idx:08d}", f"album{idx // 12:07d}", f"artist{idx // 40:06d}",
+                       f"Title {idx}", "1999-01-01", idx % 2, idx % 100) for idx in range(n)]
+
+
+def bench_per_row(db: SongsDB, songs: list) -> float:
+    start = perf_counter()
+    for song in songs:
+        try:
+            db.songs_insert(song)
+        except DBException:
+            continue
+    return perf_counter() - start
+
+
+def bench_many(db: SongsDB, songs: list, batch_size: int) -> float:
+    start = perf_counter()
+    db.songs_insert_many(songs, batch_size=batch_size)
+    return perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=SongsDB.DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    songs = make_songs(args.rows)
+    with tempfile.TemporaryDirectory() as tmp:
+        per_row_db = SongsDB(os.path.join(tmp, "per_row.db"))
+        per_row = bench_per_row(per_row_db, songs)
+        per_row_db.close_connection()
+
+        many_db = SongsDB(os.path.join(tmp, "many.db"))
+        many = bench_many(many_db, songs, args.batch_size)
+        many_db.close_connection()
+
+    print(f"rows: {args.rows}, batch size: {args.batch_size}")
+    print(f"songs_insert       {args.rows / per_row:12.0f} rows/s  ({per_row:.2f}s)")
+    print(f"songs_insert_many  {args.rows / many:12.0f} rows/s  ({many:.2f}s)")
+    print(f"speedup            {per_row / many:12.1f}x")
+
+
+
+if __name__ == "__main__":
+    main()
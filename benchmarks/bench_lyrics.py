@@ -0,0 +1,130 @@
+"""
+Lyrics stage: HTML -> text throughput, DB size of the lyrics storage formats and an end-to-end
+LyricsPipeline run against the local MockAPIServer.
+
+    parse     BeautifulSoup on 30 threads (the notebook, skipped when bs4 is not installed),
+              extract_lyrics on 30 threads, extract_lyrics in a process pool
+    storage   plain TEXT (the previous lyrics_insert), zlib without dictionary, zlib + trained dictionary
+
+Run from the repository root:
+    python -m benchmarks.bench_lyrics --songs 3000 --processes 4
+"""
+import argparse
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from time import perf_counter
+
+from db_management.db import SongsDB, LyricsInfo
+from db_management.lyrics import LyricsPipeline, extract_lyrics
+from db_management.mock_api import MockAPIServer, synthetic_lyrics_page
+from db_management.pipeline import GeniusClient, RateLimiter
+from benchmarks.bench_backlog_queries import populate
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+
+
+def notebook_lyrics(html: str) -> str:
+    # get_lyrics() of dataset-creator.ipynb
+    soup = BeautifulSoup(html, "html.parser")
+    container = soup.find("div", class_=re.compile(r"^Lyrics__Container*"))
+    return re.sub(r"\[.*?\]", "", container.get_text(separator=" "))
+
+
+def bench_parse(pages: list, threads: int, processes: int) -> list:
+    megabytes = sum(len(page) for page in pages) / 1e6
+    modes = [("extract_lyrics, %d threads" % threads, ThreadPoolExecutor(threads), extract_lyrics),
+             ("extract_lyrics, %d processes" % processes, ProcessPoolExecutor(processes), extract_lyrics)]
+    if BeautifulSoup is not None:
+        modes.insert(0, ("BeautifulSoup, %d threads" % threads, ThreadPoolExecutor(threads), notebook_lyrics))
+    else:
+        print("BeautifulSoup baseline skipped (bs4 not installed)")
+
+    texts = None
+    for name, executor, parse in modes:
+        with executor:
+            start = perf_counter()
+            results = list(executor.map(parse, pages, chunksize=16) if isinstance(executor, ProcessPoolExecutor)
+                           else executor.map(parse, pages))
+            seconds = perf_counter() - start
+        texts = texts or results
+        print(f"{name:32s} {len(pages) / seconds:8.0f} pages/s {megabytes / seconds:7.1f} MB/s")
+    return texts
+
+
+def bench_storage(tmp: str, texts: list) -> None:
+    print(f"\n{'storage':18s} {'DB MB':>8s} {'lyrics MB':>10s} {'get_data s':>11s} {'no lyrics s':>12s}")
+    for name in ["plain TEXT", "zlib", "zlib + dictionary"]:
+        path = os.path.join(tmp, name.replace(" ", "_") + ".db")
+        db = SongsDB(path)
+        populate(db, len(texts), 1.0)
+        lyrics = [LyricsInfo(f"song{idx:08d}", text) for idx, text in enumerate(texts)]
+        if name == "plain TEXT":
+            db.conn.executemany(db.LYRICS_INSERT, (item.row() for item in lyrics))
+            db.conn.commit()
+        else:
+            db.lyrics_insert_many(lyrics)
+        if name == "zlib + dictionary":
+            db.train_lyrics_dictionary()
+            db.compress_lyrics()
+        # only the lyrics differ between the files, the change log would add the same to each
+        db.conn.execute("DELETE FROM data_changes;")
+        db.conn.commit()
+        db.conn.execute("VACUUM;")
+        stored = db.conn.execute("SELECT SUM(length(lyrics)) FROM lyrics").fetchone()[0]
+        # pages of the database, the file itself lags behind while the VACUUM sits in the WAL
+        size = db.conn.execute("PRAGMA page_count;").fetchone()[0] * db.conn.execute("PRAGMA page_size;").fetchone()[0]
+
+        start = perf_counter()
+        data = db.get_data()
+        with_lyrics = perf_counter() - start
+        start = perf_counter()
+        db.get_data(lyrics=False)
+        without_lyrics = perf_counter() - start
+        assert data["lyrics"].tolist() == texts
+        db.close_connection()
+        print(f"{name:18s} {size / 1e6:8.2f} {stored / 1e6:10.2f} {with_lyrics:11.2f} {without_lyrics:12.2f}")
+
+
+def bench_pipeline(tmp: str, songs: int, threads: int, processes: int, latency: float) -> None:
+    path = os.path.join(tmp, "pipeline.db")
+    db = SongsDB(path)
+    populate(db, songs, 1.0)
+    names = dict(db.get_query_database("""SELECT s.song_spotify_id, s.title || ' ' || a.name FROM songs s
+                                          JOIN artists a ON s.artist_spotify_id = a.artist_spotify_id"""))
+    db.close_connection()
+    # Genius hits pointing every song to its own synthetic lyrics page
+    genius = {query: {"response": {"hits": [{"result": {"primary_artist_names": query.split(" ", 2)[2], "url": f"/songs/{song_id}"}}]}}
+              for song_id, query in names.items()}
+
+    with MockAPIServer({"genius": genius}, latency=latency) as server:
+        client = GeniusClient("token", base_url=server.url, limiter=RateLimiter(10 ** 6))
+        stats = LyricsPipeline(path, client, workers=threads, processes=processes).run()
+    print(f"\npipeline: {stats['keys']} songs, {stats['written']} written, {stats['failed']} failed, "
+          f"{stats['requests']} requests in {stats['seconds']:.2f}s ({stats['written'] / stats['seconds']:.0f} songs/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--songs", type=int, default=3000)
+    parser.add_argument("--threads", type=int, default=30)
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--latency", type=float, default=0.05, help="mock server latency per request")
+    args = parser.parse_args()
+
+    pages = [synthetic_lyrics_page(f"song{idx:08d}") for idx in range(args.songs)]
+    print(f"{len(pages)} pages, {sum(len(page) for page in pages) / len(pages) / 1000:.0f} kB on average")
+    texts = bench_parse(pages, args.threads, args.processes)
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_storage(tmp, texts)
+        bench_pipeline(tmp, min(args.songs, 1000), args.threads, args.processes, args.latency)
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+LyricsIndex: full build, incremental update after 1% new lyrics, and curse-word frequency queries
+answered from the memory-mapped term counts, next to the size of the index on disk.
+
+Run from the repository root:
+    python -m benchmarks.bench_lyrics_index --songs 100000
+"""
+import argparse
+import os
+import resource
+import tempfile
+from time import perf_counter
+
+from db_management.db import SongsDB, LyricsInfo
+from db_management.lyrics_index import LyricsIndex
+from db_management.mock_api import synthetic_lyrics
+from benchmarks.bench_backlog_queries import populate
+
+
+
+CURSE_WORDS = ["fuck", "shit", "bitch", "ass", "asshole", "slut", "whore", "motherfucker", "piss", "cunt",
+               "damn", "dick", "pussy", "bullshit", "bastard"]
+
+
+def lyrics(idx: int) -> str:
+    text = " ".join(synthetic_lyrics(f"song{idx}"))
+    return text + " " + " ".join(CURSE_WORDS[idx % len(CURSE_WORDS)] for _ in range(idx % 4))
+
+
+def timed(label: str, function):
+    start = perf_counter()
+    result = function()
+    print(f"{label:38s} {perf_counter() - start:8.2f}s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--songs", type=int, default=100000)
+    args = parser.parse_args()
+    initial = args.songs * 99 // 100
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = SongsDB(os.path.join(tmp, "songs.db"))
+        populate(db, args.songs, 1.0)
+        db.conn.execute("UPDATE songs SET release_date = (1960 + rowid % 64) || '-01-01';")
+        db.conn.commit()
+        db.lyrics_insert_many(LyricsInfo(f"song{idx:08d}", lyrics(idx)) for idx in range(initial))
+
+        index = LyricsIndex(os.path.join(tmp, "index"))
+        timed(f"build ({initial} songs)", lambda: index.update(db))
+        db.lyrics_insert_many(LyricsInfo(f"song{idx:08d}", lyrics(idx)) for idx in range(initial, args.songs))
+        timed(f"update (+{args.songs - initial} songs)", lambda: index.update(db))
+        timed("update (nothing changed)", lambda: index.update(db))
+
+        index = LyricsIndex(index.path)
+        frequency = timed("curse words by release_year", lambda: index.term_frequency(db, CURSE_WORDS, normalize="song"))
+        timed("curse words by year and genre", lambda: index.term_frequency(db, CURSE_WORDS, by=("release_year", "parent_genre")))
+
+        size = sum(os.path.getsize(os.path.join(index.path, name)) for name in os.listdir(index.path))
+        print(f"\n{len(index)} songs, {len(index.vocabulary)} terms, {index.manifest['nnz']} stored counts, "
+              f"{size / 1e6:.1f} MB on disk, peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+        print(frequency[["songs", "total"]].head())
+        db.close_connection()
+
+
+
+if __name__ == "__main__":
+    main()
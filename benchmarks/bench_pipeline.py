@@ -0,0 +1,66 @@
+"""
+Throughput and rate-limit behaviour of the EnrichmentPipeline against the local MockAPIServer.
+
+Run from the repository root:
+    python -m benchmarks.bench_pipeline --songs 2000 --server-rate 200 --client-rate 300
+
+With --replay the ingestion goes through a ResponseCache and is then repeated into a fresh database
+from the warm cache in offline mode (no server, no rate limit).
+"""
+import argparse
+import os
+import tempfile
+
+from db_management.cache import ResponseCache
+from db_management.db import SongsDB, SongInfo
+from db_management.mock_api import MockAPIServer
+from db_management.pipeline import EnrichmentPipeline, SpotifyClient, RateLimiter
+
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--songs", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--server-rate", type=float, default=200, help="requests/s before the mock answers 429")
+    parser.add_argument("--client-rate", type=float, default=300, help="initial (and max) client rate")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--replay", action="store_true", help="run again from the warm response cache, offline")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, MockAPIServer(rate_limit=args.server_rate, latency=args.latency) as server:
+        cache = ResponseCache(os.path.join(tmp, "http_cache.db")) if args.replay else None
+        client = SpotifyClient("token", base_url=server.url + "/v1", limiter=RateLimiter(args.client_rate), cache=cache)
+        ingest(os.path.join(tmp, "songs.db"), client, args)
+        print(f"server: {server.requests_count} requests, {server.throttled_count} answered 429, final client rate {client.limiter.rate:.0f}/s")
+
+        if args.replay:
+            cache.offline = True
+            client = SpotifyClient("token", base_url=server.url + "/v1", limiter=RateLimiter(10 ** 9), cache=cache)
+            requests_before = server.requests_count
+            print("\nreplay from the cache:")
+            ingest(os.path.join(tmp, "replay.db"), client, args)
+            print(f"server: {server.requests_count - requests_before} requests, cache: {cache.stats()}")
+            cache.close()
+
+
+
+def ingest(path: str, client: SpotifyClient, args) -> None:
+    db = SongsDB(path)
+    db.scraped_songs_insert_many(SongInfo(f"Artist {idx % 500}", f"Song {idx}") for idx in range(args.songs))
+    db.close_connection()
+
+    pipeline = EnrichmentPipeline(path, client, workers=args.workers)
+    print(f"{'stage':11s} {'keys':>7s} {'written':>8s} {'requests':>9s} {'429':>5s} {'retries':>8s} {'hits':>6s} {'req/s':>7s} {'rows/s':>8s} {'seconds':>8s}")
+    for stage in ["search", "artists", "albums", "features", "popularity"]:
+        stats = pipeline.run(stage)
+        seconds = stats["seconds"] or 1e-9
+        print(f"{stage:11s} {stats['keys']:7d} {stats['written']:8d} {stats['requests']:9d} {stats['throttled']:5d} "
+              f"{stats['retries']:8d} {stats['cache_hits']:6d} {stats['requests'] / seconds:7.0f} {stats['written'] / seconds:8.0f} {seconds:8.2f}")
+        if stats["errors"]:
+            print("   first error:", stats["errors"][0])
+
+
+
+if __name__ == "__main__":
+    main()
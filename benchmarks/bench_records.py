@@ -0,0 +1,70 @@
+"""
+Memory and construction time of 300k audio-feature rows: dict-backed objects (the previous
+SongFeatures), the __slots__ SongFeatures and the columnar SongFeaturesBatch.
+
+Run from the repository root:
+    python -m benchmarks.bench_records --rows 300000
+"""
+import argparse
+import gc
+import random
+import tracemalloc
+from time import perf_counter
+
+from db_management.db import SongFeatures, SongFeaturesBatch
+
+
+
+class DictSongFeatures:
+    """
+    The previous, dict-backed SongFeatures.
+    """
+
+    def __init__(self, features_info: dict):
+        for key in ("acousticness", "danceability", "energy", "instrumentalness", "liveness", "loudness",
+                    "speechiness", "tempo", "valence", "mode", "key", "duration_ms"):
+            setattr(self, key, features_info[key])
+        self.song_id = features_info["id"]
+
+
+def make_dicts(n: int) -> list:
+    rng = random.Random(42)
+    return [{"id": f"{idx:022d}", "acousticness": rng.random(), "danceability": rng.random(), "energy": rng.random(),
+             "instrumentalness": rng.random(), "liveness": rng.random(), "loudness": -rng.random() * 30,
+             "speechiness": rng.random(), "tempo": 60 + rng.random() * 140, "valence": rng.random(),
+             "mode": rng.randint(0, 1), "key": rng.randint(-1, 11), "duration_ms": rng.randint(60000, 600000)}
+            for idx in range(n)]
+
+
+def measure(name: str, build, dicts: list) -> None:
+    gc.collect()
+    start = perf_counter()
+    result = build(dicts)
+    seconds = perf_counter() - start
+    del result
+
+    # second run for the memory, tracemalloc would distort the timing
+    gc.collect()
+    tracemalloc.start()
+    result = build(dicts)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:22s} {seconds:7.2f}s  {current / 2 ** 20:8.1f} MB  ({len(result)} rows)")
+    del result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=300000)
+    args = parser.parse_args()
+
+    dicts = make_dicts(args.rows)
+    # the song id strings are shared by every variant and counted in none of them
+    measure("dict-backed objects", lambda ds: [DictSongFeatures(d) for d in ds], dicts)
+    measure("__slots__ SongFeatures", lambda ds: [SongFeatures(d) for d in ds], dicts)
+    measure("SongFeaturesBatch", SongFeaturesBatch.from_dicts, dicts)
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+SimilarityIndex on synthetic audio features: build time, single / batched query latency, recall@k of the
+partitioned search against the exhaustive scan, filtered queries and an incremental update of 1% of
+the songs. Every size runs in its own subprocess so ru_maxrss is not shared between them.
+
+Run from the repository root:
+    python -m benchmarks.bench_similarity --rows 300000 3000000
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+import numpy as np
+
+from db_management.db import SongsDB, ArtistInfo
+from db_management.similarity import SimilarityIndex
+
+
+
+GENRES = ["dance pop,pop", "album rock,hard rock", "contemporary jazz", "gangster rap,hip hop", "classical"]
+
+
+def features(rng: np.random.Generator, centers: np.ndarray, size: int) -> list:
+    values = centers[rng.integers(0, len(centers), size)] + rng.normal(0, 0.08, (size, 9))
+    return np.column_stack([np.clip(values[:, :5], 0, 1), -60 * np.clip(values[:, 5], 0, 1), np.clip(values[:, 6], 0, 1),
+                            60 + 140 * np.clip(values[:, 7], 0, 1), np.clip(values[:, 8], 0, 1),
+                            rng.integers(0, 2, size), rng.integers(0, 12, size), rng.integers(90000, 420000, size)]).tolist()
+
+
+def build(path: str, rows: int) -> None:
+    db = SongsDB(path)
+    rng = np.random.default_rng(42)
+    centers = rng.uniform(0, 1, (50, 9))
+    n_artists = max(rows // 40, 1)
+    columns = ", ".join(SongsDB.AUDIO_FEATURES)
+    with db.bulk_load():
+        db.artists_insert_many(ArtistInfo(f"artist{idx:06d}", f"Artist {idx}", GENRES[idx % len(GENRES)], 50, 1000)
+                               for idx in range(n_artists))
+        for start in range(0, rows, 100000):
+            size = min(100000, rows - start)
+            db.conn.executemany("INSERT INTO songs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                ((f"song{idx:08d}", f"album{idx // 12:07d}", f"artist{idx % n_artists:06d}", f"Title {idx}",
+                                  f"{1960 + idx % 64}-01-01", 0, idx % 100) for idx in range(start, start + size)))
+            db.conn.executemany(f"INSERT INTO songs_features (song_spotify_id, {columns}) VALUES (?, {', '.join('?' * 12)})",
+                                ([f"song{start + idx:08d}"] + values for idx, values in enumerate(features(rng, centers, size))))
+            db.conn.commit()
+    db.close_connection()
+
+
+def timed(label: str, function, count: int = 1):
+    start = perf_counter()
+    result = function()
+    seconds = perf_counter() - start
+    print(f"   {label:44s} {seconds:8.3f}s" + (f"  ({seconds / count * 1000:.2f} ms / query)" if count > 1 else ""))
+    return result
+
+
+def run(path: str, rows: int, queries: int) -> None:
+    print(f"{rows} songs")
+    db = SongsDB(path)
+    index = SimilarityIndex(os.path.join(os.path.dirname(path), "similarity"))
+    timed("build", lambda: index.update(db))
+
+    rng = np.random.default_rng(7)
+    song_ids = [f"song{idx:08d}" for idx in rng.choice(rows, queries, replace=False)]
+    index.similar(song_ids[0])      # page in the vectors
+    start = perf_counter()
+    latencies = []
+    for song_id in song_ids[:200]:
+        start = perf_counter()
+        index.similar(song_id, 10)
+        latencies.append(perf_counter() - start)
+    print(f"   {'single query p50 / p99':44s} {np.percentile(latencies, 50) * 1000:8.2f} / {np.percentile(latencies, 99) * 1000:.2f} ms")
+    approximate = timed(f"batch of {queries}", lambda: index.similar_many(song_ids, 10), queries)
+    exact = timed(f"batch of {queries}, exact", lambda: index.similar_many(song_ids, 10, exact=True), queries)
+    found = approximate.groupby("query_id")["song_spotify_id"].apply(set)
+    truth = exact.groupby("query_id")["song_spotify_id"].apply(set)
+    recall = np.mean([len(found[song_id] & truth[song_id]) / len(truth[song_id]) for song_id in song_ids])
+    print(f"   {'recall@10':44s} {recall:8.3f}")
+    timed("filtered (1990s rock), 20 queries", lambda: [index.similar(song_id, 10, db, {"release_year": range(1990, 2000), "parent_genre": "rock"})
+                                                         for song_id in song_ids[:20]], 20)
+    timed("filtered (pop), 20 queries", lambda: [index.similar(song_id, 10, db, {"parent_genre": "pop"}) for song_id in song_ids[:20]], 20)
+
+    changed = [f"song{idx:08d}" for idx in rng.choice(rows, rows // 100, replace=False)]
+    db.conn.executemany("UPDATE songs_features SET tempo = tempo + 1 WHERE song_spotify_id = ?", ((song_id,) for song_id in changed))
+    db.conn.commit()
+    timed(f"update (+{len(changed)} changed songs)", lambda: index.update(db))
+
+    size = sum(os.path.getsize(os.path.join(index.path, name)) for name in os.listdir(index.path))
+    print(f"   {index.manifest['partitions']} partitions, {size / 1e6:.1f} MB on disk, "
+          f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+    db.close_connection()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[300000, 3000000])
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--run", metavar="DB_PATH", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run(args.run, args.rows[0], args.queries)
+        return
+
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "songs.db")
+            build(path, rows)
+            subprocess.run([sys.executable, "-m", "benchmarks.bench_similarity", "--rows", str(rows),
+                            "--queries", str(args.queries), "--run", path], check=True)
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Startup cost of an ingestion worker: import time and peak RSS of db_management in a fresh interpreter
+(pandas is imported only by the DataFrame-returning methods), next to `import pandas` for reference,
+the start of a spawned worker process, and SongsDB() on a database at SCHEMA_VERSION (no DDL) against
+one that needs the schema (user_version 0). Linux only (/proc/self/status).
+
+Run from the repository root:
+    python -m benchmarks.bench_startup
+"""
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from statistics import median
+from time import perf_counter
+
+from db_management.db import SongsDB
+
+
+
+# each snippet runs in a fresh interpreter and prints {"seconds", "rss_mb", "pandas"}. The peak RSS is
+# VmHWM: ru_maxrss would keep the high-water mark of this process across the fork + exec
+MEASURE = """
+import json, sys
+from time import perf_counter
+start = perf_counter()
+{code}
+seconds = perf_counter() - start
+with open("/proc/self/status") as status:
+    peak = next(int(line.split()[1]) for line in status if line.startswith("VmHWM"))
+print(json.dumps({{"seconds": seconds, "rss_mb": peak / 1024, "pandas": "pandas" in sys.modules}}))
+"""
+
+CASES = {
+    "python (empty)": "pass",
+    "import pandas": "import pandas",
+    "import db_management.db": "import db_management.db",
+    "import db_management.lyrics (worker)": "import db_management.lyrics",
+    "worker: import + SongsDB + 1000 inserts": """
+from db_management.db import SongsDB, IDSongInfo
+db = SongsDB({path!r})
+db.songs_insert_many(IDSongInfo(f"song{{idx}}", "album", "artist", "title", "2001-01-01", 0, 50) for idx in range(1000))
+db.close_connection()""",
+    "get_data (pandas imported on use)": """
+from db_management.db import SongsDB
+SongsDB({path!r}).get_data(lyrics=False)""",
+}
+
+
+def measure(code: str, repeat: int) -> dict:
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", MEASURE.format(code=code)], capture_output=True, text=True, check=True,
+                                cwd=os.getcwd(), env={**os.environ, "PYTHONPATH": os.getcwd()}).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {"seconds": min(run["seconds"] for run in runs), "rss_mb": min(run["rss_mb"] for run in runs), "pandas": runs[0]["pandas"]}
+
+
+def _worker_ready() -> bool:
+    importlib.import_module("db_management.lyrics")     # what a lyrics parser / enrichment worker imports
+    return True
+
+
+def spawn_time(repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            executor.submit(_worker_ready).result()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def open_time(path: str, n: int, reset_version: bool) -> float:
+    times = []
+    for _ in range(n):
+        if reset_version:
+            conn = sqlite3.connect(path)
+            conn.execute("PRAGMA user_version = 0;")
+            conn.close()
+        start = perf_counter()
+        db = SongsDB(path)
+        times.append(perf_counter() - start)
+        db.close_connection()
+    return median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "songs.db")
+        SongsDB(path).close_connection()
+        print(f"{'':42s} {'seconds':>8s} {'peak RSS':>10s}  pandas loaded")
+        for label, code in CASES.items():
+            result = measure(code.format(path=path), args.repeat)
+            print(f"{label:42s} {result['seconds']:8.3f} {result['rss_mb']:7.0f} MB  {result['pandas']}")
+        print(f"{'spawned worker process ready':42s} {spawn_time(args.repeat):8.3f}")
+        print(f"{'SongsDB() at SCHEMA_VERSION':42s} {open_time(path, 50, False) * 1000:8.2f} ms")
+        print(f"{'SongsDB() running the DDL':42s} {open_time(path, 50, True) * 1000:8.2f} ms")
+
+
+
+if __name__ == "__main__":
+    main()
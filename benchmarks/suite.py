@@ -0,0 +1,300 @@
+"""
+Benchmark suite of db_management on the synthetic databases (benchmarks/synthetic.py): every SongsDB
+insert method, the get_distinct_*_id backlog queries, get_data / get_data_full, SongsContainer.add_song /
+from_csv and the genre mapping. Every case runs `--repeat` times, the best time is kept.
+
+Results are written as JSON (--output), and compared with a stored baseline (--baseline): a case slower
+than the baseline by more than --threshold (and by more than MIN_DELTA seconds) is flagged as a
+regression and the exit status is 1. --save-baseline stores the results as the new baseline.
+
+Run from the repository root:
+    python -m benchmarks.suite --size 10k --output results.json --baseline benchmarks/baseline_10k.json
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import PRESETS, SyntheticDataset, generate
+from db_management.db import SongsDB, SongsContainer, IDSongInfo, SongFeatures, SongFeaturesBatch, DBException
+from db_management.genres import GenreClassifier
+
+
+
+SINGLE_ROWS = 2000          # rows of the per-row inserts (one commit each)
+MANY_ROWS = 100_000         # rows of the *_insert_many cases
+LYRICS_ROWS = 20_000
+CONTAINER_ROWS = 300_000    # scraped songs of the SongsContainer cases
+IN_MEMORY_LIMIT = 1_000_000 # get_data without chunksize is skipped above this many songs
+MIN_DELTA = 0.005            # seconds, smaller slowdowns are noise
+
+# SongFeatures dict keys in the SongFeaturesBatch.rows() order
+FEATURE_KEYS = ("id",) + SongFeaturesBatch.FLOAT_COLUMNS + tuple(SongFeaturesBatch.INT_COLUMNS)
+
+
+
+class Context:
+    """
+    The dataset, the generated database and a scratch directory shared by the cases.
+    """
+
+    def __init__(self, dataset: SyntheticDataset, db_path: str, tmp: str):
+        self.dataset = dataset
+        self.db_path = db_path
+        self.tmp = tmp
+        self.created = 0
+        self._cache = {}
+
+
+    def fresh_db(self) -> SongsDB:
+        self.created += 1
+        return SongsDB(os.path.join(self.tmp, f"fresh_{self.created}.db"))
+
+
+    def rows(self, name: str, count: int) -> list:
+        """
+        The first `count` entities of a kind (songs, features, artists, albums, lyrics, scraped), memoized.
+        """
+        key = (name, count)
+        if key not in self._cache:
+            dataset = self.dataset
+            if name in ("artists", "albums"):
+                rows = getattr(dataset, name)()[:count]
+            else:
+                rows = []
+                for chunk in dataset.chunks():
+                    if len(rows) >= count:
+                        break
+                    batch = getattr(dataset, name)(chunk)
+                    if name == "songs":
+                        batch = [IDSongInfo(*row) for row in batch.rows()]
+                    elif name == "features":
+                        batch = [SongFeatures(dict(zip(FEATURE_KEYS, row))) for row in batch.rows()]
+                    rows.extend(batch)
+                rows = rows[:count]
+            self._cache[key] = rows
+        return self._cache[key]
+
+
+
+# ================== CASES ==================
+# A case prepares its state outside of the timing and returns (run, rows, cleanup).
+
+def insert_single(kind: str, method: str, count: int = SINGLE_ROWS):
+    def prepare(ctx: Context):
+        db, rows = ctx.fresh_db(), ctx.rows(kind, count)
+        insert = getattr(db, method)
+
+        def run():
+            for row in rows:
+                try:
+                    insert(row)
+                except DBException:
+                    pass
+        return run, len(rows), db.close_connection
+    return prepare
+
+
+def insert_many(kind: str, method: str, count: int = MANY_ROWS):
+    def prepare(ctx: Context):
+        db, rows = ctx.fresh_db(), ctx.rows(kind, count)
+        return (lambda: getattr(db, method)(rows)), len(rows), db.close_connection
+    return prepare
+
+
+def query(method: str, **kwargs):
+    def prepare(ctx: Context):
+        db = SongsDB(ctx.db_path)
+
+        def run():
+            result = getattr(db, method)(**kwargs)
+            if kwargs.get("chunksize"):
+                return sum(len(chunk) for chunk in result)
+            return len(result)
+        return run, None, db.close_connection
+    return prepare
+
+
+def container_add_song(ctx: Context):
+    songs = ctx.rows("scraped", CONTAINER_ROWS)
+
+    def run():
+        container = SongsContainer()
+        for song in songs:
+            container.add_song(song)
+    return run, len(songs), None
+
+
+def container_from_csv(ctx: Context):
+    songs = ctx.rows("scraped", CONTAINER_ROWS)
+    container = SongsContainer()
+    container.songs = list(songs)       # every scraped row, repeats included, as the CSV holds them
+    path = os.path.join(ctx.tmp, "scraped.csv")
+    container.save_to_csv(path, mode="w")
+    return (lambda: SongsContainer().from_csv(path)), len(songs), None
+
+
+def genres_frame(ctx: Context) -> pd.Series:
+    return pd.Series([artist.genres for artist in ctx.rows("artists", ctx.dataset.n_artists)], dtype=object)
+
+
+def genre_classify(ctx: Context):
+    genres = genres_frame(ctx).tolist()
+
+    def run():
+        classifier = GenreClassifier()
+        for value in genres:
+            classifier.classify(value)
+    return run, len(genres), None
+
+
+def genre_classify_series(ctx: Context):
+    genres = genres_frame(ctx)
+    return (lambda: GenreClassifier().classify_series(genres)), len(genres), None
+
+
+def genre_mapping_insert_many(ctx: Context):
+    db = ctx.fresh_db()
+    classifier = GenreClassifier()
+    genres = genres_frame(ctx)
+    mapping = dict(zip(genres, classifier.classify_series(genres).astype(object)))
+    return (lambda: db.genre_mapping_insert_many(mapping, classifier.version)), len(mapping), db.close_connection
+
+
+CASES = {
+    "insert.scraped_songs_insert": insert_single("scraped", "scraped_songs_insert"),
+    "insert.songs_insert": insert_single("songs", "songs_insert"),
+    "insert.songs_features_insert": insert_single("features", "songs_features_insert"),
+    "insert.artists_insert": insert_single("artists", "artists_insert"),
+    "insert.albums_insert": insert_single("albums", "albums_insert"),
+    "insert.lyrics_insert": insert_single("lyrics", "lyrics_insert"),
+    "insert.scraped_songs_insert_many": insert_many("scraped", "scraped_songs_insert_many"),
+    "insert.songs_insert_many": insert_many("songs", "songs_insert_many"),
+    "insert.songs_features_insert_many": insert_many("features", "songs_features_insert_many"),
+    "insert.artists_insert_many": insert_many("artists", "artists_insert_many"),
+    "insert.albums_insert_many": insert_many("albums", "albums_insert_many"),
+    "insert.lyrics_insert_many": insert_many("lyrics", "lyrics_insert_many", LYRICS_ROWS),
+    "insert.genre_mapping_insert_many": genre_mapping_insert_many,
+    "backlog.get_distinct_artists_id": query("get_distinct_artists_id"),
+    "backlog.get_distinct_albums_id": query("get_distinct_albums_id"),
+    "backlog.get_distinct_songs_id": query("get_distinct_songs_id"),
+    "data.get_data": query("get_data", lyrics=False),
+    "data.get_data_chunked": query("get_data", chunksize=50000, lyrics=False),
+    "data.get_data_full_lyrics_chunked": query("get_data_full", chunksize=50000),
+    "container.add_song": container_add_song,
+    "container.from_csv": container_from_csv,
+    "genres.classify": genre_classify,
+    "genres.classify_series": genre_classify_series,
+}
+
+
+def skipped(name: str, songs: int) -> bool:
+    return name == "data.get_data" and songs > IN_MEMORY_LIMIT
+
+
+
+# ================== RUNNER ==================
+
+def run_case(ctx: Context, name: str, repeat: int) -> dict:
+    times, rows = [], None
+    for _ in range(repeat):
+        run, rows, cleanup = CASES[name](ctx)
+        start = perf_counter()
+        result = run()
+        times.append(perf_counter() - start)
+        if cleanup is not None:
+            cleanup()
+        rows = rows if rows is not None else result
+    best = min(times)
+    return {"seconds": best, "median_seconds": float(np.median(times)), "rows": rows,
+            "rows_per_second": rows / best if rows and best > 0 else None}
+
+
+def metadata(size: str, seed: int, repeat: int) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"size": size, "songs": PRESETS[size], "seed": seed, "repeat": repeat, "commit": commit,
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(), "sqlite": sqlite3.sqlite_version, "numpy": np.__version__,
+            "pandas": pd.__version__, "platform": platform.platform(), "cpus": os.cpu_count()}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    (case, baseline seconds, seconds, ratio) of the cases slower than the baseline by more than threshold.
+    """
+    if baseline["meta"]["size"] != results["meta"]["size"]:
+        raise ValueError(f"The baseline is of size {baseline['meta']['size']}, the results of size {results['meta']['size']}.")
+    regressions = []
+    for name, result in results["results"].items():
+        reference = baseline["results"].get(name)
+        if reference is None:
+            continue
+        ratio = result["seconds"] / reference["seconds"] if reference["seconds"] > 0 else float("inf")
+        if ratio > 1 + threshold and result["seconds"] - reference["seconds"] > MIN_DELTA:
+            regressions.append((name, reference["seconds"], result["seconds"], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", choices=PRESETS, default="10k")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", help="regex of the cases to run")
+    parser.add_argument("--data-dir", help="keeps the generated databases there between runs (default: a temporary directory)")
+    parser.add_argument("--output", help="JSON results file")
+    parser.add_argument("--baseline", help="JSON results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.25, help="tolerated slowdown against the baseline")
+    parser.add_argument("--save-baseline", help="also writes the results to this file")
+    args = parser.parse_args()
+
+    names = [name for name in CASES if args.only is None or re.search(args.only, name)]
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        os.makedirs(data_dir, exist_ok=True)
+        start = perf_counter()
+        db_path = generate(os.path.join(data_dir, f"synthetic_{args.size}_{args.seed}.db"), PRESETS[args.size], args.seed)
+        print(f"synthetic database {args.size}: {perf_counter() - start:.1f}s")
+
+        ctx = Context(SyntheticDataset(PRESETS[args.size], args.seed), db_path, tmp)
+        results = {"meta": metadata(args.size, args.seed, args.repeat), "results": {}}
+        for name in names:
+            if skipped(name, PRESETS[args.size]):
+                print(f"{name:40s} skipped")
+                continue
+            result = run_case(ctx, name, args.repeat)
+            results["results"][name] = result
+            throughput = f"{result['rows_per_second']:12.0f} rows/s" if result["rows_per_second"] else ""
+            print(f"{name:40s} {result['seconds']:9.4f}s {throughput}")
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for name, reference, seconds, ratio in regressions:
+            print(f"REGRESSION {name}: {reference:.4f}s -> {seconds:.4f}s ({ratio:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print(f"no regression against {args.baseline} (threshold {args.threshold:.0%})")
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Deterministic synthetic SongsDB for the benchmarks - the real songs.db cannot be shipped.
+
+The same (songs, seed) always gives the same database: every entity is generated in fixed chunks of
+CHUNK songs from its own seed, whatever the order or the batch size it is consumed in. Distributions:
+
+  artists     log-normal fan-out (a few artists with hundreds of songs, many with a handful), 0 to 6
+              Spotify-like genres ("dance pop,pop,post-teen pop") built on the keys of the genre map
+  albums      singles / EPs / LPs, release dates mostly to the day, some to the month or year
+  songs       ids are random-looking 22 characters like the Spotify ones (so inserts hit the B-trees
+              in random order), some titles with "- Remastered", "(Live)", "(feat. X)" versions
+  features    beta / normal distributions close to the Spotify audio features
+  lyrics      log-normal number of lines with repeated choruses, no lyrics for instrumentals
+  backlog     only `enriched` of the artists / albums / features are stored, the rest is left for
+              the get_distinct_*_id queries
+
+Generate a database from the repository root:
+    python -m benchmarks.synthetic --size 300k --path /tmp/songs_300k.db
+"""
+import argparse
+import hashlib
+import os
+from array import array
+from time import perf_counter
+
+import numpy as np
+
+from assets.static.genre_map import genre_map as GENRE_MAP
+from db_management.db import SongsDB, SongInfo, ArtistInfo, AlbumInfo, LyricsInfo, SongsBatch, SongFeaturesBatch
+from db_management.mock_api import WORDS, PHRASES
+
+
+
+PRESETS = {"10k": 10_000, "300k": 300_000, "3M": 3_000_000}
+CHUNK = 100_000
+
+ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+GENRE_PREFIXES = ["", "", "", "dance ", "indie ", "modern ", "uk ", "german ", "latin ", "classic ", "alternative ", "post-"]
+VERSIONS = [" - Remastered 2011", " - 2009 Remaster", " - Live", " (Live)", " - Single Version", " (feat. {})"]
+SONGS_PER_ARTIST = 25
+
+
+def spotify_id(kind: str, idx: int) -> str:
+    """
+    Deterministic, random-looking base62 id of the idx-th entity of a kind (a 128 bit hash, no collisions in practice).
+    """
+    value = int.from_bytes(hashlib.blake2b(f"{kind}:{idx}".encode("ascii"), digest_size=16).digest(), "big")
+    chars = []
+    for _ in range(22):
+        value, digit = divmod(value, 62)
+        chars.append(ALPHABET[digit])
+    return "".join(chars)
+
+
+
+class SyntheticDataset:
+
+    def __init__(self, songs: int, seed: int = 42, enriched: float = 0.95, lyrics_ratio: float = 0.8):
+        self.n_songs = songs
+        self.seed = seed
+        self.enriched = enriched
+        self.lyrics_ratio = lyrics_ratio
+        rng = self._rng("catalog")
+
+        # artists: heavy-tailed (log-normal) share of the songs, albums sized for it
+        self.n_artists = max(songs // SONGS_PER_ARTIST, 1)
+        weights = rng.lognormal(0, 1.2, self.n_artists)
+        self.artist_weights = weights / weights.sum()
+        album_size = rng.choice([1, 5, 12], self.n_artists, p=[0.3, 0.15, 0.55])
+        self.albums_per_artist = np.maximum(np.rint(songs * self.artist_weights / np.maximum(album_size, 4)), 1).astype(np.int64)
+        self.album_offsets = np.concatenate([[0], np.cumsum(self.albums_per_artist)])
+        self.n_albums = int(self.album_offsets[-1])
+        self.album_sizes = np.repeat(album_size, self.albums_per_artist)
+        self.album_artists = np.repeat(np.arange(self.n_artists), self.albums_per_artist)
+        self.album_dates = self._dates(rng, self.n_albums)
+        self.album_popularity = np.clip(rng.normal(35, 20, self.n_albums), 0, 100).astype(np.int64)
+        self.artist_ids = [spotify_id("artist", idx) for idx in range(self.n_artists)]
+        self.album_ids = [spotify_id("album", idx) for idx in range(self.n_albums)]
+        self.artist_names = [f"{self._words(rng, 1, 3)} {idx}" for idx in range(self.n_artists)]
+        self.artist_enriched = rng.random(self.n_artists) < enriched
+        self.album_enriched = rng.random(self.n_albums) < enriched
+
+        # a shared pool of lyric lines, so lyrics compress / tokenize like real ones
+        zipf = 1.0 / np.arange(1, len(WORDS) + 1)
+        self.lines = [" ".join(rng.choice(WORDS, rng.integers(4, 10), p=zipf / zipf.sum())).capitalize() if rng.random() > 0.1
+                      else PHRASES[rng.integers(len(PHRASES))].capitalize() for _ in range(5000)]
+
+
+    def _rng(self, kind: str, chunk: int = 0) -> np.random.Generator:
+        return np.random.default_rng([self.seed, sum(map(ord, kind)), chunk])
+
+
+    @staticmethod
+    def _words(rng: np.random.Generator, low: int, high: int) -> str:
+        return " ".join(WORDS[idx].capitalize() for idx in rng.integers(0, len(WORDS), rng.integers(low, high + 1)))
+
+
+    @staticmethod
+    def _dates(rng: np.random.Generator, n: int) -> list:
+        # more music released every decade, mostly day precision
+        years = np.clip(2024 - rng.exponential(14, n), 1950, 2023).astype(np.int64)
+        months, days = rng.integers(1, 13, n), rng.integers(1, 29, n)
+        precision = rng.choice(3, n, p=[0.85, 0.05, 0.10])
+        return [f"{year}-{month:02d}-{day:02d}" if kind == 0 else f"{year}-{month:02d}" if kind == 1 else str(year)
+                for year, month, day, kind in zip(years.tolist(), months.tolist(), days.tolist(), precision.tolist())]
+
+
+    def chunks(self) -> range:
+        return range((self.n_songs + CHUNK - 1) // CHUNK)
+
+
+    def _chunk_range(self, chunk: int) -> range:
+        return range(chunk * CHUNK, min((chunk + 1) * CHUNK, self.n_songs))
+
+
+    # ================== ENTITIES ==================
+
+    def artists(self) -> list:
+        """
+        ArtistInfo of the enriched artists.
+        """
+        rng = self._rng("artists")
+        count = len(GENRE_PREFIXES)
+        keys = sorted(GENRE_MAP)
+        genre_weights = 1.0 / np.arange(1, len(keys) + 1)
+        genre_weights = rng.permutation(genre_weights / genre_weights.sum())
+        n_genres = np.where(rng.random(self.n_artists) < 0.15, 0, np.minimum(1 + rng.poisson(1.5, self.n_artists), 6))
+        followers = np.rint(rng.lognormal(8, 2.5, self.n_artists) * (1 + 1000 * self.artist_weights)).astype(np.int64)
+        popularity = np.clip(np.log10(followers + 1) * 14 + rng.normal(0, 6, self.n_artists), 0, 100).astype(np.int64)
+        artists = []
+        for idx in range(self.n_artists):
+            genres = ",".join(GENRE_PREFIXES[rng.integers(count)] + keys[key]
+                              for key in rng.choice(len(keys), n_genres[idx], replace=False, p=genre_weights))
+            if self.artist_enriched[idx]:
+                artists.append(ArtistInfo(self.artist_ids[idx], self.artist_names[idx], genres, int(popularity[idx]), int(followers[idx])))
+        return artists
+
+
+    def albums(self) -> list:
+        """
+        AlbumInfo of the enriched albums.
+        """
+        rng = self._rng("albums")
+        return [AlbumInfo(self.album_ids[idx], self._words(rng, 1, 4), self.album_dates[idx], int(self.album_sizes[idx]), "",
+                          int(self.album_popularity[idx]))
+                for idx in range(self.n_albums) if self.album_enriched[idx]]
+
+
+    def _song_albums(self, chunk: int) -> np.ndarray:
+        rng = self._rng("song_albums", chunk)
+        size = len(self._chunk_range(chunk))
+        artists = rng.choice(self.n_artists, size, p=self.artist_weights)
+        return self.album_offsets[artists] + (rng.random(size) * self.albums_per_artist[artists]).astype(np.int64)
+
+
+    def songs(self, chunk: int) -> SongsBatch:
+        rng = self._rng("songs", chunk)
+        albums = self._song_albums(chunk)
+        featured = rng.random(len(albums)) < 0.15
+        batch = SongsBatch()
+        batch.song_id = [spotify_id("song", idx) for idx in self._chunk_range(chunk)]
+        batch.album_id = [self.album_ids[album] for album in albums.tolist()]
+        batch.artist_id = [self.artist_ids[artist] for artist in self.album_artists[albums].tolist()]
+        batch.title = [self._title(rng, is_featured) for is_featured in featured.tolist()]
+        batch.release_date = [self.album_dates[album] for album in albums.tolist()]
+        batch.featured = array("b", featured.astype(np.int8).tolist())
+        batch.popularity = array("h", np.clip(self.album_popularity[albums] + rng.normal(0, 8, len(albums)), 0, 100).astype(np.int64).tolist())
+        return batch
+
+
+    def _title(self, rng: np.random.Generator, featured: bool) -> str:
+        title = self._words(rng, 1, 5)
+        if featured and rng.random() < 0.5:
+            return title + VERSIONS[-1].format(self.artist_names[rng.integers(self.n_artists)])
+        if rng.random() < 0.06:
+            return title + VERSIONS[rng.integers(len(VERSIONS) - 1)]
+        return title
+
+
+    def features(self, chunk: int) -> SongFeaturesBatch:
+        """
+        Features of the enriched songs of the chunk.
+        """
+        rng = self._rng("features", chunk)
+        songs = self._chunk_range(chunk)
+        size = len(songs)
+        columns = {
+            "acousticness": rng.beta(0.6, 1.6, size), "danceability": rng.beta(5, 3.5, size), "energy": rng.beta(3.5, 2, size),
+            "instrumentalness": np.where(rng.random(size) < 0.1, rng.beta(5, 1.5, size), rng.beta(0.2, 20, size)),
+            "liveness": rng.beta(1.5, 6, size), "loudness": np.clip(rng.normal(-8, 4, size), -45, 0),
+            "speechiness": rng.beta(0.9, 12, size), "tempo": np.clip(rng.normal(120, 28, size), 40, 220), "valence": rng.beta(2.2, 2, size),
+            "mode": (rng.random(size) < 0.65).astype(np.int64), "key": rng.integers(0, 12, size),
+            "duration_ms": np.clip(rng.lognormal(12.25, 0.3, size), 30000, 1800000).astype(np.int64),
+        }
+        keep = rng.random(size) < self.enriched
+        batch = SongFeaturesBatch()
+        batch.song_id = [spotify_id("song", idx) for idx, kept in zip(songs, keep.tolist()) if kept]
+        for column in SongFeaturesBatch.FLOAT_COLUMNS:
+            setattr(batch, column, array("d", columns[column][keep].tolist()))
+        for column, typecode in SongFeaturesBatch.INT_COLUMNS.items():
+            setattr(batch, column, array(typecode, columns[column][keep].tolist()))
+        return batch
+
+
+    def lyrics(self, chunk: int) -> list:
+        """
+        LyricsInfo of the songs of the chunk that have lyrics.
+        """
+        rng = self._rng("lyrics", chunk)
+        songs = self._chunk_range(chunk)
+        has_lyrics = rng.random(len(songs)) < self.lyrics_ratio
+        n_lines = np.clip(rng.lognormal(3.6, 0.45, len(songs)), 8, 300).astype(np.int64)
+        lyrics = []
+        for idx, kept, count in zip(songs, has_lyrics.tolist(), n_lines.tolist()):
+            if not kept:
+                continue
+            chorus = [self.lines[line] for line in rng.integers(0, len(self.lines), 4)]
+            verse = [self.lines[line] for line in rng.integers(0, len(self.lines), count)]
+            parts = []
+            for start in range(0, count, 8):
+                parts += [f"[Verse {start // 8 + 1}]"] + verse[start:start + 8] + ["[Chorus]"] + chorus
+            lyrics.append(LyricsInfo(spotify_id("song", idx), "\n".join(parts)))
+        return lyrics
+
+
+    def scraped(self, chunk: int) -> list:
+        """
+        SongInfo of the chart scrape behind the songs of the chunk, hits appear in several weeks.
+        """
+        rng = self._rng("scraped", chunk)
+        batch = self.songs(chunk)
+        names = {artist_id: name for artist_id, name in zip(self.artist_ids, self.artist_names)}
+        weeks = np.minimum(rng.geometric(0.5, len(batch)), 20)
+        return [SongInfo(names[artist_id], title) for artist_id, title, count in zip(batch.artist_id, batch.title, weeks.tolist())
+                for _ in range(count)]
+
+
+    # ================== DATABASE ==================
+
+    def write(self, db: SongsDB) -> None:
+        with db.bulk_load():
+            db.artists_insert_many(self.artists())
+            db.albums_insert_many(self.albums())
+            for chunk in self.chunks():
+                db.songs_insert_many(self.songs(chunk))
+                db.songs_features_insert_many(self.features(chunk))
+                db.lyrics_insert_many(self.lyrics(chunk))
+
+
+
+def generate(path: str, songs: int, seed: int = 42, **kwargs) -> str:
+    """
+    Creates the synthetic database at path unless a complete one is there already (a "<path>.done"
+    marker is written at the end). Returns path.
+    """
+    if os.path.exists(path + ".done"):
+        return path
+    for leftover in (path, path + "-wal", path + "-shm"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    db = SongsDB(path)
+    try:
+        SyntheticDataset(songs, seed, **kwargs).write(db)
+    finally:
+        db.close_connection()
+    with open(path + ".done", "w", encoding="utf-8") as file:
+        file.write(f"{songs} {seed}\n")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", choices=PRESETS, default="10k")
+    parser.add_argument("--path", required=True)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    start = perf_counter()
+    generate(args.path, PRESETS[args.size], args.seed)
+    print(f"{args.path}: {PRESETS[args.size]} songs in {perf_counter() - start:.1f}s, {os.path.getsize(args.path) / 1e6:.0f} MB")
+
+
+
+if __name__ == "__main__":
+    main()
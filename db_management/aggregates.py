@@ -0,0 +1,157 @@
+import math
+
+import pandas as pd
+
+from db_management.genres import GenreClassifier
+
+
+
+# --- FEATURE AGGREGATES ---
+#
+# feature_aggregates holds, per (release_year, parent_genre, weekday), the number of songs with features
+# and for every audio feature its non-null count, sum and sum of squares. Means and variances of any
+# grouping of those keys come from one small GROUP BY over this table instead of get_data() + pandas.
+#
+# The table is maintained from the data_changes log (filled by triggers): a refresh recomputes only
+# the release years touched since the previous refresh. Songs with an imprecise release_date
+# ("1975", "1975-06") get weekday -1, unknown years / genres are stored as "unknown".
+
+
+UNKNOWN = "unknown"
+KEYS = ("release_year", "parent_genre", "weekday")
+
+SEQ_STATE = "aggregates_seq"
+VERSION_STATE = "aggregates_map_version"
+
+
+def _select(db, where: str = "") -> str:
+    columns = ", ".join(f"COUNT(f.{feature}), TOTAL(f.{feature}), TOTAL(f.{feature} * f.{feature})"
+                        for feature in db.AUDIO_FEATURES)
+    return f"""
+            SELECT  COALESCE(substr(s.release_date, 1, 4), '{UNKNOWN}') AS release_year,
+                    COALESCE(g.parent_genre, '{UNKNOWN}') AS parent_genre,
+                    CASE WHEN length(s.release_date) = 10 THEN CAST(strftime('%w', s.release_date) AS INTEGER) ELSE -1 END AS weekday,
+                    COUNT(*), {columns}
+            FROM songs s
+            JOIN songs_features f ON s.song_spotify_id = f.song_spotify_id
+            LEFT JOIN artists a ON s.artist_spotify_id = a.artist_spotify_id
+            LEFT JOIN genre_mapping g ON g.genres = a.genres AND g.map_version = ?
+            {"WHERE " + where if where else ""}
+            GROUP BY 1, 2, 3
+            """
+
+
+def _year_filter(years: set) -> tuple:
+    known = sorted(year for year in years if year is not None)
+    conditions = [f"substr(s.release_date, 1, 4) IN ({', '.join('?' * len(known))})"] if known else []
+    if None in years:
+        conditions.append("s.release_date IS NULL")
+    return " OR ".join(conditions), tuple(known)
+
+
+def _classify_missing(db, classifier: GenreClassifier, where: str = "", params: tuple = ()) -> None:
+    # resolve the artist genres strings of the affected songs that have no mapping yet
+    genres = db.conn.execute(f"""SELECT DISTINCT a.genres FROM songs s
+                                 JOIN artists a ON s.artist_spotify_id = a.artist_spotify_id
+                                 WHERE a.genres NOT IN (SELECT genres FROM genre_mapping WHERE map_version = ?)
+                                 {"AND (" + where + ")" if where else ""}""", (classifier.version,) + params).fetchall()
+    if genres:
+        classifier.classify_series(pd.Series([row[0] for row in genres], dtype=object))
+
+
+def _get_state(db, name: str):
+    row = db.conn.execute("SELECT value FROM analytics_state WHERE name = ?", (name,)).fetchone()
+    return None if row is None else row[0]
+
+
+def _set_state(db, name: str, value) -> None:
+    db.conn.execute("INSERT OR REPLACE INTO analytics_state (name, value) VALUES (?, ?)", (name, value))
+
+
+def _classifier(db, classifier: GenreClassifier) -> GenreClassifier:
+    return classifier if classifier is not None else GenreClassifier(db=db)
+
+
+
+def rebuild_aggregates(db, classifier: GenreClassifier = None) -> None:
+    """
+    Backfill: recomputes the whole feature_aggregates table.
+    """
+    classifier = _classifier(db, classifier)
+    last_change = db.last_change()
+    _classify_missing(db, classifier)
+    db.conn.execute("DELETE FROM feature_aggregates;")
+    db.conn.execute(f"INSERT INTO feature_aggregates {_select(db)}", (classifier.version,))
+    _set_state(db, SEQ_STATE, last_change)
+    _set_state(db, VERSION_STATE, classifier.version)
+    db.conn.commit()
+
+
+
+def refresh_aggregates(db, classifier: GenreClassifier = None) -> list:
+    classifier = _classifier(db, classifier)
+    since = _get_state(db, SEQ_STATE)
+    if since is None or _get_state(db, VERSION_STATE) != classifier.version or not db.changes_available(since):
+        rebuild_aggregates(db, classifier)
+        db.prune_changes()
+        return [row[0] for row in db.conn.execute("SELECT DISTINCT release_year FROM feature_aggregates ORDER BY 1")]
+
+    last_change = db.last_change()
+    years = db.changed_release_years(since, last_change)
+    if years:
+        where, params = _year_filter(years)
+        _classify_missing(db, classifier, where, params)
+        stored = sorted(year for year in years if year is not None) + ([UNKNOWN] if None in years else [])
+        db.conn.execute(f"DELETE FROM feature_aggregates WHERE release_year IN ({', '.join('?' * len(stored))})", stored)
+        db.conn.execute(f"INSERT INTO feature_aggregates {_select(db, where)}", (classifier.version,) + params)
+    _set_state(db, SEQ_STATE, last_change)
+    db.conn.commit()
+    db.prune_changes()
+    return sorted(UNKNOWN if year is None else year for year in years)
+
+
+
+def check_aggregates(db, classifier: GenreClassifier = None, rel_tol: float = 1e-9) -> list:
+    """
+    Refreshes the table and compares it with a full recomputation.
+    Returns the (release_year, parent_genre, weekday) cells that differ, empty when consistent.
+    """
+    classifier = _classifier(db, classifier)
+    refresh_aggregates(db, classifier)
+    expected = {row[:3]: row[3:] for row in db.conn.execute(_select(db), (classifier.version,))}
+    stored = {row[:3]: row[3:] for row in db.conn.execute("SELECT * FROM feature_aggregates")}
+
+    mismatches = []
+    for cell in sorted(set(expected) | set(stored), key=str):
+        if cell not in expected or cell not in stored:
+            mismatches.append(cell)
+        elif not all(math.isclose(a, b, rel_tol=rel_tol, abs_tol=1e-9) for a, b in zip(expected[cell], stored[cell])):
+            mismatches.append(cell)
+    return mismatches
+
+
+
+def feature_stats(db, by: tuple = ("release_year",), classifier: GenreClassifier = None) -> pd.DataFrame:
+    by = (by,) if isinstance(by, str) else tuple(by)
+    if not by or any(key not in KEYS for key in by):
+        raise ValueError(f"by must be a non-empty subset of {KEYS}.")
+    refresh_aggregates(db, classifier)
+
+    columns = ", ".join(f"SUM({feature}_n), TOTAL({feature}_sum), TOTAL({feature}_sumsq)" for feature in db.AUDIO_FEATURES)
+    cursor = db.conn.execute(f"""SELECT {", ".join(by)}, SUM(n), {columns} FROM feature_aggregates
+                                 GROUP BY {", ".join(by)} ORDER BY {", ".join(by)}""")
+    rows = cursor.fetchall()
+
+    data = {key: [row[idx] for row in rows] for idx, key in enumerate(by)}
+    data["count"] = [row[len(by)] for row in rows]
+    for idx, feature in enumerate(db.AUDIO_FEATURES):
+        offset = len(by) + 1 + 3 * idx
+        means, variances = [], []
+        for row in rows:
+            n, total, total_sq = row[offset:offset + 3]
+            means.append(total / n if n else math.nan)
+            # sample variance (ddof=1), the pandas default
+            variances.append(max(total_sq - total * total / n, 0.0) / (n - 1) if n > 1 else math.nan)
+        data[f"{feature}_mean"] = means
+        data[f"{feature}_var"] = variances
+    return pd.DataFrame(data).set_index(list(by))
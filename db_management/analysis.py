@@ -0,0 +1,317 @@
+import hashlib
+import json
+import os
+import string
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from db_management.genres import GenreClassifier
+
+
+
+# --- ANALYSIS FRAME ---
+#
+# The derived columns the notebooks recompute row by row on every run, cached per song:
+#
+#   song_analysis      release_year and weekday (0 = Sunday, like strftime('%w') in aggregates.py) of the
+#                      mixed-precision release_date ("1975", "1975-06", "1975-06-13" - only full dates
+#                      get a weekday), duration_s, the <feature>_level buckets of LEVELS and the parent
+#                      genre of the artist genres (GenreClassifier)
+#   lyrics_languages   language of the lyrics (stopword profiles of LANGUAGES), None when undecided
+#
+# Both are computed with numpy / pandas over chunks: the date parsing runs once per distinct
+# release_date, the genre classification once per distinct genres string. refresh_analysis recomputes
+# only the songs whose songs / songs_features / artists rows changed since the previous refresh
+# (data_changes), and detects the language of the new or changed lyrics only, in a process pool.
+# A change of LEVELS, of the genre map or of LANGUAGES rebuilds the table concerned.
+#
+# build_analysis_frame = get_data_full joined with both tables in SQL.
+
+
+LEVELS = {
+    "energy": ((0.0, 1 / 3, 2 / 3, 1.0), ("low", "medium", "high")),
+    "valence": ((0.0, 1 / 3, 2 / 3, 1.0), ("low", "medium", "high")),
+    "danceability": ((0.0, 1 / 3, 2 / 3, 1.0), ("low", "medium", "high")),
+    "tempo": ((0.0, 90.0, 120.0, 150.0, np.inf), ("slow", "moderate", "fast", "very fast")),
+    "loudness": ((-np.inf, -15.0, -8.0, np.inf), ("quiet", "moderate", "loud")),
+}
+
+# the most frequent function words of every language, lyrics are given the language with the most hits
+LANGUAGES = {
+    "en": "the and you to it is in my me of that on your all be for this so we but what don't can just i'm it's with",
+    "es": "que de la el y en no me mi te lo es tu por un una con se los las pero yo para como más",
+    "pt": "que de não o a e é eu você do da em um uma com meu se mais pra por os as te",
+    "fr": "je de la le et les tu pas que un une des est en il qui ne moi dans pour sur mon toi",
+    "de": "ich und die der nicht du das ist zu ein es mich mir dich in wir sie auf mit den so eine",
+    "it": "che di e il la non mi ti è un per una io con tu sei le ma come se ho nel",
+    "pl": "nie się w i na to jest z że co jak mnie ja do ty mi tak za już po czy",
+    "sv": "jag och det att du en är som på inte för med mig har vi i av till den",
+}
+MIN_LANGUAGE_HITS = 5
+MIN_LANGUAGE_SHARE = 0.15
+
+STOPWORDS = {language: set(words.split()) for language, words in LANGUAGES.items()}
+# punctuation (apostrophes kept, "’" normalized) -> spaces, then str.split: ~3x faster than a word regex
+PUNCTUATION = str.maketrans({**{char: " " for char in string.punctuation.replace("'", "")}, "’": "'"})
+SAMPLE = 3000               # characters of the lyrics read, plenty to tell the language
+
+SEQ_STATE = "analysis_seq"
+VERSION_STATE = "analysis_version"
+LANGUAGE_SEQ_STATE = "lyrics_languages_seq"
+LANGUAGE_VERSION_STATE = "lyrics_languages_version"
+LANGUAGE_VERSION = hashlib.sha1(json.dumps(LANGUAGES, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+LEVEL_COLUMNS = tuple(f"{feature}_level" for feature in LEVELS)
+ANALYSIS_COLUMNS = ("release_year", "weekday", "duration_s") + LEVEL_COLUMNS + ("parent_genre",)
+CHUNK = 50000
+LANGUAGE_BATCH = 2000       # lyrics per process pool task
+IN_CLAUSE = 500
+
+
+
+def analysis_version(classifier: GenreClassifier) -> str:
+    levels = {feature: ([float(bound) for bound in bounds], labels) for feature, (bounds, labels) in LEVELS.items()}
+    return hashlib.sha1(json.dumps([levels, classifier.version], sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def detect_language(text: str):
+    """
+    Language code of LANGUAGES, None for empty lyrics or when no profile is clear enough.
+    """
+    if not text:
+        return None
+    words = text[:SAMPLE].casefold().translate(PUNCTUATION).split()
+    if not words:
+        return None
+    counts = Counter(words)
+    hits = {language: sum(counts[word] for word in stopwords if word in counts) for language, stopwords in STOPWORDS.items()}
+    language = max(hits, key=hits.get)
+    if hits[language] < MIN_LANGUAGE_HITS or hits[language] < MIN_LANGUAGE_SHARE * len(words):
+        return None
+    return language
+
+
+def detect_languages(texts: list) -> list:
+    return [detect_language(text) for text in texts]
+
+
+
+# ================== DERIVED COLUMNS ==================
+
+def parse_release_dates(dates: pd.Series) -> tuple:
+    """
+    (release_year, weekday) arrays of the release_date strings, NaN when unknown. Every distinct
+    date is parsed once.
+    """
+    codes, uniques = pd.factorize(dates)
+    uniques = pd.Series(uniques, dtype=object)
+    years = pd.to_numeric(uniques.str.slice(0, 4), errors="coerce").to_numpy(dtype=np.float64)
+    full = pd.to_datetime(uniques.where(uniques.str.len() == 10), format="%Y-%m-%d", errors="coerce")
+    weekdays = ((full.dt.dayofweek + 1) % 7).to_numpy(dtype=np.float64)
+    # -1 in codes (missing release_date) picks the appended NaN
+    years, weekdays = np.append(years, np.nan), np.append(weekdays, np.nan)
+    return years[codes], weekdays[codes]
+
+
+def level(values: np.ndarray, feature: str) -> np.ndarray:
+    """
+    LEVELS label of every value of the feature, None for missing values.
+    """
+    bounds, labels = LEVELS[feature]
+    values = np.asarray(values, dtype=np.float64)
+    positions = np.clip(np.searchsorted(bounds, values, side="right") - 1, 0, len(labels) - 1)
+    return np.where(np.isnan(values), None, np.array(labels, dtype=object)[positions])
+
+
+def derive(songs: pd.DataFrame, classifier: GenreClassifier) -> pd.DataFrame:
+    """
+    ANALYSIS_COLUMNS of songs (song_id, release_date, duration_ms, the LEVELS features, artist_genres).
+    """
+    years, weekdays = parse_release_dates(songs["release_date"])
+    result = pd.DataFrame({"song_id": songs["song_id"].to_numpy(), "release_year": years, "weekday": weekdays,
+                           "duration_s": songs["duration_ms"].to_numpy(dtype=np.float64) / 1000})
+    for feature, column in zip(LEVELS, LEVEL_COLUMNS):
+        result[column] = level(songs[feature].to_numpy(dtype=np.float64), feature)
+    result["parent_genre"] = classifier.classify_series(songs["artist_genres"]).astype(object).to_numpy()
+    return result
+
+
+
+# ================== REFRESH ==================
+
+SOURCE_QUERY = f"""SELECT s.song_spotify_id, s.release_date, f.duration_ms, {", ".join("f." + feature for feature in LEVELS)}, a.genres
+                   FROM songs s
+                   LEFT JOIN songs_features f ON s.song_spotify_id = f.song_spotify_id
+                   LEFT JOIN artists a ON s.artist_spotify_id = a.artist_spotify_id"""
+SOURCE_COLUMNS = ["song_id", "release_date", "duration_ms"] + list(LEVELS) + ["artist_genres"]
+
+
+def _get_state(db, name: str):
+    row = db.conn.execute("SELECT value FROM analytics_state WHERE name = ?", (name,)).fetchone()
+    return None if row is None else row[0]
+
+
+def _set_state(db, name: str, value) -> None:
+    db.conn.execute("INSERT OR REPLACE INTO analytics_state (name, value) VALUES (?, ?)", (name, value))
+
+
+def _changed(db, query: str, since: int, until: int) -> list:
+    return [row[0] for row in db.conn.execute(query, (since, until))]
+
+
+def _in_chunks(song_ids: list):
+    for idx in range(0, len(song_ids), IN_CLAUSE):
+        chunk = song_ids[idx:idx + IN_CLAUSE]
+        yield chunk, ", ".join("?" * len(chunk))
+
+
+def _source_chunks(db, song_ids: list = None):
+    if song_ids is None:
+        cursor = db.conn.execute(SOURCE_QUERY + " ORDER BY s.rowid")
+        for rows in iter(lambda: cursor.fetchmany(CHUNK), []):
+            yield pd.DataFrame.from_records(rows, columns=SOURCE_COLUMNS)
+        return
+    rows = []
+    for chunk, marks in _in_chunks(song_ids):
+        rows.extend(db.conn.execute(f"{SOURCE_QUERY} WHERE s.song_spotify_id IN ({marks})", chunk).fetchall())
+        if len(rows) >= CHUNK:
+            yield pd.DataFrame.from_records(rows, columns=SOURCE_COLUMNS)
+            rows = []
+    if rows:
+        yield pd.DataFrame.from_records(rows, columns=SOURCE_COLUMNS)
+
+
+def _write(db, derived: pd.DataFrame) -> None:
+    # NaN floats are stored as NULL by SQLite, the integer columns need None
+    columns = [derived["song_id"].tolist()]
+    for column in ANALYSIS_COLUMNS:
+        values = derived[column].tolist()
+        if column in ("release_year", "weekday"):
+            values = [None if value != value else int(value) for value in values]
+        columns.append(values)
+    db.conn.executemany(f"""INSERT OR REPLACE INTO song_analysis (song_spotify_id, {", ".join(ANALYSIS_COLUMNS)})
+                            VALUES (?, {", ".join("?" * len(ANALYSIS_COLUMNS))})""", zip(*columns))
+
+
+def refresh_song_analysis(db, classifier: GenreClassifier = None) -> int:
+    """
+    Recomputes the song_analysis rows of the songs changed since the previous refresh (all of them
+    the first time, or when LEVELS / the genre map changed). Returns the number of rows written.
+    """
+    classifier = classifier if classifier is not None else GenreClassifier(db=db)
+    version = analysis_version(classifier)
+    last_change = db.last_change()
+    since = _get_state(db, SEQ_STATE)
+    if since is None or _get_state(db, VERSION_STATE) != version or not db.changes_available(since):
+        db.conn.execute("DELETE FROM song_analysis")
+        song_ids = None
+    else:
+        # songs whose own rows changed, and the songs of the changed artists (their parent genre)
+        song_ids = set(_changed(db, """SELECT DISTINCT entity_id FROM data_changes
+                                       WHERE table_name IN ('songs', 'songs_features') AND seq > ? AND seq <= ?""", since, last_change))
+        song_ids.update(_changed(db, """SELECT DISTINCT s.song_spotify_id FROM data_changes c JOIN songs s ON s.artist_spotify_id = c.entity_id
+                                        WHERE c.table_name = 'artists' AND c.seq > ? AND c.seq <= ?""", since, last_change))
+        song_ids = sorted(song_ids)
+        for chunk, marks in _in_chunks(song_ids):
+            db.conn.execute(f"DELETE FROM song_analysis WHERE song_spotify_id IN ({marks})", chunk)
+
+    written = 0
+    for songs in _source_chunks(db, song_ids):
+        _write(db, derive(songs, classifier))
+        written += len(songs)
+    _set_state(db, SEQ_STATE, last_change)
+    _set_state(db, VERSION_STATE, version)
+    db.conn.commit()
+    return written
+
+
+def refresh_lyrics_languages(db, processes: int = None) -> int:
+    """
+    Detects the language of the lyrics added or changed since the previous refresh (all of them the
+    first time, or when LANGUAGES changed), in a process pool. Returns the number of lyrics processed.
+    """
+    last_change = db.last_change()
+    since = _get_state(db, LANGUAGE_SEQ_STATE)
+    if since is None or _get_state(db, LANGUAGE_VERSION_STATE) != LANGUAGE_VERSION or not db.changes_available(since):
+        db.conn.execute("DELETE FROM lyrics_languages")
+        cursor = db.conn.execute("SELECT song_spotify_id, lyrics FROM lyrics ORDER BY rowid")
+        chunks = iter(lambda: cursor.fetchmany(CHUNK), [])
+    else:
+        song_ids = _changed(db, """SELECT DISTINCT entity_id FROM data_changes
+                                   WHERE table_name = 'lyrics' AND seq > ? AND seq <= ?""", since, last_change)
+        for chunk, marks in _in_chunks(song_ids):
+            db.conn.execute(f"DELETE FROM lyrics_languages WHERE song_spotify_id IN ({marks})", chunk)
+        chunks = (db.conn.execute(f"SELECT song_spotify_id, lyrics FROM lyrics WHERE song_spotify_id IN ({marks})", chunk).fetchall()
+                  for chunk, marks in _in_chunks(song_ids))
+
+    processed = 0
+    executor = None
+    try:
+        for rows in chunks:
+            if not rows:
+                continue
+            texts = [db.decode_lyrics(lyrics) for _, lyrics in rows]
+            batches = [texts[idx:idx + LANGUAGE_BATCH] for idx in range(0, len(texts), LANGUAGE_BATCH)]
+            if len(batches) > 1 and (processes or os.cpu_count()) > 1:
+                # the pool is only started once there is more than one batch to spread
+                executor = executor or ProcessPoolExecutor(processes)
+                languages = [language for batch in executor.map(detect_languages, batches) for language in batch]
+            else:
+                languages = [language for batch in batches for language in detect_languages(batch)]
+            db.conn.executemany("INSERT OR REPLACE INTO lyrics_languages (song_spotify_id, language) VALUES (?, ?)",
+                                ((song_id, language) for (song_id, _), language in zip(rows, languages)))
+            processed += len(rows)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    _set_state(db, LANGUAGE_SEQ_STATE, last_change)
+    _set_state(db, LANGUAGE_VERSION_STATE, LANGUAGE_VERSION)
+    db.conn.commit()
+    return processed
+
+
+def refresh_analysis(db, classifier: GenreClassifier = None, processes: int = None) -> dict:
+    counts = {"songs": refresh_song_analysis(db, classifier), "lyrics": refresh_lyrics_languages(db, processes)}
+    db.prune_changes()
+    return counts
+
+
+
+# ================== FRAME ==================
+
+def _dtypes(classifier: GenreClassifier) -> dict:
+    dtypes = {"release_year": "Int16", "weekday": "Int8", "duration_s": "float32",
+              "parent_genre": pd.CategoricalDtype(classifier.categories),
+              "lyrics_language": pd.CategoricalDtype(sorted(LANGUAGES))}
+    dtypes.update({column: pd.CategoricalDtype(labels, ordered=True) for column, (_, labels) in zip(LEVEL_COLUMNS, LEVELS.values())})
+    return dtypes
+
+
+def _typed(data: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+    return data.astype({column: dtype for column, dtype in dtypes.items() if column in data.columns})
+
+
+def build_analysis_frame(db, chunksize: int = None, lyrics: bool = False, collapse_duplicates: bool = False,
+                         refresh: bool = True, classifier: GenreClassifier = None, processes: int = None):
+    """
+    get_data_full with the song_analysis and lyrics_language columns, refreshed first unless refresh=False.
+    With chunksize, a generator of DataFrames like get_data.
+    """
+    classifier = classifier if classifier is not None else GenreClassifier(db=db)
+    if refresh:
+        refresh_analysis(db, classifier, processes)
+    dtypes = _dtypes(classifier)
+    query = f"""SELECT d.*, {", ".join("an." + column for column in ANALYSIS_COLUMNS)}, ll.language AS lyrics_language
+                FROM ({db._data_query(True, lyrics, where=db.DUPLICATE_FILTER if collapse_duplicates else "").strip().rstrip(";")}) d
+                LEFT JOIN song_analysis an ON an.song_spotify_id = d.song_id
+                LEFT JOIN lyrics_languages ll ON ll.song_spotify_id = d.song_id"""
+    if chunksize is not None:
+        if chunksize < 1:
+            raise ValueError("chunksize must be a positive integer.")
+        return (_typed(chunk, dtypes) for chunk in db._data_chunks(query, chunksize))
+    cursor = db.conn.execute(query)
+    data = pd.DataFrame(cursor.fetchall(), columns=[description[0] for description in cursor.description])
+    return _typed(db._decode_lyrics_column(data).astype({column: dtype for column, dtype in db.DATA_DTYPES.items() if column in data.columns}), dtypes)
@@ -0,0 +1,187 @@
+import hashlib
+import sqlite3
+import threading
+import zlib
+from time import time
+from urllib.parse import urlencode, urlparse
+
+
+
+# --- HTTP RESPONSE CACHE ---
+#
+# On-disk cache of API answers in its own SQLite file (the workers write it concurrently with the
+# songs.db writer, so it is kept out of that database). Keys are hashes of the normalized request,
+# bodies are zlib-compressed. Entries expire per endpoint and the least recently used ones are
+# evicted once the cache grows past max_bytes. With offline=True the API clients never go to the
+# network, so a warm cache replays a whole ingestion (and serves as a fixture source).
+# The total size of the bodies is kept in the file (cache_size, maintained by triggers), so every
+# process sharing the cache evicts against the same, current total.
+
+
+# part of the request URL -> seconds to live, None = never expires. The longest matching pattern wins.
+DEFAULT_TTLS = {
+    "/tracks": 24 * 3600,               # popularity refresh
+    "/artists": 7 * 24 * 3600,          # popularity, followers
+    "/albums": 30 * 24 * 3600,
+    "/search": 30 * 24 * 3600,          # Spotify and Genius search
+    "/audio-features": None,
+    "-lyrics": None,                    # Genius lyrics pages
+}
+
+
+
+class ResponseCache:
+
+    def __init__(self, path: str = "db_management/data/http_cache.db", max_bytes: int = 2 * 1024 ** 3,
+                 ttls: dict = None, default_ttl: float = 7 * 24 * 3600, offline: bool = False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.default_ttl = default_ttl
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode = WAL;")
+        self.conn.execute("PRAGMA synchronous = NORMAL;")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                             key TEXT PRIMARY KEY,
+                             endpoint TEXT,
+                             body BLOB,
+                             size INTEGER,
+                             expires_at REAL,
+                             accessed_at REAL);
+                            """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed_at);")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS cache_size (
+                             id INTEGER PRIMARY KEY CHECK (id = 0),
+                             bytes INTEGER NOT NULL);
+                            """)
+        self.conn.execute("INSERT OR IGNORE INTO cache_size (id, bytes) SELECT 0, COALESCE(SUM(size), 0) FROM responses;")
+        for event, change in (("INSERT", "NEW.size"), ("UPDATE", "NEW.size - OLD.size"), ("DELETE", "-OLD.size")):
+            self.conn.execute(f"""CREATE TRIGGER IF NOT EXISTS responses_size_{event.lower()} AFTER {event} ON responses
+                                  BEGIN UPDATE cache_size SET bytes = bytes + {change}; END;""")
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+
+    @staticmethod
+    def key(url: str, params: dict = None) -> str:
+        """
+        Hash of the normalized request: sorted parameters, collapsed whitespace, case-folded search query.
+        Headers (the auth token) are not part of the key.
+        """
+        normalized = {}
+        for name, value in (params or {}).items():
+            value = " ".join(str(value).split())
+            normalized[name] = value.casefold() if name == "q" else value
+        request = url.rstrip("/") + "?" + urlencode(sorted(normalized.items()))
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+
+    @property
+    def size(self) -> int:
+        """
+        Total size of the stored (compressed) bodies, including the ones written by other processes.
+        """
+        return self.conn.execute("SELECT bytes FROM cache_size").fetchone()[0]
+
+
+    def ttl(self, url: str):
+        matches = [pattern for pattern in self.ttls if pattern in url]
+        return self.ttls[max(matches, key=len)] if matches else self.default_ttl
+
+
+    def get(self, key: str):
+        """
+        Cached body (str) or None on a miss / expired entry.
+        """
+        return self.get_many([key]).get(key)
+
+
+    def get_many(self, keys: list) -> dict:
+        """
+        {key: body} of the keys that are cached and not expired, in one query and one commit.
+        """
+        now = time()
+        found = {}
+        with self.lock:
+            for idx in range(0, len(keys), 500):
+                chunk = keys[idx:idx + 500]
+                cursor = self.conn.execute(f"SELECT key, body, expires_at FROM responses WHERE key IN ({', '.join('?' * len(chunk))})", chunk)
+                for key, body, expires_at in cursor:
+                    if expires_at is not None and expires_at < now:
+                        self.expired += 1
+                    else:
+                        found[key] = body
+            if found:
+                self.conn.executemany("UPDATE responses SET accessed_at = ? WHERE key = ?", ((now, key) for key in found))
+                self.conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return {key: zlib.decompress(body).decode("utf-8") for key, body in found.items()}
+
+
+    def put(self, key: str, url: str, body: str) -> None:
+        self.put_many([(key, url, body)])
+
+
+    def put_many(self, items: list) -> None:
+        """
+        Stores (key, url, body) items, the TTL comes from url.
+        """
+        now = time()
+        rows = []
+        for key, url, body in items:
+            endpoint = urlparse(url).path
+            ttl = self.ttl(url)
+            rows.append((key, endpoint, zlib.compress(body.encode("utf-8")), None if ttl is None else now + ttl, now))
+        with self.lock:
+            # an upsert rather than INSERT OR REPLACE: the replaced row fires the UPDATE trigger of cache_size
+            self.conn.executemany("""INSERT INTO responses (key, endpoint, body, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)
+                                     ON CONFLICT (key) DO UPDATE SET endpoint = excluded.endpoint, body = excluded.body, size = excluded.size,
+                                     expires_at = excluded.expires_at, accessed_at = excluded.accessed_at""",
+                                  ((key, endpoint, data, len(data), expires_at, accessed_at) for key, endpoint, data, expires_at, accessed_at in rows))
+            # read inside the write transaction, so the writes of the other processes are counted
+            size = self.size
+            if size > self.max_bytes:
+                self._evict(size)
+            self.conn.commit()
+
+
+    def _evict(self, size: int) -> None:
+        # least recently used first, down to 90% of the cap so eviction does not run on every put
+        target = self.max_bytes * 0.9
+        while size > target:
+            rows = self.conn.execute("SELECT key, size FROM responses ORDER BY accessed_at LIMIT 256").fetchall()
+            if not rows:
+                return
+            for key, row_size in rows:
+                if size <= target:
+                    break
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                size -= row_size
+                self.evictions += 1
+
+
+    def purge_expired(self) -> int:
+        now = time()
+        with self.lock:
+            removed = self.conn.execute("DELETE FROM responses WHERE expires_at < ?", (now,)).rowcount
+            self.conn.commit()
+        return removed
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            size = self.size
+        lookups = self.hits + self.misses
+        return {"entries": entries, "bytes": size, "hits": self.hits, "misses": self.misses,
+                "expired": self.expired, "evictions": self.evictions, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+    def close(self) -> None:
+        self.conn.close()
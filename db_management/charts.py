@@ -0,0 +1,192 @@
+import html
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
+from time import monotonic, time
+
+from db_management.db import SongsDB
+from db_management.pipeline import APIClient, RateLimiter
+
+
+
+# --- CHART STAGE ---
+#
+# Replaces generate_dates / retrieve_top_songs of dataset-creator.ipynb: the weekly Official Charts
+# singles pages are fetched on `workers` threads, parsed with regexes instead of BeautifulSoup and
+# stored per week in chart_weeks / chart_positions. A later run fetches only the weeks it has not
+# stored yet, and revalidates the recent ones with conditional requests (If-None-Match / If-Modified-Since),
+# so an unchanged chart costs a 304 and no parsing.
+
+
+OFFICIAL_CHARTS = "https://www.officialcharts.com"
+CHART_PATH = "/charts/singles-chart/%s/7501/"
+CHART_WEEKDAY = 4       # weeks are keyed by their Friday, the day the chart is published
+WEEK_FORMAT = "%Y%m%d"
+
+ITEM_START = re.compile(r'<div\b[^>]*\bclass="(?:[^"]*\s)?chart-item(?=[\s"])')
+CHART_LINK = re.compile(r'<a\b[^>]*\bclass="(?:[^"]*\s)?chart-(name|artist)(?=[\s"])[^>]*>(.*?)</a>', re.S)
+SPAN = re.compile(r"<span\b([^>]*)>(.*?)</span>", re.S)
+SPAN_CLASS = re.compile(r'\bclass="\s*[^"\s]')
+TAG = re.compile(r"<[^>]+>")
+
+
+
+class ChartClient(APIClient):
+
+    def __init__(self, base_url: str = OFFICIAL_CHARTS, **kwargs):
+        kwargs.setdefault("limiter", RateLimiter(5))
+        super().__init__(base_url, **kwargs)
+
+
+    def get_week(self, week: str, etag: str = None, last_modified: str = None) -> tuple:
+        """
+        (html, etag, last_modified) of a chart week, html is None when the page did not change
+        since the validators of the previous fetch.
+        """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        path = CHART_PATH % week
+        response = self._response(self.base_url + path, path, headers=headers)
+        if response.status_code == 304:
+            return None, etag, last_modified
+        return response.text, response.headers.get("ETag"), response.headers.get("Last-Modified")
+
+
+
+def _span_text(link: str) -> str:
+    # text of the first <span> without a class, like find("span", {"class": None}) of the notebook
+    for attrs, text in SPAN.findall(link):
+        if not SPAN_CLASS.search(attrs):
+            return " ".join(html.unescape(TAG.sub("", text)).split())
+    return ""
+
+
+def parse_chart(page: str) -> list:
+    """
+    (title, artist) of every div.chart-item of a chart page in chart order. Items without a title or
+    an artist (ads, placeholders) are skipped, as the notebook did. The page is cut at the item starts
+    with a regex search, only the chart-name / chart-artist links of each item are read.
+    """
+    starts = [match.start() for match in ITEM_START.finditer(page)] + [len(page)]
+    entries = []
+    for start, end in zip(starts, starts[1:]):
+        names = {}
+        for kind, link in CHART_LINK.findall(page, start, end):
+            names.setdefault(kind, _span_text(link))
+        if names.get("name") and names.get("artist"):
+            entries.append((names["name"], names["artist"]))
+    return entries
+
+
+def week_dates(start: date, end: date) -> list:
+    """
+    Chart weeks ("%Y%m%d" of their Friday) from start to end. Unlike generate_dates of the notebook the
+    weeks do not depend on the day of the run, so they can be compared with the stored ones.
+    """
+    first = start + timedelta(days=(CHART_WEEKDAY - start.weekday()) % 7)
+    return [(first + timedelta(days=7 * idx)).strftime(WEEK_FORMAT) for idx in range((end - first).days // 7 + 1)]
+
+
+
+class ChartScraper:
+    """
+    Fetches the chart weeks of a date range that are not stored yet (and revalidates the ones from the
+    last `refresh_days`, or every stored week with revalidate=True) on `workers` threads. Each week is
+    written on the calling thread: its positions, its validators, and its songs into scraped_songs,
+    where the new ones get "search" jobs once that stage is seeded. Failed weeks are left unstored,
+    the next run fetches them again.
+    """
+
+    def __init__(self, db_path: str, client: ChartClient = None, workers: int = 8, refresh_days: int = 14,
+                 commit_every: int = 50):
+        self.db_path = db_path
+        self.client = client if client is not None else ChartClient()
+        self.workers = workers
+        self.refresh_days = refresh_days
+        self.commit_every = commit_every
+
+
+    def run(self, start: date = None, end: date = None, revalidate: bool = False) -> dict:
+        """
+        Over the weeks from start (default: 60 years before end) to end (default: today).
+        Returns the run statistics.
+        """
+        end = end or date.today()
+        start = start or end - timedelta(days=365 * 60)
+        stats = {"weeks": 0, "fetched": 0, "not_modified": 0, "empty": 0, "failed": 0, "errors": [],
+                 "entries": 0, "new_songs": 0, "requests": 0, "seconds": 0.0}
+        requests_before = self.client.requests_count
+        begin = monotonic()
+        db = SongsDB(self.db_path)
+        try:
+            weeks = self._pending(db, week_dates(start, end), end, revalidate)
+            stats["weeks"] = len(weeks)
+            last_song = db.conn.execute("SELECT COALESCE(MAX(id), 0) FROM scraped_songs").fetchone()[0]
+            with ThreadPoolExecutor(self.workers) as fetchers:
+                fetches = {fetchers.submit(self._fetch_week, week, *validators): week for week, validators in weeks.items()}
+                for done, future in enumerate(as_completed(fetches), 1):
+                    try:
+                        entries, etag, last_modified = future.result()
+                    except Exception as exception:
+                        stats["failed"] += 1
+                        stats["errors"].append((fetches[future], repr(exception)))
+                        continue
+                    self._write_week(db, fetches[future], entries, etag, last_modified, stats)
+                    if done % self.commit_every == 0:
+                        db.conn.commit()
+            db.conn.commit()
+            stats["new_songs"] = self._enqueue_new_songs(db, last_song)
+        finally:
+            db.close_connection()
+        stats["requests"] = self.client.requests_count - requests_before
+        stats["seconds"] = monotonic() - begin
+        return stats
+
+
+    def _pending(self, db: SongsDB, weeks: list, end: date, revalidate: bool) -> dict:
+        # week -> (etag, last_modified) of the weeks to fetch, (None, None) for the ones not stored yet.
+        # Weeks stored without entries (not published yet at the time) are fetched again as well
+        recent = (end - timedelta(days=self.refresh_days)).strftime(WEEK_FORMAT)
+        stored = {week: (entries, etag, last_modified) for week, entries, etag, last_modified
+                  in db.conn.execute("SELECT week, entries, etag, last_modified FROM chart_weeks")}
+        pending = {}
+        for week in weeks:
+            if week not in stored:
+                pending[week] = (None, None)
+            elif revalidate or week >= recent or not stored[week][0]:
+                pending[week] = stored[week][1:]
+        return pending
+
+
+    def _fetch_week(self, week: str, etag: str = None, last_modified: str = None) -> tuple:
+        page, etag, last_modified = self.client.get_week(week, etag, last_modified)
+        return (None if page is None else parse_chart(page)), etag, last_modified
+
+
+    @staticmethod
+    def _write_week(db: SongsDB, week: str, entries: list, etag: str, last_modified: str, stats: dict) -> None:
+        if entries is None:
+            stats["not_modified"] += 1
+            db.conn.execute("UPDATE chart_weeks SET fetched_at = ? WHERE week = ?", (time(), week))
+            return
+        stats["fetched"] += 1
+        stats["entries"] += len(entries)
+        stats["empty"] += not entries
+        db.conn.execute("DELETE FROM chart_positions WHERE week = ?", (week,))
+        db.conn.executemany("INSERT INTO chart_positions (week, position, title, artist) VALUES (?, ?, ?, ?)",
+                            ((week, position, title, artist) for position, (title, artist) in enumerate(entries, 1)))
+        db.conn.execute("INSERT OR REPLACE INTO chart_weeks (week, entries, etag, last_modified, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                        (week, len(entries), etag, last_modified, time()))
+        db.conn.executemany("INSERT OR IGNORE INTO scraped_songs (title, artist) VALUES (?, ?)", entries)
+
+
+    @staticmethod
+    def _enqueue_new_songs(db: SongsDB, last_song: int) -> int:
+        new_songs = [row[0] for row in db.conn.execute("SELECT id FROM scraped_songs WHERE id > ?", (last_song,))]
+        # before the seeding, seed_jobs("search") picks them up with the rest of scraped_songs
+        if new_songs and db.jobs_seeded("search"):
+            db.enqueue_jobs("search", new_songs)
+        return len(new_songs)
@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from time import time
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import IncrementalPCA
+from sklearn.preprocessing import StandardScaler
+
+from db_management.db import SongsDB
+
+
+
+# --- OUT-OF-CORE CLUSTERING OF THE AUDIO FEATURES ---
+#
+# Every pass streams songs_features in chunks of `chunksize` rows, so the memory stays bounded by the
+# chunk size whatever the number of songs:
+#
+#   pass 1      StandardScaler.partial_fit
+#   pass 2..    IncrementalPCA (3 components, for the plots) and MiniBatchKMeans on the standardized features,
+#               every epoch over the chunks in a new random order (rowid order follows the ingestion)
+#   assign      cluster + PCA coordinates of every song into song_clusters
+#
+# A fitted model is stored in cluster_models, so later songs are assigned without refitting
+# (assign() only processes the songs_features changed since its previous run). Saving a model drops
+# the ones saved before, unless replace=False: every stored model keeps its change log marker.
+
+
+PCA_COMPONENTS = 3
+MINI_BATCH = 4096
+STATE = "clusters_seq:"     # analytics_state: last data_changes.seq assigned, per model
+
+
+
+class SongClusterer:
+    """
+    StandardScaler + IncrementalPCA + MiniBatchKMeans fitted chunk by chunk over songs_features.
+    """
+
+    def __init__(self, db_path: str, n_clusters: int = 5, features: tuple = SongsDB.AUDIO_FEATURES,
+                 chunksize: int = 50000, epochs: int = 5, random_state: int = 42):
+        self.db_path = db_path
+        self.n_clusters = n_clusters
+        self.features = tuple(features)
+        self.chunksize = chunksize
+        self.epochs = epochs
+        self.random_state = random_state
+        self.scaler = None
+        self.pca = None
+        self.kmeans = None
+
+
+    @property
+    def model_id(self) -> str:
+        params = {"n_clusters": self.n_clusters, "features": self.features, "epochs": self.epochs, "random_state": self.random_state}
+        return hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+    def _chunks(self, db: SongsDB, epoch: int = None):
+        if epoch is None:
+            return db.get_features_chunks(self.features, self.chunksize)
+        seed = None if self.random_state is None else self.random_state + epoch
+        return db.get_features_chunks(self.features, self.chunksize, shuffle=True, seed=seed)
+
+
+    def fit_scaler(self) -> "SongClusterer":
+        db = SongsDB(self.db_path)
+        try:
+            self.scaler = StandardScaler()
+            for _, data in self._chunks(db):
+                self.scaler.partial_fit(data)
+        finally:
+            db.close_connection()
+        if not hasattr(self.scaler, "mean_"):
+            raise ValueError("songs_features has no complete rows to cluster.")
+        return self
+
+
+    def fit(self, pca: bool = True) -> "SongClusterer":
+        """
+        Fits the scaler (unless already fitted), then the PCA together with the first KMeans epoch.
+        """
+        if self.scaler is None:
+            self.fit_scaler()
+        self.pca = IncrementalPCA(n_components=min(PCA_COMPONENTS, len(self.features))) if pca else None
+        self.kmeans = MiniBatchKMeans(n_clusters=self.n_clusters, batch_size=MINI_BATCH, n_init=3, random_state=self.random_state)
+
+        db = SongsDB(self.db_path)
+        try:
+            for epoch in range(self.epochs):
+                for _, data in self._chunks(db, epoch):
+                    scaled = self.scaler.transform(data)
+                    if epoch == 0 and self.pca is not None and len(scaled) >= self.pca.n_components:
+                        self.pca.partial_fit(scaled)
+                    for idx in range(0, len(scaled), MINI_BATCH):
+                        batch = scaled[idx:idx + MINI_BATCH]
+                        # the first call initializes the centers, it needs at least n_clusters rows
+                        if len(batch) >= self.n_clusters or hasattr(self.kmeans, "cluster_centers_"):
+                            self.kmeans.partial_fit(batch)
+        finally:
+            db.close_connection()
+        return self
+
+
+    def inertia(self) -> float:
+        """
+        Sum of the squared distances of every song to its center, computed chunk by chunk.
+        """
+        db = SongsDB(self.db_path)
+        try:
+            return float(sum(-self.kmeans.score(self.scaler.transform(data)) for _, data in self._chunks(db)))
+        finally:
+            db.close_connection()
+
+
+    def predict(self, data: np.ndarray) -> tuple:
+        """
+        (clusters, PCA coordinates) of raw feature rows.
+        """
+        scaled = self.scaler.transform(np.asarray(data, dtype=np.float64))
+        coordinates = self.pca.transform(scaled) if self.pca is not None else np.full((len(scaled), 0), np.nan)
+        return self.kmeans.predict(scaled), coordinates
+
+
+    # ================== PERSISTENCE ==================
+
+    def save(self, replace: bool = True) -> str:
+        """
+        Stores the model, dropping the models saved before (their assignments and change log markers)
+        unless replace=False. Returns its model_id.
+        """
+        db = SongsDB(self.db_path)
+        try:
+            db.conn.execute("INSERT OR REPLACE INTO cluster_models (model_id, n_clusters, features, model, created_at) VALUES (?, ?, ?, ?, ?)",
+                            (self.model_id, self.n_clusters, ",".join(self.features),
+                             pickle.dumps({"epochs": self.epochs, "random_state": self.random_state, "chunksize": self.chunksize,
+                                           "scaler": self.scaler, "pca": self.pca, "kmeans": self.kmeans}), time()))
+            # a refitted model reassigns every song
+            db.conn.execute("DELETE FROM song_clusters WHERE model_id = ?", (self.model_id,))
+            db.conn.execute("DELETE FROM analytics_state WHERE name = ?", (STATE + self.model_id,))
+            if replace:
+                superseded = db.conn.execute("SELECT model_id FROM cluster_models WHERE model_id != ?", (self.model_id,)).fetchall()
+                for (model_id,) in superseded:
+                    _drop_model(db, model_id)
+            db.conn.commit()
+        finally:
+            db.close_connection()
+        return self.model_id
+
+
+    @staticmethod
+    def drop_model(db_path: str, model_id: str) -> None:
+        """
+        Deletes a stored model with its assignments. Its change log marker goes as well, so it no
+        longer holds data_changes back.
+        """
+        db = SongsDB(db_path)
+        try:
+            _drop_model(db, model_id)
+            db.conn.commit()
+            db.prune_changes()
+        finally:
+            db.close_connection()
+
+
+    @classmethod
+    def load(cls, db_path: str, model_id: str) -> "SongClusterer":
+        db = SongsDB(db_path)
+        try:
+            row = db.conn.execute("SELECT n_clusters, features, model FROM cluster_models WHERE model_id = ?", (model_id,)).fetchone()
+        finally:
+            db.close_connection()
+        if row is None:
+            raise ValueError(f"Unknown cluster model '{model_id}'.")
+        model = pickle.loads(row[2])
+        clusterer = cls(db_path, row[0], tuple(row[1].split(",")), model["chunksize"], model["epochs"], model["random_state"])
+        clusterer.scaler, clusterer.pca, clusterer.kmeans = model["scaler"], model["pca"], model["kmeans"]
+        return clusterer
+
+
+    def assign(self, batch_size: int = SongsDB.DEFAULT_BATCH_SIZE) -> int:
+        """
+        Writes the cluster of the songs not assigned yet (all of them after save()) and of the songs whose
+        features changed since the previous assign. Returns the number of songs written.
+        """
+        model_id = self.model_id
+        db = SongsDB(self.db_path)
+        try:
+            last_change = db.last_change()
+            state = db.conn.execute("SELECT value FROM analytics_state WHERE name = ?", (STATE + model_id,)).fetchone()
+            if state is None or not db.changes_available(state[0]):
+                db.conn.execute("DELETE FROM song_clusters WHERE model_id = ?", (model_id,))
+                chunks = self._chunks(db)
+            else:
+                changed = [row[0] for row in db.conn.execute("""SELECT DISTINCT entity_id FROM data_changes
+                                                                 WHERE table_name = 'songs_features' AND seq > ? AND seq <= ?""",
+                                                             (state[0], last_change))]
+                db.conn.executemany("DELETE FROM song_clusters WHERE model_id = ? AND song_spotify_id = ?",
+                                    ((model_id, song_id) for song_id in changed))
+                chunks = db.get_features_chunks(self.features, self.chunksize, changed)
+
+            written = 0
+            for song_ids, data in chunks:
+                clusters, coordinates = self.predict(data)
+                coordinates = np.pad(coordinates, ((0, 0), (0, PCA_COMPONENTS - coordinates.shape[1])), constant_values=np.nan)
+                rows = [(model_id, song_id, int(cluster), *(None if np.isnan(value) else float(value) for value in point))
+                        for song_id, cluster, point in zip(song_ids, clusters, coordinates)]
+                for idx in range(0, len(rows), batch_size):
+                    db.conn.executemany("INSERT OR REPLACE INTO song_clusters (model_id, song_spotify_id, cluster, pc1, pc2, pc3) VALUES (?, ?, ?, ?, ?, ?)",
+                                        rows[idx:idx + batch_size])
+                    db.conn.commit()
+                written += len(rows)
+            db.conn.execute("INSERT OR REPLACE INTO analytics_state (name, value) VALUES (?, ?)", (STATE + model_id, last_change))
+            db.conn.commit()
+            db.prune_changes()
+        finally:
+            db.close_connection()
+        return written
+
+
+
+def _drop_model(db: SongsDB, model_id: str) -> None:
+    db.conn.execute("DELETE FROM cluster_models WHERE model_id = ?", (model_id,))
+    db.conn.execute("DELETE FROM song_clusters WHERE model_id = ?", (model_id,))
+    db.conn.execute("DELETE FROM analytics_state WHERE name = ?", (STATE + model_id,))
+
+
+
+def _elbow_point(clusterer: SongClusterer) -> tuple:
+    clusterer.fit(pca=False)
+    return clusterer.n_clusters, clusterer.inertia()
+
+
+
+def elbow(db_path: str, ks=range(1, 11), processes: int = None, **kwargs) -> dict:
+    """
+    {k: inertia} for the elbow method, one KMeans fit per worker process. The scaler is fitted once
+    and shared, every worker streams the features on its own connection.
+    """
+    scaler = SongClusterer(db_path, **kwargs).fit_scaler().scaler
+    clusterers = []
+    for k in ks:
+        clusterer = SongClusterer(db_path, n_clusters=k, **kwargs)
+        clusterer.scaler = scaler
+        clusterers.append(clusterer)
+    with ProcessPoolExecutor(processes or min(len(clusterers), os.cpu_count())) as executor:
+        return dict(executor.map(_elbow_point, clusterers))
@@ -0,0 +1,89 @@
+import struct
+import zlib
+from collections import Counter
+
+
+
+# --- LYRICS COMPRESSION ---
+#
+# Stored lyrics are raw deflate streams primed with a shared dictionary (zlib zdict) trained on the
+# lyrics already in the database - song texts are short, so most of the gain comes from the dictionary.
+# Layout of a compressed value:  [format byte][dictionary id, uint32][deflate data]
+# Values shorter than MIN_SIZE and legacy rows stay plain TEXT, decode() passes str through.
+
+
+FORMAT = 1
+HEADER = struct.Struct(">BI")
+MIN_SIZE = 64
+DICTIONARY_SIZE = 32 * 1024     # the deflate window, zlib ignores anything older
+
+
+class LyricsCodec:
+    """
+    Compresses / decompresses lyrics with one shared dictionary, dict_id 0 means no dictionary.
+    """
+
+    def __init__(self, zdict: bytes = b"", dict_id: int = 0, level: int = 9):
+        self.zdict = zdict
+        self.dict_id = dict_id
+        self.level = level
+        self.header = HEADER.pack(FORMAT, dict_id)
+
+
+    def encode(self, text: str):
+        if text is None or len(text) < MIN_SIZE:
+            return text
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, zdict=self.zdict) if self.zdict else \
+                     zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        return self.header + compressor.compress(text.encode("utf-8")) + compressor.flush()
+
+
+    def decode(self, value):
+        if not isinstance(value, bytes):
+            return value
+        decompressor = zlib.decompressobj(-15, zdict=self.zdict) if self.zdict else zlib.decompressobj(-15)
+        return (decompressor.decompress(value[HEADER.size:]) + decompressor.flush()).decode("utf-8")
+
+
+
+def dictionary_id(value: bytes) -> int:
+    """
+    Id of the dictionary a compressed value was written with.
+    """
+    format_, dict_id = HEADER.unpack_from(value)
+    if format_ != FORMAT:
+        raise ValueError(f"Unknown lyrics format {format_}.")
+    return dict_id
+
+
+
+def train_dictionary(samples, size: int = DICTIONARY_SIZE) -> bytes:
+    """
+    Builds a zdict from sample lyrics: the lines repeated across the most songs, then the most common words.
+    zlib finds matches closer to the end of the dictionary cheaper, so the most useful strings go last.
+    """
+    lines = Counter()
+    words = Counter()
+    for text in samples:
+        if not text:
+            continue
+        # each song counts once, so a chorus repeated ten times does not outweigh the shared phrases
+        lines.update({line.strip() for line in text.splitlines() if len(line.strip()) > 8})
+        words.update(set(text.split()))
+
+    chosen = []
+    used = 0
+    for line, count in sorted(lines.items(), key=lambda item: item[1] * len(item[0]), reverse=True):
+        if count < 2 or used + len(line) + 1 > size * 3 // 4:
+            continue
+        chosen.append(line)
+        used += len(line.encode("utf-8")) + 1
+    common_words = []
+    for word, count in words.most_common():
+        if count < 2 or used + len(word) + 1 > size:
+            break
+        common_words.append(word)
+        used += len(word.encode("utf-8")) + 1
+
+    # least useful first: the rarer words, then the common words, then the shared lines
+    return ("\n".join(reversed(common_words)) + "\n" + "\n".join(reversed(chosen))).encode("utf-8")[-size:]
@@ -1,40 +1,83 @@
+from __future__ import annotations
+
+import csv
+import io
+import os
+import re
 import sqlite3
-import pandas as pd
+from array import array
+from contextlib import contextmanager
+from time import time
+from typing import TYPE_CHECKING
+
+# pandas is imported by the DataFrame-returning methods only: the ingestion workers use the inserts
+# and the data classes, and importing pandas costs them ~0.5 s and ~80 MB each
+if TYPE_CHECKING:
+    import pandas as pd
+
+from db_management.compression import LyricsCodec, MIN_SIZE, dictionary_id, train_dictionary
 
 
 
 # --- DATA STRUCTURES ---
 
 
+# "(feat. X)", "[ft X]" anywhere, or a trailing "feat. X" / "featuring X" / "ft X"
+FEATURING_BRACKETED = re.compile(r"[(\[]\s*(?:feat\.?|ft\.?|featuring)\s[^)\]]*[)\]]")
+FEATURING_TRAILING = re.compile(r"\s(?:feat\.?|ft\.?|featuring)\s.*$")
+
+
+def normalize_name(text: str) -> str:
+    """
+    Case-folded title / artist name without featured artists and with collapsed whitespace.
+    """
+    text = str(text).casefold()
+    text = FEATURING_TRAILING.sub("", FEATURING_BRACKETED.sub(" ", text))
+    return " ".join(text.split())
+
+
 class SongInfo:
     """
     Scraped song data structure.
     """
 
+    __slots__ = ("artist", "song", "key")
+
     def __init__(self, artist: str, song: str):
         self.artist = artist
         self.song = song
+        self.key = (normalize_name(song), normalize_name(artist))
 
     
     def csv(self) -> str:
         return f"{self.song},{self.artist}"
 
+
+    def row(self) -> tuple:
+        return (self.song, self.artist)
+
     
     def __eq__(self, other) -> bool:
         if isinstance(other, SongInfo):
-            return all([self.artist == other.artist, self.song == other.song])
+            return self.key == other.key
         return False
 
 
+    def __hash__(self) -> int:
+        return hash(self.key)
+
+
 
 class IDSongInfo:
     """
     Main song data structure for the database.
     """
 
+    __slots__ = ("song_id", "album_id", "artist_id", "title", "release_date", "featured", "popularity")
+
     def __init__(self, song_id: str, album_id: str, artist_id: str, title: str,
                  release_date: str, featured: int, popularity: int):
-        if not all([isinstance(song_id, str), isinstance(album_id, str), isinstance(artist_id, str)]):
+        if not (isinstance(song_id, str) and isinstance(album_id, str) and isinstance(artist_id, str)):
             raise ValueError("song_id, album_id and artist_id must be strings.")
         self.song_id = song_id
         self.album_id = album_id
@@ -48,6 +91,10 @@ class IDSongInfo:
     def csv(self) -> str:
         return f"{self.song_id},{self.album_id},{self.artist_id},{self.title},{self.release_date},{self.featured},{self.popularity}"
 
+
+    def row(self) -> tuple:
+        return (self.song_id, self.album_id, self.artist_id, self.title, self.release_date, self.featured, self.popularity)
+
     
     def __eq__(self, other) -> bool:
         if isinstance(other, IDSongInfo):
@@ -62,35 +109,86 @@ class IDSongInfo:
 
 class SongsContainer:
     """
-    Container for the scraped songs.
+    Container for the scraped songs, deduplicated on SongInfo.key in insertion order.
+    Repeated songs (f.ex. the same song in many chart weeks) are counted instead of stored again.
     """
 
     def __init__(self):
         self.songs = []
+        self.counts = {}    # SongInfo.key -> number of times the song was added
 
 
-    def add_song(self, song: SongInfo) -> None:
-        if song not in self.songs and isinstance(song, SongInfo):
+    def add_song(self, song: SongInfo, count: int = 1) -> None:
+        if not isinstance(song, SongInfo):
+            return
+        if song.key in self.counts:
+            self.counts[song.key] += count
+        else:
+            self.counts[song.key] = count
             self.songs.append(song)
 
 
+    def merge(self, other: "SongsContainer") -> None:
+        """
+        Set-style union with another container (f.ex. collected by a parallel worker), counts are summed.
+        """
+        for song in other.songs:
+            self.add_song(song, other.counts[song.key])
+
+
+    def count(self, song: SongInfo) -> int:
+        return self.counts.get(song.key, 0)
+
+
     def save_to_csv(self, name: str, mode: str = "a") -> None:
-        with open(name, mode, encoding="utf-8") as file:
-            file.write(self.get_csv())
+        # rows are streamed and quoted, so titles with commas or quotes survive the round trip
+        with open(name, mode, encoding="utf-8", newline="") as file:
+            csv.writer(file, lineterminator="\n").writerows(song.row() for song in self.songs)
 
     
     def get_csv(self) -> str:
-        return "\n".join([song.csv() for song in self.songs])
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(song.row() for song in self.songs)
+        return buffer.getvalue()
 
     
-    def from_csv(self, csv_path: str) -> None:
-        data = pd.read_csv(csv_path, on_bad_lines='skip', header=None, names=["Song", "Artist"])
-        for idx, song in data.iterrows():
-            try:
-                self.songs.append(SongInfo(song["Artist"], song["Song"]))
-            except Exception as exception:
-                print(idx)
-                raise exception from None
+    def from_csv(self, csv_path: str, chunksize: int = 100000) -> None:
+        for songs in self.read_csv_chunks(csv_path, chunksize):
+            for song in songs:
+                self.add_song(song)
+
+
+    @staticmethod
+    def read_csv_chunks(csv_path: str, chunksize: int = 100000):
+        """
+        Yields lists of at most chunksize SongInfo from a "song,artist" CSV, built from the column arrays.
+        Unparsable lines (unquoted commas from files written before quoting) are reported, not silently skipped.
+        """
+        import pandas as pd
+        chunks = pd.read_csv(csv_path, header=None, names=["Song", "Artist"], dtype=str, keep_default_na=False,
+                             on_bad_lines="warn", chunksize=chunksize)
+        for data in chunks:
+            yield [SongInfo(artist, song) for song, artist in zip(data["Song"].tolist(), data["Artist"].tolist())]
+
+
+    def __or__(self, other: "SongsContainer") -> "SongsContainer":
+        merged = SongsContainer()
+        merged.merge(self)
+        merged.merge(other)
+        return merged
+
+
+    def __ior__(self, other: "SongsContainer") -> "SongsContainer":
+        self.merge(other)
+        return self
+
+
+    def __contains__(self, song) -> bool:
+        return isinstance(song, SongInfo) and song.key in self.counts
+
+
+    def __iter__(self):
+        return iter(self.songs)
         
 
     def __len__(self) -> int:
@@ -103,6 +201,9 @@ class SongFeatures:
     Song Features data structure for the database.
     """
 
+    __slots__ = ("song_id", "acousticness", "danceability", "energy", "instrumentalness", "liveness",
+                 "loudness", "speechiness", "tempo", "valence", "mode", "key", "duration_ms")
+
 
     def __init__(self, features_info: dict):
         if not isinstance(features_info, dict):
@@ -127,6 +228,11 @@ class SongFeatures:
                                                self.liveness, self.loudness, self.speechiness, self.tempo, self.valence, self.mode, self.key, self.duration_ms]])
 
 
+    def row(self) -> tuple:
+        return (self.song_id, self.acousticness, self.danceability, self.energy, self.instrumentalness, self.liveness,
+                self.loudness, self.speechiness, self.tempo, self.valence, self.mode, self.key, self.duration_ms)
+
+
     def __eq__(self, other) -> bool:
         if isinstance(other, SongFeatures):
             return self.song_id == other.song_id
@@ -139,6 +245,8 @@ class ArtistInfo:
     Artist data structure for the database.
     """
 
+    __slots__ = ("artist_id", "name", "genres", "popularity", "followers")
+
 
     def __init__(self, artist_id: str, name: str, genres: str, popularity: int, followers: int):
         if not isinstance(artist_id, str):
@@ -152,6 +260,10 @@ class ArtistInfo:
     
     def csv(self) -> str:
         return f"{self.artist_id},{self.name},{self.genres},{self.popularity},{self.followers}"
+
+
+    def row(self) -> tuple:
+        return (self.artist_id, self.name, self.genres, self.popularity, self.followers)
     
 
     def __eq__(self, other) -> bool:
@@ -166,6 +278,8 @@ class AlbumInfo:
     Album data structure for the database.
     """
 
+    __slots__ = ("album_id", "name", "release_date", "total_tracks", "genres", "popularity")
+
 
     def __init__(self, album_id: str, name: str, release_date: str, total_tracks: int, genres: str, popularity: int):
         if not isinstance(album_id, str):
@@ -180,6 +294,10 @@ class AlbumInfo:
 
     def csv(self) -> str:
         return f"{self.album_id},{self.name},{self.release_date},{self.total_tracks},{self.genres},{self.popularity}"
+
+
+    def row(self) -> tuple:
+        return (self.album_id, self.name, self.release_date, self.total_tracks, self.genres, self.popularity)
     
 
     def __eq__(self, other) -> bool:
@@ -194,9 +312,11 @@ class LyricsInfo:
     Lyrics data structure for the database.
     """
 
+    __slots__ = ("song_id", "lyrics")
+
 
     def __init__(self, song_id: str, lyrics: str):
-        if not all([isinstance(song_id, str), isinstance(lyrics, str)]):
+        if not (isinstance(song_id, str) and isinstance(lyrics, str)):
             raise ValueError("song_id and lyrics must be strings.")
         self.song_id = song_id
         self.lyrics = lyrics
@@ -205,6 +325,10 @@ class LyricsInfo:
     
     def csv(self) -> str:
         return f"{self.song_id},{self.lyrics}"
+
+
+    def row(self) -> tuple:
+        return (self.song_id, self.lyrics)
     
 
     def __eq__(self, other) -> bool:
@@ -214,15 +338,234 @@ class LyricsInfo:
 
 
 
+# --- COLUMNAR BATCHES ---
+
+
+class SongFeaturesBatch:
+    """
+    Columnar batch of song features, one array per column instead of one SongFeatures per row.
+    Missing values (null in the API answer) are stored as NULL, like the SongFeatures rows.
+    """
+
+    FLOAT_COLUMNS = ("acousticness", "danceability", "energy", "instrumentalness", "liveness",
+                     "loudness", "speechiness", "tempo", "valence")
+    # column -> array typecode
+    INT_COLUMNS = {"mode": "b", "key": "b", "duration_ms": "l"}
+    # missing (None) values of the int columns are stored as the smallest value of their type, and written as NULL
+    INT_NULLS = {column: -(1 << (8 * array(typecode).itemsize - 1)) for column, typecode in INT_COLUMNS.items()}
+
+
+    def __init__(self):
+        self.song_id = []
+        for column in self.FLOAT_COLUMNS:
+            setattr(self, column, array("d"))
+        for column, typecode in self.INT_COLUMNS.items():
+            setattr(self, column, array(typecode))
+        self.null_columns = set()   # int columns holding at least one missing value
+
+
+    @classmethod
+    def from_dicts(cls, features_info: list) -> "SongFeaturesBatch":
+        """
+        Builds the batch from the dicts returned by the audio_features API, None entries are skipped.
+        """
+        batch = cls()
+        batch.extend(features_info)
+        return batch
+
+
+    def extend(self, features_info: list) -> None:
+        # column by column, so no per-row objects are created
+        infos = [info for info in features_info if info is not None]
+        if not all(isinstance(info, dict) for info in infos):
+            raise ValueError("features_info must be a list of dictionaries.")
+        song_ids = [info["id"] for info in infos]
+        if not all(isinstance(song_id, str) for song_id in song_ids):
+            raise ValueError("song_id must be a string.")
+
+        columns = {}
+        for column in self.FLOAT_COLUMNS:
+            values = [info[column] for info in infos]
+            try:
+                columns[column] = array("d", values)
+            except TypeError:   # None values
+                columns[column] = array("d", [float("nan") if value is None else value for value in values])
+        nulls = set()
+        for column, typecode in self.INT_COLUMNS.items():
+            values = [info[column] for info in infos]
+            try:
+                columns[column] = array(typecode, values)
+            except TypeError:   # None values
+                columns[column] = array(typecode, [self.INT_NULLS[column] if value is None else value for value in values])
+                nulls.add(column)
+
+        self.song_id.extend(song_ids)
+        for column, values in columns.items():
+            getattr(self, column).extend(values)
+        self.null_columns |= nulls
+
+
+    def append(self, features_info: dict) -> None:
+        if not isinstance(features_info, dict):
+            raise ValueError("features_info must be a dictionary." + " but is " + str(type(features_info)))
+        song_id = features_info["id"]
+        if not isinstance(song_id, str):
+            raise ValueError("song_id must be a string.")
+        # convert everything first (ints into one-item arrays, which also catches the values out of
+        # range of their column), so a missing or invalid value leaves the columns aligned
+        floats = [float("nan") if features_info[column] is None else float(features_info[column]) for column in self.FLOAT_COLUMNS]
+        ints = [array(typecode, [self.INT_NULLS[column] if features_info[column] is None else int(features_info[column])])
+                for column, typecode in self.INT_COLUMNS.items()]
+        self.song_id.append(song_id)
+        for column, value in zip(self.FLOAT_COLUMNS, floats):
+            getattr(self, column).append(value)
+        for column, value in zip(self.INT_COLUMNS, ints):
+            getattr(self, column).extend(value)
+            if value[0] == self.INT_NULLS[column]:
+                self.null_columns.add(column)
+
+
+    def _int_values(self, column: str):
+        values = getattr(self, column)
+        if column not in self.null_columns:
+            return values
+        null = self.INT_NULLS[column]
+        return [None if value == null else value for value in values]
+
+
+    def rows(self):
+        """
+        Rows in the songs_features column order, ready for SongsDB.SONGS_FEATURES_INSERT.
+        """
+        return zip(self.song_id, *[getattr(self, column) for column in self.FLOAT_COLUMNS],
+                   *[self._int_values(column) for column in self.INT_COLUMNS])
+
+
+    def to_frame(self) -> pd.DataFrame:
+        import pandas as pd
+        data = {"song_id": self.song_id}
+        data.update({column: pd.array(getattr(self, column), dtype="float32") for column in self.FLOAT_COLUMNS})
+        data.update({column: pd.array(self._int_values(column), dtype=SongsDB.DATA_DTYPES[column]) for column in self.INT_COLUMNS})
+        return pd.DataFrame(data)
+
+
+    def __len__(self) -> int:
+        return len(self.song_id)
+
+
+
+class SongsBatch:
+    """
+    Columnar batch of songs (the IDSongInfo rows).
+    """
+
+    def __init__(self):
+        self.song_id = []
+        self.album_id = []
+        self.artist_id = []
+        self.title = []
+        self.release_date = []
+        self.featured = array("b")
+        self.popularity = array("h")
+
+
+    @classmethod
+    def from_tracks(cls, tracks: list) -> "SongsBatch":
+        """
+        Builds the batch from track objects of the Spotify API (search, playlist and album items with an "album").
+        """
+        batch = cls()
+        for track in tracks:
+            if track is not None:
+                batch.append(track["id"], track["album"]["id"], track["artists"][0]["id"], track["name"],
+                             track["album"]["release_date"], int(len(track["artists"]) > 1), track.get("popularity", -1))
+        return batch
+
+
+    def append(self, song_id: str, album_id: str, artist_id: str, title: str,
+               release_date: str, featured: int, popularity: int) -> None:
+        if not (isinstance(song_id, str) and isinstance(album_id, str) and isinstance(artist_id, str)):
+            raise ValueError("song_id, album_id and artist_id must be strings.")
+        featured, popularity = int(featured), int(popularity)
+        self.featured.append(featured)
+        self.popularity.append(popularity)
+        self.song_id.append(song_id)
+        self.album_id.append(album_id)
+        self.artist_id.append(artist_id)
+        self.title.append(title)
+        self.release_date.append(release_date)
+
+
+    def rows(self):
+        """
+        Rows in the songs column order, ready for SongsDB.SONGS_INSERT.
+        """
+        return zip(self.song_id, self.album_id, self.artist_id, self.title, self.release_date, self.featured, self.popularity)
+
+
+    def to_frame(self) -> pd.DataFrame:
+        import pandas as pd
+        return pd.DataFrame({"song_id": self.song_id, "album_id": self.album_id, "artist_id": self.artist_id,
+                             "song_title": self.title, "song_release_date": self.release_date,
+                             "featured": pd.array(self.featured, dtype="Int8"),
+                             "song_popularity": pd.array(self.popularity, dtype="Int16")})
+
+
+    def __len__(self) -> int:
+        return len(self.song_id)
+
+
+
 # --- DATABASE MANAGEMENT ---
 
 
 class SongsDB:
 
 
-    def __init__(self):
-        self.conn = sqlite3.connect("db_management/data/songs.db")
+    # PRAGMA settings per connection profile. "safe" is the everyday mode: WAL lets the
+    # get_data readers run next to a writer, synchronous=NORMAL is durable enough under WAL.
+    # "bulk" is meant only for the duration of an ingestion run (see bulk_load).
+    PROFILES = {
+        "safe": {
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "cache_size": -64000,           # ~64 MB
+            "mmap_size": 268435456,         # 256 MB
+            "temp_store": "MEMORY",
+            "busy_timeout": 5000,
+        },
+        "bulk": {
+            "journal_mode": "WAL",
+            "synchronous": "OFF",
+            "cache_size": -256000,          # ~256 MB
+            "mmap_size": 1073741824,        # 1 GB
+            "temp_store": "MEMORY",
+            "busy_timeout": 5000,
+        },
+    }
+
+
+    # PRAGMA user_version of a database with the whole schema below, bump it when _create_schema changes
+    SCHEMA_VERSION = 3
+
+
+    def __init__(self, db_path: str = "db_management/data/songs.db", profile: str = "safe"):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.lyrics_codecs = {}     # dict_id -> LyricsCodec, see lyrics_codec()
+        self.instrumentation = None # see enable_instrumentation()
+        self.profile = None
+        self.set_profile(profile)
         self.cursor = self.conn.cursor()
+        # raw SQL over the compressed lyrics: SELECT decompress_lyrics(lyrics) FROM lyrics
+        self.conn.create_function("decompress_lyrics", 1, self.decode_lyrics, deterministic=True)
+        # a database at SCHEMA_VERSION opens without running any DDL
+        if self.conn.execute("PRAGMA user_version;").fetchone()[0] < self.SCHEMA_VERSION:
+            self._create_schema()
+
+
+    def _create_schema(self) -> None:
+        # every statement is IF NOT EXISTS: older databases get the missing tables, indexes and triggers
         self.cursor.execute("""CREATE TABLE IF NOT EXISTS scraped_songs (
                              id INTEGER PRIMARY KEY AUTOINCREMENT,
                              title TEXT,
@@ -282,16 +625,271 @@ class SongsDB:
                              lyrics TEXT,
                              FOREIGN KEY(song_spotify_id) REFERENCES songs_features(song_spotify_id));
                             """)
-        
+
+        # shared compression dictionaries of lyrics.lyrics (db_management/compression.py)
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS lyrics_dictionaries (
+                             dict_id INTEGER PRIMARY KEY,
+                             zdict BLOB NOT NULL,
+                             created_at REAL);
+                            """)
+
+        # the backlog queries (get_distinct_*_id) probe songs by artist / album id
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_songs_artist ON songs(artist_spotify_id);")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_songs_album ON songs(album_spotify_id);")
+        self.cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_songs_release_year ON songs({self.RELEASE_YEAR});")
+
+        # change log of the incremental consumers (aggregates, analysis, clusters, lyrics / similarity
+        # indexes, snapshot), pruned up to the slowest of them by prune_changes()
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS data_changes (
+                             seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                             table_name TEXT NOT NULL,
+                             entity_id TEXT,
+                             release_year TEXT);
+                            """)
+        self._create_change_triggers()
+
+        # memoized GenreClassifier results (db_management/genres.py), map_version is a hash of the genre map.
+        # Keyed per version (map_version first, the lookups are by version), every map keeps its own results.
+        # Before SCHEMA_VERSION 3 the key was genres alone and a new version replaced the rows of the previous one
+        keys = [row[1] for row in self.conn.execute("PRAGMA table_info(genre_mapping);") if row[5]]
+        if keys == ["genres"]:
+            self.cursor.execute("ALTER TABLE genre_mapping RENAME TO genre_mapping_old;")
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS genre_mapping (
+                             genres TEXT NOT NULL,
+                             parent_genre TEXT,
+                             map_version TEXT NOT NULL,
+                             PRIMARY KEY (map_version, genres));
+                            """)
+        if keys == ["genres"]:
+            self.cursor.execute("""INSERT INTO genre_mapping (genres, parent_genre, map_version)
+                                   SELECT genres, parent_genre, map_version FROM genre_mapping_old;""")
+            self.cursor.execute("DROP TABLE genre_mapping_old;")
+
+        # per (release_year, parent_genre, weekday) count / sum / sum of squares of every audio feature,
+        # maintained from data_changes by db_management/aggregates.py
+        self.cursor.execute(f"""CREATE TABLE IF NOT EXISTS feature_aggregates (
+                             release_year TEXT NOT NULL,
+                             parent_genre TEXT NOT NULL,
+                             weekday INTEGER NOT NULL,
+                             n INTEGER NOT NULL,
+                             {", ".join(f"{feature}_n INTEGER, {feature}_sum REAL, {feature}_sumsq REAL" for feature in self.AUDIO_FEATURES)},
+                             PRIMARY KEY (release_year, parent_genre, weekday));
+                            """)
+
+        # progress markers of the derived tables (f.ex. the last data_changes.seq aggregated)
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS analytics_state (
+                             name TEXT PRIMARY KEY,
+                             value);
+                            """)
+
+        # ingestion progress per (stage, entity), claimed by the enrichment workers (db_management/pipeline.py)
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS ingest_jobs (
+                             stage TEXT NOT NULL,
+                             entity_key TEXT NOT NULL,
+                             status TEXT NOT NULL DEFAULT 'pending',
+                             attempts INTEGER NOT NULL DEFAULT 0,
+                             last_error TEXT,
+                             updated_at REAL,
+                             claimed_by TEXT,
+                             PRIMARY KEY (stage, entity_key));
+                            """)
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs(stage, status, updated_at);")
+
+        # fitted audio-feature clusterings and the cluster + 3 PCA coordinates of every song (db_management/clustering.py)
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS cluster_models (
+                             model_id TEXT PRIMARY KEY,
+                             n_clusters INTEGER NOT NULL,
+                             features TEXT NOT NULL,
+                             model BLOB NOT NULL,
+                             created_at REAL);
+                            """)
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS song_clusters (
+                             model_id TEXT NOT NULL,
+                             song_spotify_id TEXT NOT NULL,
+                             cluster INTEGER NOT NULL,
+                             pc1 REAL,
+                             pc2 REAL,
+                             pc3 REAL,
+                             PRIMARY KEY (model_id, song_spotify_id));
+                            """)
+
+        # clusters of fuzzy duplicate songs, every member with the song kept for it (db_management/duplicates.py)
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS song_duplicates (
+                             song_spotify_id TEXT PRIMARY KEY,
+                             canonical_spotify_id TEXT NOT NULL,
+                             score REAL);
+                            """)
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_song_duplicates_canonical ON song_duplicates(canonical_spotify_id);")
+
+        # cached derived columns of the analysis frame and language of the lyrics (db_management/analysis.py)
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS song_analysis (
+                             song_spotify_id TEXT PRIMARY KEY,
+                             release_year INTEGER,
+                             weekday INTEGER,
+                             duration_s REAL,
+                             energy_level TEXT,
+                             valence_level TEXT,
+                             danceability_level TEXT,
+                             tempo_level TEXT,
+                             loudness_level TEXT,
+                             parent_genre TEXT);
+                            """)
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS lyrics_languages (
+                             song_spotify_id TEXT PRIMARY KEY,
+                             language TEXT);
+                            """)
+
+        # scraped chart weeks (validators of the conditional requests included) and their entries (db_management/charts.py)
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS chart_weeks (
+                             week TEXT PRIMARY KEY,
+                             entries INTEGER NOT NULL,
+                             etag TEXT,
+                             last_modified TEXT,
+                             fetched_at REAL);
+                            """)
+        self.cursor.execute("""CREATE TABLE IF NOT EXISTS chart_positions (
+                             week TEXT NOT NULL,
+                             position INTEGER NOT NULL,
+                             title TEXT NOT NULL,
+                             artist TEXT NOT NULL,
+                             PRIMARY KEY (week, position));
+                            """)
+
+        self.conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION};")
         self.conn.commit()
-        
+
+
+    # first 4 characters of the mixed-precision release_date ("1975", "1975-06", "1975-06-13")
+    RELEASE_YEAR = "substr(release_date, 1, 4)"
+
+    AUDIO_FEATURES = ("acousticness", "danceability", "energy", "instrumentalness", "liveness", "loudness",
+                      "speechiness", "tempo", "valence", "mode", "key", "duration_ms")
+
+    # tables logged into data_changes with the column identifying the changed entity
+    TRACKED_TABLES = {
+        "songs_features": "song_spotify_id",
+        "artists": "artist_spotify_id",
+        "albums": "album_spotify_id",
+        "lyrics": "song_spotify_id",
+    }
+
+
+    def _create_change_triggers(self) -> None:
+        year = self.RELEASE_YEAR
+        for event, rows in (("INSERT", ["NEW"]), ("UPDATE", ["OLD", "NEW"]), ("DELETE", ["OLD"])):
+            # songs log the release year directly, so moved or deleted songs still mark their old partition
+            logs = " ".join(f"""INSERT INTO data_changes (table_name, entity_id, release_year)
+                                VALUES ('songs', {row}.song_spotify_id, {year.replace("release_date", row + ".release_date")});"""
+                            for row in rows)
+            self.cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS songs_log_{event.lower()} AFTER {event} ON songs
+                                   BEGIN {logs} END;""")
+
+            for table, key in self.TRACKED_TABLES.items():
+                logs = " ".join(f"""INSERT INTO data_changes (table_name, entity_id)
+                                    VALUES ('{table}', {row}.{key});""" for row in rows)
+                self.cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_log_{event.lower()} AFTER {event} ON {table}
+                                       BEGIN {logs} END;""")
+
+
+    def _drop_change_triggers(self) -> None:
+        for event in ("insert", "update", "delete"):
+            for table in ("songs", *self.TRACKED_TABLES):
+                self.cursor.execute(f"DROP TRIGGER IF EXISTS {table}_log_{event};")
+
+
+    # ================== CONNECTION METHODS ==================
+
+    def set_profile(self, profile: str) -> None:
+        if profile not in self.PROFILES:
+            raise ValueError(f"Unknown profile '{profile}', expected one of {list(self.PROFILES)}.")
+        self.conn.commit()  # journal_mode cannot be changed inside an open transaction
+        for pragma, value in self.PROFILES[profile].items():
+            self.conn.execute(f"PRAGMA {pragma} = {value};")
+        self.profile = profile
+
+
+    @contextmanager
+    def bulk_load(self):
+        """
+        Switches the connection to the "bulk" profile for the duration of the block
+        and goes back to the previous profile (checkpointing the WAL) afterwards.
+        The rows loaded in the block are not logged into data_changes one by one:
+        the change triggers are dropped, and the consumers of the log rebuild
+        on their next refresh (see _invalidate_changes).
+        """
+        previous = self.profile
+        self.set_profile("bulk")
+        # user_version 0 until the triggers are back, so a process dying in the block recreates them on the next open
+        self._drop_change_triggers()
+        self.conn.execute("PRAGMA user_version = 0;")
+        self._invalidate_changes()
+        try:
+            yield self
+        finally:
+            self.conn.commit()
+            self._create_change_triggers()
+            self.conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION};")
+            self._invalidate_changes()
+            self.set_profile(previous)
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+
+
+    def enable_instrumentation(self, slow_query_threshold: float = 0.5, slow_log_path: str = None):
+        """
+        Starts recording per-method calls, latencies, SQLite time, rows and commits, and logging the
+        get_query_database calls slower than slow_query_threshold seconds with their query plan.
+        Returns the Instrumentation (see db_management/instrumentation.py), already enabled ones are kept.
+        """
+        from db_management.instrumentation import Instrumentation, install
+        if self.instrumentation is None:
+            install(self, Instrumentation(slow_query_threshold, slow_log_path))
+        return self.instrumentation
+
+
+    def disable_instrumentation(self):
+        """
+        Removes the instrumentation, returns it with the metrics recorded so far.
+        """
+        from db_management.instrumentation import uninstall
+        instrumentation = self.instrumentation
+        if instrumentation is not None:
+            uninstall(self)
+            self.instrumentation = None
+        return instrumentation
+
+
 
     # ================== INSERT METHODS ==================
 
+    SCRAPED_SONGS_INSERT = """INSERT INTO scraped_songs 
+                           (title, artist) VALUES (?, ?)"""
+
+    SONGS_INSERT = """INSERT INTO songs
+                   (song_spotify_id, album_spotify_id, artist_spotify_id, title, release_date, featured, popularity)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)"""
+
+    SONGS_FEATURES_INSERT = """INSERT INTO songs_features
+                            (song_spotify_id, acousticness, danceability, energy, instrumentalness, liveness, loudness, speechiness, tempo, valence, mode, key, duration_ms)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+
+    ARTISTS_INSERT = """INSERT INTO artists
+                     (artist_spotify_id, name, genres, popularity, followers)
+                     VALUES (?, ?, ?, ?, ?)"""
+
+    ALBUMS_INSERT = """INSERT INTO albums
+                    (album_spotify_id, name, release_date, total_tracks, genres, popularity)
+                    VALUES (?, ?, ?, ?, ?, ?)"""
+
+    LYRICS_INSERT = """INSERT INTO lyrics
+                    (song_spotify_id, lyrics)
+                    VALUES (?, ?)"""
+
+    DEFAULT_BATCH_SIZE = 5000
+
+
     def scraped_songs_insert(self, song: SongInfo) -> None:
         try:
-            self.cursor.execute("""INSERT INTO scraped_songs 
-                                (title, artist) VALUES (?, ?)""", (song.song, song.artist))
+            self.cursor.execute(self.SCRAPED_SONGS_INSERT, song.row())
             self.conn.commit()
         except Exception as exception:
             raise DBException(song.song, song.artist, *exception.args)
@@ -299,10 +897,7 @@ class SongsDB:
 
     def songs_insert(self, song: IDSongInfo) -> None:
         try:
-            self.cursor.execute("""INSERT INTO songs
-                                 (song_spotify_id, album_spotify_id, artist_spotify_id, title, release_date, featured, popularity)
-                                 VALUES (?, ?, ?, ?, ?, ?, ?)""", (song.song_id, song.album_id, song.artist_id,
-                                                                 song.title, song.release_date, song.featured, song.popularity))
+            self.cursor.execute(self.SONGS_INSERT, song.row())
             self.conn.commit()
         except Exception as exception:
             raise DBException(song.song_id, song.title, *exception.args)
@@ -310,11 +905,7 @@ class SongsDB:
 
     def songs_features_insert(self, songf: SongFeatures) -> None:
         try:
-            self.cursor.execute("""INSERT INTO songs_features
-                                 (song_spotify_id, acousticness, danceability, energy, instrumentalness, liveness, loudness, speechiness, tempo, valence, mode, key, duration_ms)
-                                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", (songf.song_id, songf.acousticness, songf.danceability, songf.energy,
-                                                                                songf.instrumentalness, songf.liveness, songf.loudness, songf.speechiness,
-                                                                                songf.tempo, songf.valence, songf.mode, songf.key, songf.duration_ms))
+            self.cursor.execute(self.SONGS_FEATURES_INSERT, songf.row())
             self.conn.commit()
         except Exception as exception:
             raise DBException(songf.song_id, *exception.args)
@@ -322,9 +913,7 @@ class SongsDB:
 
     def artists_insert(self, artist: ArtistInfo) -> None:
         try:
-            self.cursor.execute("""INSERT INTO artists
-                                 (artist_spotify_id, name, genres, popularity, followers)
-                                 VALUES (?, ?, ?, ?, ?)""", (artist.artist_id, artist.name, artist.genres, artist.popularity, artist.followers))
+            self.cursor.execute(self.ARTISTS_INSERT, artist.row())
             self.conn.commit()
         except Exception as exception:
             raise DBException(artist.artist_id, artist.name, *exception.args)
@@ -332,9 +921,7 @@ class SongsDB:
 
     def albums_insert(self, album: AlbumInfo) -> None:
         try:
-            self.cursor.execute("""INSERT INTO albums
-                                 (album_spotify_id, name, release_date, total_tracks, genres, popularity)
-                                 VALUES (?, ?, ?, ?, ?, ?)""", (album.album_id, album.name, album.release_date, album.total_tracks, album.genres, album.popularity))
+            self.cursor.execute(self.ALBUMS_INSERT, album.row())
             self.conn.commit()
         except Exception as exception:
             raise DBException(album.album_id, album.name, *exception.args)
@@ -342,95 +929,703 @@ class SongsDB:
 
     def lyrics_insert(self, lyrics: LyricsInfo) -> None:
         try:
-            self.cursor.execute("""INSERT INTO lyrics
-                                 (song_spotify_id, lyrics)
-                                 VALUES (?, ?)""", (lyrics.song_id, lyrics.lyrics))
+            self.cursor.execute(self.LYRICS_INSERT, self._lyrics_row(lyrics))
             self.conn.commit()
         except Exception as exception:
             raise DBException(lyrics.song_id, *exception.args)
-        
 
-    
+
+
+    # ================== BULK INSERT METHODS ==================
+    # Each *_insert_many commits once per batch and returns the keys of the rows that were rejected:
+    # constraint violations and values SQLite cannot store. Any other error (f.ex. "database is locked")
+    # rolls the batch back and is raised. With commit=False the rows stay in the caller's transaction
+    # (one SAVEPOINT per batch), to be committed together with f.ex. the status of their jobs.
+
+    def scraped_songs_insert_many(self, songs, batch_size: int = DEFAULT_BATCH_SIZE, commit: bool = True) -> list:
+        return self._insert_many(self.SCRAPED_SONGS_INSERT, (song.row() for song in songs), lambda row: row, batch_size, commit)
+
+
+    def songs_insert_many(self, songs, batch_size: int = DEFAULT_BATCH_SIZE, commit: bool = True) -> list:
+        """
+        songs is an iterable of IDSongInfo or a SongsBatch.
+        """
+        rows = songs.rows() if isinstance(songs, SongsBatch) else (song.row() for song in songs)
+        return self._insert_many(self.SONGS_INSERT, rows, lambda row: row[0], batch_size, commit)
+
+
+    def songs_features_insert_many(self, songsf, batch_size: int = DEFAULT_BATCH_SIZE, commit: bool = True) -> list:
+        """
+        songsf is an iterable of SongFeatures or a SongFeaturesBatch.
+        """
+        rows = songsf.rows() if isinstance(songsf, SongFeaturesBatch) else (songf.row() for songf in songsf)
+        return self._insert_many(self.SONGS_FEATURES_INSERT, rows, lambda row: row[0], batch_size, commit)
+
+
+    def artists_insert_many(self, artists, batch_size: int = DEFAULT_BATCH_SIZE, commit: bool = True) -> list:
+        return self._insert_many(self.ARTISTS_INSERT, (artist.row() for artist in artists), lambda row: row[0], batch_size, commit)
+
+
+    def albums_insert_many(self, albums, batch_size: int = DEFAULT_BATCH_SIZE, commit: bool = True) -> list:
+        return self._insert_many(self.ALBUMS_INSERT, (album.row() for album in albums), lambda row: row[0], batch_size, commit)
+
+
+    def lyrics_insert_many(self, lyrics, batch_size: int = DEFAULT_BATCH_SIZE, commit: bool = True) -> list:
+        return self._insert_many(self.LYRICS_INSERT, (self._lyrics_row(lyric) for lyric in lyrics), lambda row: row[0], batch_size, commit)
+
+
+    def genre_mapping_insert_many(self, mapping: dict, map_version: str, batch_size: int = DEFAULT_BATCH_SIZE, commit: bool = True) -> list:
+        rows = ((genres, parent_genre, map_version) for genres, parent_genre in mapping.items())
+        return self._insert_many("""INSERT OR REPLACE INTO genre_mapping (genres, parent_genre, map_version)
+                                    VALUES (?, ?, ?)""", rows, lambda row: row[0], batch_size, commit)
+
+
+    def _insert_many(self, query: str, rows, key, batch_size: int, commit: bool = True) -> list:
+        if batch_size < 1:
+            raise ValueError("batch_size must be a positive integer.")
+        insert_batch = self._insert_batch if commit else self._insert_batch_uncommitted
+        rejected = []
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                rejected.extend(insert_batch(query, batch, key))
+                batch = []
+        if batch:
+            rejected.extend(insert_batch(query, batch, key))
+        return rejected
+
+
+    @staticmethod
+    def _rejected_row(exception: Exception) -> bool:
+        # errors caused by the row itself, the batch goes on without it
+        if isinstance(exception, (sqlite3.IntegrityError, OverflowError)):
+            return True
+        return isinstance(exception, sqlite3.ProgrammingError) and str(exception).startswith("Error binding parameter")
+
+
+    def _insert_batch(self, query: str, batch: list, key) -> list:
+        # fast path: the whole batch in a single executemany + commit
+        try:
+            self.cursor.executemany(query, batch)
+            self.conn.commit()
+            return []
+        except Exception as exception:
+            self.conn.rollback()
+            if not self._rejected_row(exception):
+                raise
+
+        # some row failed - replay the batch row by row, still inside one transaction
+        rejected = []
+        for row in batch:
+            try:
+                self.cursor.execute(query, row)
+            except Exception as exception:
+                if not self._rejected_row(exception):
+                    self.conn.rollback()
+                    raise
+                rejected.append(key(row))
+        self.conn.commit()
+        return rejected
+
+
+    def _insert_batch_uncommitted(self, query: str, batch: list, key) -> list:
+        # same as _insert_batch inside the open transaction: a failed batch is undone up to its savepoint only,
+        # or entirely when the transaction was opened here, so an error never leaves it open behind the caller
+        opened = not self.conn.in_transaction
+        if opened:
+            self.conn.execute("BEGIN;")     # releasing an outermost savepoint would commit
+        self.conn.execute("SAVEPOINT insert_batch;")
+        try:
+            try:
+                self.cursor.executemany(query, batch)
+                rejected = []
+            except Exception as exception:
+                if not self._rejected_row(exception):
+                    raise
+                self.conn.execute("ROLLBACK TO insert_batch;")
+                rejected = []
+                for row in batch:
+                    try:
+                        self.cursor.execute(query, row)
+                    except Exception as exception:
+                        if not self._rejected_row(exception):
+                            raise
+                        rejected.append(key(row))
+        except Exception:
+            if opened:
+                self.conn.rollback()
+            else:
+                self.conn.execute("ROLLBACK TO insert_batch;")
+                self.conn.execute("RELEASE insert_batch;")
+            raise
+        self.conn.execute("RELEASE insert_batch;")
+        return rejected
+
+
+
+
     # ================== GET METHODS ==================
 
     def get_scraped_songs(self) -> list:
-        self.cursor.execute("SELECT * FROM scraped_songs")
-        return self.cursor.fetchall()
+        cursor = self.conn.execute("SELECT * FROM scraped_songs")
+        return cursor.fetchall()
+    
+
+    def get_chart_songs(self) -> SongsContainer:
+        """
+        The songs of the stored chart weeks in chart order, counted once per week on the chart.
+        """
+        container = SongsContainer()
+        for title, artist in self.conn.execute("SELECT title, artist FROM chart_positions ORDER BY week, position"):
+            container.add_song(SongInfo(artist, title))
+        return container
     
 
     def get_artists(self) -> list:
-        self.cursor.execute("SELECT * FROM artists")
-        return self.cursor.fetchall()
+        cursor = self.conn.execute("SELECT * FROM artists")
+        return cursor.fetchall()
     
 
     def get_albums(self) -> list:
-        self.cursor.execute("SELECT * FROM albums")
-        return self.cursor.fetchall()
+        cursor = self.conn.execute("SELECT * FROM albums")
+        return cursor.fetchall()
+    
+
+    def get_song_cluster(self, song_id: str, model_id: str):
+        row = self.conn.execute("SELECT cluster FROM song_clusters WHERE model_id = ? AND song_spotify_id = ?",
+                                (model_id, song_id)).fetchone()
+        return None if row is None else row[0]
+    
+
+    def get_genre_mapping(self, map_version: str) -> dict:
+        cursor = self.conn.execute("SELECT genres, parent_genre FROM genre_mapping WHERE map_version = ?", (map_version,))
+        return dict(cursor.fetchall())
     
 
+    # anti-joins over songs: the distinct ids come straight from idx_songs_artist / idx_songs_album,
+    # so the primary key of artists / albums is probed once per id instead of once per song
+    MISSING_ARTISTS_QUERY = """SELECT s.artist_spotify_id FROM (SELECT DISTINCT artist_spotify_id FROM songs) s
+                               WHERE NOT EXISTS (SELECT 1 FROM artists a WHERE a.artist_spotify_id = s.artist_spotify_id);"""
+
+    MISSING_ALBUMS_QUERY = """SELECT s.album_spotify_id FROM (SELECT DISTINCT album_spotify_id FROM songs) s
+                              WHERE NOT EXISTS (SELECT 1 FROM albums al WHERE al.album_spotify_id = s.album_spotify_id);"""
+
+    MISSING_FEATURES_QUERY = """SELECT s.song_spotify_id FROM songs s
+                                WHERE NOT EXISTS (SELECT 1 FROM songs_features f WHERE f.song_spotify_id = s.song_spotify_id);"""
+
+
     def get_distinct_artists_id(self) -> list:
-        self.cursor.execute("""SELECT DISTINCT artist_spotify_id FROM songs
-                               WHERE artist_spotify_id NOT IN (SELECT artist_spotify_id FROM artists);""")
-        return self.cursor.fetchall()
+        return self.conn.execute(self.MISSING_ARTISTS_QUERY).fetchall()
     
 
     def get_distinct_albums_id(self) -> list:
-        self.cursor.execute("""SELECT DISTINCT album_spotify_id FROM songs
-                               WHERE album_spotify_id NOT IN (SELECT album_spotify_id FROM albums);""")
-        return self.cursor.fetchall()
+        return self.conn.execute(self.MISSING_ALBUMS_QUERY).fetchall()
     
 
     def get_distinct_songs_id(self) -> list:
-        self.cursor.execute("""SELECT DISTINCT song_spotify_id FROM songs
-                               WHERE song_spotify_id NOT IN (SELECT song_spotify_id FROM songs_features);""")
-        return self.cursor.fetchall()
+        return self.conn.execute(self.MISSING_FEATURES_QUERY).fetchall()
     
 
     def get_query_database(self, query: str) -> list:
-        self.cursor.execute(query)
-        return self.cursor.fetchall()
-    
-
-    def get_data(self) -> pd.DataFrame:
-        self.cursor.execute("""
-                            SELECT  s.title AS song_title, s.release_date AS song_release_date,
-                                    s.featured AS featured, s.popularity AS song_popularity, f.acousticness,
-                                    f.danceability, f.energy, f.instrumentalness,
-                                    f.liveness, f.loudness, f.speechiness,
-                                    f.tempo, f.valence, f.mode,
-                                    f.key, f.duration_ms, a.name AS artist_name,
-                                    a.genres AS artist_genres, a.popularity AS artist_popularity, a.followers AS artist_followers,
-                                    al.name AS album_name, al.release_date AS album_release_date, al.total_tracks AS album_total_tracks,
-                                    al.popularity AS album_popularity, l.lyrics
-                            FROM songs s
-                            LEFT JOIN songs_features f ON s.song_spotify_id = f.song_spotify_id
-                            LEFT JOIN artists a ON s.artist_spotify_id = a.artist_spotify_id
-                            LEFT JOIN albums al ON s.album_spotify_id = al.album_spotify_id
-                            LEFT JOIN lyrics l ON s.song_spotify_id = l.song_spotify_id;
-                            """)
+        """
+        Rows of a raw query, the values of columns named "lyrics" are decompressed (see LYRICS METHODS).
+        """
+        cursor = self.conn.execute(query)
+        rows = cursor.fetchall()
+        lyrics = [idx for idx, column in enumerate(cursor.description or ()) if column[0] == "lyrics"]
+        if not lyrics:
+            return rows
+        return [tuple(self.decode_lyrics(value) if idx in lyrics else value for idx, value in enumerate(row)) for row in rows]
+    
 
-        return pd.DataFrame(self.cursor.fetchall(), columns=[description[0] for description in self.cursor.description])
-
-
-    def get_data_full(self) -> pd.DataFrame:
-        self.cursor.execute("""
-                            SELECT  s.song_spotify_id as song_id, s.title AS song_title, s.release_date AS song_release_date,
-                                    s.featured AS featured, s.popularity AS song_popularity, f.acousticness,
-                                    f.danceability, f.energy, f.instrumentalness,
-                                    f.liveness, f.loudness, f.speechiness,
-                                    f.tempo, f.valence, f.mode,
-                                    f.key, f.duration_ms, a.name AS artist_name,
-                                    a.genres AS artist_genres, a.popularity AS artist_popularity, a.followers AS artist_followers,
-                                    al.name AS album_name, al.release_date AS album_release_date, al.total_tracks AS album_total_tracks,
-                                    al.popularity AS album_popularity, l.lyrics
-                            FROM songs s
-                            LEFT JOIN songs_features f ON s.song_spotify_id = f.song_spotify_id
-                            LEFT JOIN artists a ON s.artist_spotify_id = a.artist_spotify_id
-                            LEFT JOIN albums al ON s.album_spotify_id = al.album_spotify_id
-                            LEFT JOIN lyrics l ON s.song_spotify_id = l.song_spotify_id;
-                            """)
+    def explain(self, query: str, params: tuple = ()) -> list:
+        """
+        Returns the EXPLAIN QUERY PLAN details of the query, one line per plan step.
+        """
+        cursor = self.conn.execute("EXPLAIN QUERY PLAN " + query, params)
+        return [detail for _, _, _, detail in cursor.fetchall()]
+    
 
-        return pd.DataFrame(self.cursor.fetchall(), columns=[description[0] for description in self.cursor.description])
+    # compact dtypes for the joined frame, nullable integers because of the LEFT JOINs
+    DATA_DTYPES = {
+        "featured": "Int8",
+        "song_popularity": "Int16",
+        "acousticness": "float32",
+        "danceability": "float32",
+        "energy": "float32",
+        "instrumentalness": "float32",
+        "liveness": "float32",
+        "loudness": "float32",
+        "speechiness": "float32",
+        "tempo": "float32",
+        "valence": "float32",
+        "mode": "Int8",
+        "key": "Int8",
+        "duration_ms": "Int32",
+        "artist_genres": "category",
+        "artist_popularity": "Int16",
+        "artist_followers": "Int32",
+        "album_total_tracks": "Int16",
+        "album_popularity": "Int16",
+    }
+
+
+    # songs of a duplicate cluster other than its canonical song
+    DUPLICATE_FILTER = """s.song_spotify_id NOT IN (SELECT song_spotify_id FROM song_duplicates
+                                                     WHERE song_spotify_id != canonical_spotify_id)"""
+
+
+    def _data_query(self, song_id: bool, lyrics: bool, where: str = "", order_by: str = "", release_year: bool = False) -> str:
+        return f"""
+                SELECT  {"substr(s.release_date, 1, 4) AS release_year, " if release_year else ""}{"s.song_spotify_id as song_id, " if song_id else ""}s.title AS song_title, s.release_date AS song_release_date,
+                        s.featured AS featured, s.popularity AS song_popularity, f.acousticness,
+                        f.danceability, f.energy, f.instrumentalness,
+                        f.liveness, f.loudness, f.speechiness,
+                        f.tempo, f.valence, f.mode,
+                        f.key, f.duration_ms, a.name AS artist_name,
+                        a.genres AS artist_genres, a.popularity AS artist_popularity, a.followers AS artist_followers,
+                        al.name AS album_name, al.release_date AS album_release_date, al.total_tracks AS album_total_tracks,
+                        al.popularity AS album_popularity{", l.lyrics" if lyrics else ""}
+                FROM songs s
+                LEFT JOIN songs_features f ON s.song_spotify_id = f.song_spotify_id
+                LEFT JOIN artists a ON s.artist_spotify_id = a.artist_spotify_id
+                LEFT JOIN albums al ON s.album_spotify_id = al.album_spotify_id
+                {"LEFT JOIN lyrics l ON s.song_spotify_id = l.song_spotify_id" if lyrics else ""}
+                {"WHERE " + where if where else ""}
+                {"ORDER BY " + order_by if order_by else ""};
+                """
+
+
+    def _data_chunks(self, query: str, chunksize: int, params: tuple = ()):
+        import pandas as pd
+        cursor = self.conn.execute(query, params)
+        columns = [description[0] for description in cursor.description]
+        dtypes = {column: dtype for column, dtype in self.DATA_DTYPES.items() if column in columns}
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            yield self._decode_lyrics_column(pd.DataFrame.from_records(rows, columns=columns).astype(dtypes))
+
+
+    def _get_data(self, song_id: bool, chunksize: int, lyrics: bool, collapse_duplicates: bool = False):
+        query = self._data_query(song_id, lyrics, where=self.DUPLICATE_FILTER if collapse_duplicates else "")
+        if chunksize is not None:
+            if chunksize < 1:
+                raise ValueError("chunksize must be a positive integer.")
+            return self._data_chunks(query, chunksize)
+
+        import pandas as pd
+        cursor = self.conn.execute(query)
+        return self._decode_lyrics_column(pd.DataFrame(cursor.fetchall(), columns=[description[0] for description in cursor.description]))
+
+
+    def _decode_lyrics_column(self, data: pd.DataFrame) -> pd.DataFrame:
+        # lyrics are decompressed only here, when the column was selected
+        if "lyrics" in data.columns:
+            data["lyrics"] = [self.decode_lyrics(value) for value in data["lyrics"]]
+        return data
+
+
+    def get_data(self, chunksize: int = None, lyrics: bool = True, collapse_duplicates: bool = False):
+        """
+        Joined songs dataset. With chunksize, returns a generator of DataFrames of at most
+        chunksize rows with the compact DATA_DTYPES. lyrics=False leaves out the lyrics column
+        and the join on the lyrics table. collapse_duplicates=True keeps only the canonical song
+        of every song_duplicates cluster (see refresh_duplicates).
+        """
+        return self._get_data(False, chunksize, lyrics, collapse_duplicates)
+
+
+    def get_data_full(self, chunksize: int = None, lyrics: bool = True, collapse_duplicates: bool = False):
+        """
+        Same as get_data, with the song_id column.
+        """
+        return self._get_data(True, chunksize, lyrics, collapse_duplicates)
+
+
+    def get_features_chunks(self, features: tuple = AUDIO_FEATURES, chunksize: int = 50000, song_ids: list = None,
+                            shuffle: bool = False, seed: int = None):
+        """
+        Generator of (song ids, float64 array of features) chunks of the songs with all the features set,
+        in rowid order - or only of song_ids when given. With shuffle=True the chunks are blocks of
+        chunksize rowids in random order, their rows shuffled as well (f.ex. for mini-batch training).
+        """
+        import numpy as np
+        where = " AND ".join(f"{feature} IS NOT NULL" for feature in features)
+        if shuffle:
+            rng = np.random.default_rng(seed)
+            low, high = self.conn.execute("SELECT MIN(rowid), MAX(rowid) FROM songs_features").fetchone()
+            starts = np.arange(low, high + 1, chunksize) if low is not None else []
+            for start in rng.permutation(starts):
+                rows = self.conn.execute(f"""SELECT song_spotify_id, {", ".join(features)} FROM songs_features
+                                             WHERE {where} AND rowid >= ? AND rowid < ?""", (int(start), int(start) + chunksize)).fetchall()
+                if rows:
+                    rows = [rows[idx] for idx in rng.permutation(len(rows))]
+                    yield [row[0] for row in rows], np.array([row[1:] for row in rows], dtype=np.float64)
+            return
+        if song_ids is not None:
+            for idx in range(0, len(song_ids), 500):
+                chunk = song_ids[idx:idx + 500]
+                rows = self.conn.execute(f"""SELECT song_spotify_id, {", ".join(features)} FROM songs_features
+                                             WHERE {where} AND song_spotify_id IN ({", ".join("?" * len(chunk))})""", chunk).fetchall()
+                if rows:
+                    yield [row[0] for row in rows], np.array([row[1:] for row in rows], dtype=np.float64)
+            return
+
+        cursor = self.conn.execute(f"SELECT song_spotify_id, {', '.join(features)} FROM songs_features WHERE {where} ORDER BY rowid")
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                return
+            yield [row[0] for row in rows], np.array([row[1:] for row in rows], dtype=np.float64)
+    
+    
+    def export_snapshot(self, path: str, chunksize: int = 50000, full: bool = False) -> list:
+        """
+        Incremental columnar (parquet) export of get_data_full, see db_management/snapshot.py.
+        """
+        from db_management.snapshot import export_snapshot
+        return export_snapshot(self, path, chunksize, full)
+    
+    
+    def changed_release_years(self, since: int, until: int) -> set:
+        """
+        Release years (None for songs without release_date) touched by data_changes with since < seq <= until.
+        """
+        year = "substr(s.release_date, 1, 4)"
+        years = set()
+        for query in (
+            "SELECT DISTINCT c.release_year FROM data_changes c WHERE c.table_name = 'songs' AND c.seq > ? AND c.seq <= ?",
+            f"""SELECT DISTINCT {year} FROM data_changes c JOIN songs s ON s.song_spotify_id = c.entity_id
+                    WHERE c.table_name IN ('songs_features', 'lyrics') AND c.seq > ? AND c.seq <= ?""",
+            f"""SELECT DISTINCT {year} FROM data_changes c JOIN songs s ON s.artist_spotify_id = c.entity_id
+                    WHERE c.table_name = 'artists' AND c.seq > ? AND c.seq <= ?""",
+            f"""SELECT DISTINCT {year} FROM data_changes c JOIN songs s ON s.album_spotify_id = c.entity_id
+                    WHERE c.table_name = 'albums' AND c.seq > ? AND c.seq <= ?""",
+        ):
+            years.update(row[0] for row in self.conn.execute(query, (since, until)))
+        return years
+
+
+    def last_change(self) -> int:
+        return self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM data_changes").fetchone()[0]
+
+
+    # The consumers of data_changes keep the last seq they processed in analytics_state, under a name
+    # ending in "_seq" or of the form "<consumer>_seq:<key>". The file based ones (keyed by their path)
+    # register it with set_changes_marker, their marker is dropped once the path is gone.
+    CHANGES_MARKERS = r"(name LIKE '%\_seq' ESCAPE '\' OR name LIKE '%\_seq:%' ESCAPE '\')"
+    FILE_CHANGES_CONSUMERS = ("lyrics_index_seq", "similarity_seq", "snapshot_seq")
+    CHANGES_PRUNED_STATE = "data_changes_pruned"
+
+
+    def set_changes_marker(self, consumer: str, path: str, seq: int) -> None:
+        if consumer not in self.FILE_CHANGES_CONSUMERS:
+            raise ValueError(f"Unknown consumer '{consumer}', expected one of {list(self.FILE_CHANGES_CONSUMERS)}.")
+        self.conn.execute("INSERT OR REPLACE INTO analytics_state (name, value) VALUES (?, ?)",
+                          (f"{consumer}:{os.path.abspath(path)}", seq))
+        self.conn.commit()
+
+
+    def changes_pruned(self) -> int:
+        """
+        Last seq deleted by prune_changes, 0 when the log is complete.
+        """
+        row = self.conn.execute("SELECT value FROM analytics_state WHERE name = ?", (self.CHANGES_PRUNED_STATE,)).fetchone()
+        return 0 if row is None else row[0]
+
+
+    def changes_available(self, since: int) -> bool:
+        """
+        Whether the log still holds every change after since, a consumer behind a prune rebuilds instead.
+        """
+        return since >= self.changes_pruned()
+
+
+    def _invalidate_changes(self) -> None:
+        # logs one row for changes made without the triggers and marks everything before it as pruned,
+        # so every consumer refreshed before it rebuilds instead of applying an incomplete log
+        seq = self.conn.execute("INSERT INTO data_changes (table_name) VALUES ('bulk_load')").lastrowid
+        self.conn.execute("INSERT OR REPLACE INTO analytics_state (name, value) VALUES (?, ?)", (self.CHANGES_PRUNED_STATE, seq))
+        self.conn.commit()
+
+
+    def prune_changes(self) -> int:
+        """
+        Deletes the data_changes rows processed by every consumer. Without any marker nothing is
+        deleted: no consumer is not the same as every consumer caught up. Called by the refreshes of
+        the consumers. A consumer no longer in use holds the log back until its marker is deleted
+        from analytics_state. Returns the number of rows deleted.
+        """
+        markers = []
+        for name, value in self.conn.execute(f"SELECT name, value FROM analytics_state WHERE {self.CHANGES_MARKERS}").fetchall():
+            consumer, _, path = name.partition(":")
+            if consumer in self.FILE_CHANGES_CONSUMERS and not os.path.exists(path):
+                self.conn.execute("DELETE FROM analytics_state WHERE name = ?", (name,))
+                continue
+            markers.append(value)
+        if not markers:
+            self.conn.commit()
+            return 0
+        upto = min(markers)
+        deleted = self.conn.execute("DELETE FROM data_changes WHERE seq <= ?", (upto,)).rowcount
+        if upto > self.changes_pruned():
+            self.conn.execute("INSERT OR REPLACE INTO analytics_state (name, value) VALUES (?, ?)", (self.CHANGES_PRUNED_STATE, upto))
+        self.conn.commit()
+        return deleted
+
+
+    # ================== JOB METHODS ==================
+    # ingest_jobs statuses: pending -> running -> done | failed (retried until max_attempts)
+
+    # backlog of every stage, used once to seed ingest_jobs
+    JOB_SEEDS = {
+        "search": "SELECT id FROM scraped_songs",
+        "artists": MISSING_ARTISTS_QUERY,
+        "albums": MISSING_ALBUMS_QUERY,
+        "features": MISSING_FEATURES_QUERY,
+        "popularity": "SELECT song_spotify_id FROM songs WHERE popularity = -1",
+        "lyrics": """SELECT s.song_spotify_id FROM songs s
+                     WHERE s.popularity >= 40
+                     AND NOT EXISTS (SELECT 1 FROM lyrics l WHERE l.song_spotify_id = s.song_spotify_id)""",
+    }
+
+
+    # whether the entity of a stage is already stored, enqueue_jobs skips those
+    JOB_DONE_CHECKS = {
+        "artists": "SELECT 1 FROM artists WHERE artist_spotify_id = ?",
+        "albums": "SELECT 1 FROM albums WHERE album_spotify_id = ?",
+        "features": "SELECT 1 FROM songs_features WHERE song_spotify_id = ?",
+        "popularity": "SELECT 1 FROM songs WHERE song_spotify_id = ? AND popularity <> -1",
+        "lyrics": "SELECT 1 FROM lyrics WHERE song_spotify_id = ?",
+    }
+
+
+    def seed_jobs(self, stage: str) -> int:
+        """
+        Enqueues the current backlog of the stage (one scan), returns the number of new jobs.
+        """
+        if stage not in self.JOB_SEEDS:
+            raise ValueError(f"Unknown stage '{stage}', expected one of {list(self.JOB_SEEDS)}.")
+        before = self.conn.total_changes
+        self.conn.execute(f"""WITH backlog(key) AS ({self.JOB_SEEDS[stage].rstrip(";")})
+                              INSERT OR IGNORE INTO ingest_jobs (stage, entity_key, updated_at)
+                              SELECT ?, CAST(key AS TEXT), ? FROM backlog""", (stage, time()))
+        added = self.conn.total_changes - before
+        self.conn.execute("INSERT OR REPLACE INTO analytics_state (name, value) VALUES (?, ?)", (f"jobs_seeded:{stage}", time()))
+        self.conn.commit()
+        return added
+
+
+    def jobs_seeded(self, stage: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM analytics_state WHERE name = ?", (f"jobs_seeded:{stage}",)).fetchone() is not None
+
+
+    def enqueue_jobs(self, stage: str, keys, commit: bool = True) -> None:
+        """
+        Adds pending jobs for keys that have none yet and whose entity is not stored already.
+        """
+        check = self.JOB_DONE_CHECKS.get(stage)
+        now = time()
+        if check is None:
+            self.conn.executemany("INSERT OR IGNORE INTO ingest_jobs (stage, entity_key, updated_at) VALUES (?, ?, ?)",
+                                  ((stage, str(key), now) for key in keys))
+        else:
+            self.conn.executemany(f"""INSERT OR IGNORE INTO ingest_jobs (stage, entity_key, updated_at)
+                                      SELECT ?, ?, ? WHERE NOT EXISTS ({check})""",
+                                  ((stage, str(key), now, key) for key in keys))
+        if commit:
+            self.conn.commit()
+
+
+    def claim_jobs(self, stage: str, n: int, worker: str, lease: float = 600, max_attempts: int = 3) -> list:
+        """
+        Atomically marks up to n jobs of the stage as running for worker and returns their keys.
+        Claimable are pending jobs, failed jobs with attempts left and running jobs whose lease expired
+        (their worker died). Several processes can claim from the same database without overlap.
+        """
+        now = time()
+        self.conn.commit()
+        self.conn.execute("BEGIN IMMEDIATE;")   # takes the write lock before reading
+        try:
+            keys = [row[0] for row in self.conn.execute(
+                """SELECT entity_key FROM ingest_jobs
+                   WHERE stage = ? AND (status = 'pending'
+                                        OR (status = 'failed' AND attempts < ?)
+                                        OR (status = 'running' AND updated_at < ?))
+                   LIMIT ?""", (stage, max_attempts, now - lease, n))]
+            self.conn.executemany("""UPDATE ingest_jobs SET status = 'running', attempts = attempts + 1,
+                                     claimed_by = ?, updated_at = ? WHERE stage = ? AND entity_key = ?""",
+                                  ((worker, now, stage, key) for key in keys))
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return keys
+
+
+    def complete_jobs(self, stage: str, keys, commit: bool = True) -> None:
+        self.conn.executemany("""UPDATE ingest_jobs SET status = 'done', last_error = NULL, updated_at = ?
+                                 WHERE stage = ? AND entity_key = ?""", ((time(), stage, str(key)) for key in keys))
+        if commit:
+            self.conn.commit()
+
+
+    def fail_jobs(self, stage: str, keys, error: str, commit: bool = True) -> None:
+        self.conn.executemany("""UPDATE ingest_jobs SET status = 'failed', last_error = ?, updated_at = ?
+                                 WHERE stage = ? AND entity_key = ?""", ((error, time(), stage, str(key)) for key in keys))
+        if commit:
+            self.conn.commit()
+
+
+    def get_job_counts(self, stage: str = None) -> dict:
+        """
+        {(stage, status): count}
+        """
+        query = "SELECT stage, status, COUNT(*) FROM ingest_jobs {} GROUP BY stage, status"
+        cursor = self.conn.execute(query.format("WHERE stage = ?"), (stage,)) if stage else self.conn.execute(query.format(""))
+        return {(row[0], row[1]): row[2] for row in cursor.fetchall()}
+
+
+
+    # ================== LYRICS METHODS ==================
+    # lyrics.lyrics holds plain TEXT (legacy rows, short texts) or values compressed by LyricsCodec
+    # with the dictionary they name, new rows are written with the newest dictionary. Raw SQL reads
+    # BLOBs there: on a SongsDB connection use decompress_lyrics(lyrics), get_query_database does it
+    # for the "lyrics" columns.
+
+    def lyrics_codec(self, dict_id: int = None) -> LyricsCodec:
+        """
+        Codec of the dictionary dict_id, the newest one (or no dictionary yet) by default.
+        """
+        if dict_id is None:
+            dict_id = self.conn.execute("SELECT COALESCE(MAX(dict_id), 0) FROM lyrics_dictionaries").fetchone()[0]
+        if dict_id not in self.lyrics_codecs:
+            row = self.conn.execute("SELECT zdict FROM lyrics_dictionaries WHERE dict_id = ?", (dict_id,)).fetchone()
+            if row is None and dict_id != 0:
+                raise ValueError(f"Unknown lyrics dictionary {dict_id}.")
+            self.lyrics_codecs[dict_id] = LyricsCodec(row[0] if row else b"", dict_id)
+        return self.lyrics_codecs[dict_id]
+
+
+    def decode_lyrics(self, value):
+        if not isinstance(value, bytes):
+            return value
+        return self.lyrics_codec(dictionary_id(value)).decode(value)
+
+
+    def _lyrics_row(self, lyrics: LyricsInfo) -> tuple:
+        if None not in self.lyrics_codecs:
+            self.lyrics_codecs[None] = self.lyrics_codec()   # the codec new rows are written with
+        return (lyrics.song_id, self.lyrics_codecs[None].encode(lyrics.lyrics))
+
+
+    def get_lyrics(self, song_id: str):
+        row = self.conn.execute("SELECT lyrics FROM lyrics WHERE song_spotify_id = ?", (song_id,)).fetchone()
+        return None if row is None else self.decode_lyrics(row[0])
+
+
+    def train_lyrics_dictionary(self, sample_size: int = 5000, size: int = 32 * 1024) -> int:
+        """
+        Trains a new shared dictionary on a random sample of the stored lyrics and makes it the one
+        new rows are compressed with. Returns its dict_id, existing rows keep theirs (see compress_lyrics).
+        """
+        samples = (self.decode_lyrics(row[0]) for row in
+                   self.conn.execute("SELECT lyrics FROM lyrics ORDER BY random() LIMIT ?", (sample_size,)))
+        cursor = self.conn.execute("INSERT INTO lyrics_dictionaries (zdict, created_at) VALUES (?, ?)",
+                                   (train_dictionary(samples, size), time()))
+        self.conn.commit()
+        self.lyrics_codecs.pop(None, None)
+        return cursor.lastrowid
+
+
+    def compress_lyrics(self, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        """
+        Rewrites the lyrics not compressed with the newest dictionary, one transaction per batch.
+        Returns the number of rewritten rows. Run VACUUM afterwards to give the space back to the OS.
+        """
+        codec = self.lyrics_codec()
+        self.lyrics_codecs[None] = codec
+        query = f"""SELECT song_spotify_id, lyrics FROM lyrics
+                    WHERE song_spotify_id > ?
+                    AND ((typeof(lyrics) = 'text' AND length(lyrics) >= {MIN_SIZE})
+                         OR (typeof(lyrics) = 'blob' AND substr(lyrics, 1, {len(codec.header)}) <> ?))
+                    ORDER BY song_spotify_id LIMIT ?"""
+        rewritten = 0
+        last = ""
+        while True:
+            rows = self.conn.execute(query, (last, codec.header, batch_size)).fetchall()
+            if not rows:
+                return rewritten
+            self.conn.executemany("UPDATE lyrics SET lyrics = ? WHERE song_spotify_id = ?",
+                                  ((codec.encode(self.decode_lyrics(lyrics)), song_id) for song_id, lyrics in rows))
+            self.conn.commit()
+            rewritten += len(rows)
+            last = rows[-1][0]
+
+
+
+    # ================== ANALYTICS METHODS ==================
+
+    def refresh_aggregates(self, classifier=None) -> list:
+        """
+        Recomputes the feature_aggregates of the release years changed since the last refresh,
+        see db_management/aggregates.py. Returns the refreshed years.
+        """
+        from db_management.aggregates import refresh_aggregates
+        return refresh_aggregates(self, classifier)
+
+
+    def rebuild_aggregates(self, classifier=None) -> None:
+        from db_management.aggregates import rebuild_aggregates
+        rebuild_aggregates(self, classifier)
+
+
+    def check_aggregates(self, classifier=None, rel_tol: float = 1e-9) -> list:
+        """
+        Compares feature_aggregates with a full recomputation, returns the mismatching cells.
+        """
+        from db_management.aggregates import check_aggregates
+        return check_aggregates(self, classifier, rel_tol)
+
+
+    def get_feature_stats(self, by: tuple = ("release_year",), classifier=None) -> pd.DataFrame:
+        """
+        Count, mean and (sample) variance of the audio features grouped by any of
+        release_year, parent_genre, weekday - answered from feature_aggregates.
+        """
+        from db_management.aggregates import feature_stats
+        return feature_stats(self, by, classifier)
+
+
+    def refresh_duplicates(self, title_threshold: float = 0.85, max_feature_distance: float = 0.5) -> int:
+        """
+        Recomputes the song_duplicates clusters, see db_management/duplicates.py.
+        Returns the number of songs collapsed into another one.
+        """
+        from db_management.duplicates import refresh_duplicates
+        return refresh_duplicates(self, title_threshold=title_threshold, max_feature_distance=max_feature_distance)
+
+
+    def refresh_analysis(self, classifier=None, processes: int = None) -> dict:
+        """
+        Recomputes the cached analysis columns of the changed songs and the language of the new lyrics,
+        see db_management/analysis.py. Returns the number of songs and lyrics processed.
+        """
+        from db_management.analysis import refresh_analysis
+        return refresh_analysis(self, classifier, processes)
+
+
+    def build_analysis_frame(self, chunksize: int = None, lyrics: bool = False, collapse_duplicates: bool = False,
+                             refresh: bool = True, classifier=None, processes: int = None):
+        """
+        get_data_full with the derived release_year, weekday, duration_s, <feature>_level, parent_genre
+        and lyrics_language columns, refreshed first unless refresh=False.
+        """
+        from db_management.analysis import build_analysis_frame
+        return build_analysis_frame(self, chunksize, lyrics, collapse_duplicates, refresh, classifier, processes)
     
     
 
@@ -445,20 +1640,29 @@ class SongsDB:
             raise DBException(song_id, popularity, *exception.args)
     
 
+    def update_song_popularity_many(self, popularities, batch_size: int = DEFAULT_BATCH_SIZE, commit: bool = True) -> list:
+        """
+        popularities is an iterable of (song_id, popularity), one transaction per batch.
+        """
+        rows = ((popularity, song_id) for song_id, popularity in popularities)
+        return self._insert_many("""UPDATE songs SET popularity = ? WHERE song_spotify_id = ?""", rows, lambda row: row[1], batch_size, commit)
+    
+
 
 
 
 
     # ================== POPULATE METHODS ==================
 
-    def songs_populate_csv(self, csv_path: str) -> None:
-        songs = SongsContainer()
-        songs.from_csv(csv_path)
-        for song in songs.songs:
-            try:
-                self.songs_insert(song)
-            except:
-                continue
+    def songs_populate_csv(self, csv_path: str, chunksize: int = 100000) -> list:
+        """
+        Streams a scraped "song,artist" CSV into scraped_songs, one transaction per chunk.
+        Returns the (title, artist) rows that were rejected (already stored).
+        """
+        rejected = []
+        for songs in SongsContainer.read_csv_chunks(csv_path, chunksize):
+            rejected.extend(self.scraped_songs_insert_many(songs, batch_size=chunksize))
+        return rejected
         
 
     def close_connection(self) -> None:
@@ -0,0 +1,201 @@
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+
+
+# --- FUZZY DUPLICATE SONGS ---
+#
+# The same track is often on Spotify under several ids: remasters, live versions, "- Remastered 2011"
+# suffixes, compilation albums... Comparing every pair of titles is out of the question, so:
+#
+#   normalize   casefold, accents / punctuation removed, version tags ("(Live)", "- 2011 Remaster",
+#               "(feat. X)") cut off - remixes, acoustic and instrumental versions are kept apart
+#   block       only songs of the same artist sharing a blocking key (title prefix, longest title word)
+#               are compared, and within a key only the WINDOW neighbours in title order
+#   score       trigram Dice similarity of the titles and the RMS distance of the standardized audio
+#               features, both computed with numpy over all the candidate pairs at once
+#   cluster     connected components of the accepted pairs, the canonical song of a cluster is the one
+#               without a version tag, then the most popular, then the oldest
+#
+# song_duplicates keeps every song of a cluster (the canonical one included) with its canonical id.
+
+
+# remasters / live versions change the loudness, liveness and duration, and the estimated mode / key
+# of the same recording flip between releases - those are left out
+FEATURES = ("acousticness", "danceability", "energy", "instrumentalness", "speechiness", "tempo", "valence")
+
+TAGS = r"remaster(?:ed)?|live|version|edit|mono|stereo|deluxe|edition|single|bonus|anniversary|re-?recorded|explicit|clean|feat|ft|featuring"
+BRACKETED_TAG = re.compile(rf"\s*[\(\[][^\)\]]*\b(?:{TAGS}|with|from)\b[^\)\]]*[\)\]]", re.IGNORECASE)
+DASHED_TAG = re.compile(rf"\s+-\s+(?:[^-]*\s)?(?:{TAGS})\b.*$", re.IGNORECASE)
+APOSTROPHES = re.compile(r"['’`]")
+NON_WORD = re.compile(r"[\W_]+")
+
+PREFIX = 6
+WINDOW = 10
+PAIR_CHUNK = 1 << 20
+
+
+
+def normalize_title(title: str) -> tuple:
+    """
+    (normalized title, True when a version tag was removed).
+    """
+    if not isinstance(title, str):
+        return "", False
+    stripped = DASHED_TAG.sub("", BRACKETED_TAG.sub("", title))
+    normalized = _clean(stripped)
+    if not normalized:
+        # a title made only of tags ("(Live)") keeps them
+        return _clean(title), False
+    return normalized, stripped != title
+
+
+def _clean(title: str) -> str:
+    title = title.casefold()
+    if not title.isascii():
+        title = "".join(char for char in unicodedata.normalize("NFKD", title) if not unicodedata.combining(char))
+    title = APOSTROPHES.sub("", title.replace("&", " and "))
+    return NON_WORD.sub(" ", title).strip()
+
+
+def _trigrams(titles) -> tuple:
+    # (trigram ids of every title concatenated, offset of every title), each title's trigrams unique
+    vocabulary = {}
+    grams = []
+    offsets = [0]
+    for title in titles:
+        padded = f"  {title} "
+        ids = {vocabulary.setdefault(padded[idx:idx + 3], len(vocabulary)) for idx in range(len(padded) - 2)}
+        grams.extend(ids)
+        offsets.append(len(grams))
+    return np.array(grams, dtype=np.int64), np.array(offsets, dtype=np.int64), len(vocabulary)
+
+
+def _gather(grams: np.ndarray, offsets: np.ndarray, items: np.ndarray) -> tuple:
+    # (pair of every gathered trigram, trigram) for the titles items[pair]
+    lengths = offsets[items + 1] - offsets[items]
+    pairs = np.repeat(np.arange(len(items)), lengths)
+    within = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return pairs, grams[np.repeat(offsets[items], lengths) + within]
+
+
+def dice(grams: np.ndarray, offsets: np.ndarray, vocabulary_size: int, left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """
+    Trigram Dice similarity of the title pairs (left[i], right[i]), as title indices of _trigrams.
+    """
+    left_pairs, left_grams = _gather(grams, offsets, left)
+    right_pairs, right_grams = _gather(grams, offsets, right)
+    keys = np.sort(np.concatenate([left_pairs * vocabulary_size + left_grams, right_pairs * vocabulary_size + right_grams]))
+    # trigrams are unique per title: a key present twice is shared by both titles of the pair
+    shared = keys[1:][keys[1:] == keys[:-1]] // vocabulary_size
+    common = np.bincount(shared, minlength=len(left))
+    sizes = (offsets[left + 1] - offsets[left]) + (offsets[right + 1] - offsets[right])
+    return np.divide(2 * common, sizes, out=np.zeros(len(left)), where=sizes > 0)
+
+
+def candidate_pairs(keys: pd.Series, titles: pd.Series, window: int = WINDOW) -> np.ndarray:
+    """
+    (n, 2) positions of the rows sharing a blocking key, each row paired with the next `window`
+    rows of its key in title order.
+    """
+    valid = keys.notna().to_numpy()
+    frame = pd.DataFrame({"key": keys[valid].to_numpy(), "title": titles[valid].to_numpy(), "position": np.flatnonzero(valid)})
+    frame = frame.sort_values(["key", "title"], kind="stable")
+    codes = pd.factorize(frame["key"])[0]
+    positions = frame["position"].to_numpy()
+    pairs = []
+    for offset in range(1, window + 1):
+        same = codes[offset:] == codes[:-offset]
+        pairs.append(np.column_stack([positions[:-offset][same], positions[offset:][same]]))
+    return np.concatenate(pairs) if pairs else np.zeros((0, 2), dtype=np.int64)
+
+
+def _components(n: int, pairs: np.ndarray) -> np.ndarray:
+    # smallest row position of the connected component of every row
+    labels = np.arange(n)
+    while True:
+        smallest = np.minimum(labels[pairs[:, 0]], labels[pairs[:, 1]])
+        updated = labels.copy()
+        np.minimum.at(updated, pairs[:, 0], smallest)
+        np.minimum.at(updated, pairs[:, 1], smallest)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+
+def load_songs(db) -> pd.DataFrame:
+    cursor = db.conn.execute(f"""SELECT s.song_spotify_id, s.artist_spotify_id, s.title, s.release_date, s.popularity,
+                                        {", ".join("f." + feature for feature in FEATURES)}
+                                 FROM songs s LEFT JOIN songs_features f ON s.song_spotify_id = f.song_spotify_id""")
+    return pd.DataFrame(cursor.fetchall(), columns=["song_id", "artist_id", "title", "release_date", "popularity"] + list(FEATURES))
+
+
+def find_duplicates(db, title_threshold: float = 0.85, max_feature_distance: float = 0.5, window: int = WINDOW) -> pd.DataFrame:
+    """
+    Clusters of duplicate songs: a DataFrame song_id, canonical_id, score of every song with at least one
+    duplicate. A pair is a duplicate when the titles' Dice similarity reaches title_threshold and the RMS
+    distance of the standardized features is at most max_feature_distance (skipped when a song has no features).
+    """
+    songs = load_songs(db)
+    columns = ["song_id", "canonical_id", "score"]
+    if songs.empty:
+        return pd.DataFrame(columns=columns)
+
+    codes, titles = pd.factorize(songs["title"].fillna(""))
+    normalized = [normalize_title(title) for title in titles]
+    songs["normalized"] = np.array([title for title, _ in normalized], dtype=object)[codes]
+    songs["tagged"] = np.array([tagged for _, tagged in normalized], dtype=bool)[codes]
+    title_ids, unique_titles = pd.factorize(songs["normalized"])
+    grams, offsets, vocabulary_size = _trigrams(unique_titles)
+
+    named = songs["normalized"] != ""
+    words = songs["normalized"].str.split()
+    blocks = [songs["artist_id"] + "\x1f" + songs["normalized"].str[:PREFIX],
+              songs["artist_id"] + "\x1f" + words.map(lambda tokens: max(tokens, key=len) if tokens else None)]
+    pairs = np.concatenate([candidate_pairs(key.where(named), songs["normalized"], window) for key in blocks])
+    pairs = np.unique(np.sort(pairs, axis=1), axis=0) if len(pairs) else pairs
+
+    features = songs[list(FEATURES)].to_numpy(dtype=np.float64)
+    scale = np.nanstd(features, axis=0)
+    features = (features - np.nanmean(features, axis=0)) / np.where(scale > 0, scale, 1.0)
+
+    accepted, scores = [], []
+    for start in range(0, len(pairs), PAIR_CHUNK):
+        chunk = pairs[start:start + PAIR_CHUNK]
+        similarity = dice(grams, offsets, vocabulary_size, title_ids[chunk[:, 0]], title_ids[chunk[:, 1]])
+        distance = np.sqrt(np.mean((features[chunk[:, 0]] - features[chunk[:, 1]]) ** 2, axis=1))
+        keep = (similarity >= title_threshold) & ~(distance > max_feature_distance)     # NaN distance: no features
+        accepted.append(chunk[keep])
+        scores.append((similarity * np.exp(-np.nan_to_num(distance)))[keep])
+    if not accepted or not sum(len(chunk) for chunk in accepted):
+        return pd.DataFrame(columns=columns)
+    accepted, scores = np.concatenate(accepted), np.concatenate(scores)
+
+    songs["cluster"] = _components(len(songs), accepted)
+    best = np.zeros(len(songs))
+    np.maximum.at(best, accepted[:, 0], scores)
+    np.maximum.at(best, accepted[:, 1], scores)
+    songs["score"] = best
+    members = songs[songs["cluster"].duplicated(keep=False)]
+    ordered = members.sort_values(["cluster", "tagged", "popularity", "release_date", "song_id"],
+                                  ascending=[True, True, False, True, True], na_position="last")
+    canonical = ordered.groupby("cluster")["song_id"].first()
+    result = pd.DataFrame({"song_id": members["song_id"], "canonical_id": members["cluster"].map(canonical), "score": members["score"]})
+    result.loc[result["song_id"] == result["canonical_id"], "score"] = 1.0
+    return result.reset_index(drop=True)
+
+
+def refresh_duplicates(db, **kwargs) -> int:
+    """
+    Recomputes song_duplicates, returns the number of duplicate (non canonical) songs.
+    """
+    duplicates = find_duplicates(db, **kwargs)
+    db.conn.execute("DELETE FROM song_duplicates")
+    db.conn.executemany("INSERT INTO song_duplicates (song_spotify_id, canonical_spotify_id, score) VALUES (?, ?, ?)",
+                        duplicates[["song_id", "canonical_id", "score"]].itertuples(index=False, name=None))
+    db.conn.commit()
+    return int((duplicates["song_id"] != duplicates["canonical_id"]).sum())
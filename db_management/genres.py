@@ -0,0 +1,76 @@
+import hashlib
+import json
+import re
+
+import pandas as pd
+
+from assets.static.genre_map import genre_map as GENRE_MAP
+
+
+
+class GenreClassifier:
+    """
+    Maps the comma-separated Spotify genres of an artist ("dance pop,pop,post-teen pop") to one parent genre.
+
+    The genre map is compiled once into a single regex, alternatives ordered longest first, so at every
+    position the longest key wins ("post-rock" over "rock", "k-pop" over "pop"). The parent genre with
+    the most matches wins, ties go to the one matched first. Results are memoized per raw genres string,
+    in memory and - when a SongsDB is given - in its genre_mapping table.
+    """
+
+    def __init__(self, genre_map: dict = None, db=None):
+        self.genre_map = dict(GENRE_MAP if genre_map is None else genre_map)
+        keys = sorted(self.genre_map, key=lambda key: (-len(key), key))
+        self.pattern = re.compile("|".join(re.escape(key) for key in keys))
+        self.categories = sorted(set(self.genre_map.values()))
+        self.version = hashlib.sha1(json.dumps(self.genre_map, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        self.db = db
+        self.cache = db.get_genre_mapping(self.version) if db is not None else {}
+
+
+    def classify(self, genres: str):
+        """
+        Parent genre of one genres string, None when nothing matches.
+        """
+        if not isinstance(genres, str) or not genres:
+            return None
+        if genres in self.cache:
+            return self.cache[genres]
+        parent_genre = self._match(genres)
+        self.cache[genres] = parent_genre
+        return parent_genre
+
+
+    def classify_series(self, genres: pd.Series) -> pd.Series:
+        """
+        Vectorized classify: every distinct genres string is resolved once, the result is a categorical
+        with the same categories (the parent genres of the map) for every call.
+        """
+        codes, uniques = pd.factorize(genres, use_na_sentinel=True)
+        new = {}
+        parents = []
+        for value in uniques:
+            if value not in self.cache:
+                new[value] = self._match(value) if isinstance(value, str) and value else None
+                self.cache[value] = new[value]
+            parents.append(self.cache[value])
+        if new and self.db is not None:
+            self.db.genre_mapping_insert_many(new, self.version)
+
+        dtype = pd.CategoricalDtype(self.categories)
+        parent_codes = pd.Categorical(parents, dtype=dtype).codes
+        # -1 (missing) in codes has to stay -1 after the lookup
+        result_codes = parent_codes.take(codes) if len(parent_codes) else codes
+        result_codes[codes == -1] = -1
+        return pd.Series(pd.Categorical.from_codes(result_codes, dtype=dtype), index=genres.index, name=genres.name)
+
+
+    def _match(self, genres: str):
+        counts = {}
+        for position, match in enumerate(self.pattern.finditer(genres.casefold())):
+            parent_genre = self.genre_map[match.group()]
+            count, first = counts.get(parent_genre, (0, position))
+            counts[parent_genre] = (count + 1, first)
+        if not counts:
+            return None
+        return min(counts, key=lambda parent_genre: (-counts[parent_genre][0], counts[parent_genre][1]))
@@ -0,0 +1,388 @@
+import inspect
+import json
+import threading
+from bisect import bisect_left
+from collections import deque
+from functools import wraps
+from time import perf_counter, time
+
+
+
+# --- SONGSDB INSTRUMENTATION ---
+#
+# Opt-in, see SongsDB.enable_instrumentation. Nothing is wrapped while it is off: enabling shadows the
+# public SongsDB methods with timing wrappers on the instance and swaps db.conn / db.cursor for thin
+# proxies, disabling deletes the wrappers and puts the sqlite3 objects back.
+#
+#   per method  calls, latency histogram (inclusive of nested calls), time spent inside SQLite calls
+#               (execute / fetch / commit, attributed to the innermost running method), rows written
+#               (cursor.rowcount), rows fetched, bytes of the fetched values, commits
+#   slow log    get_query_database calls above slow_query_threshold, with their EXPLAIN QUERY PLAN,
+#               kept in memory (last SLOW_LOG_SIZE) and appended as JSON lines to slow_log_path
+#
+# Methods returning a generator (get_data with chunksize, get_features_chunks...) are timed while the
+# generator is consumed. Export with to_dict / to_json / to_prometheus.
+
+
+# histogram upper bounds in seconds, +Inf is implicit
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SLOW_LOG_SIZE = 1000
+
+# not instrumented: context managers, teardown and the per-value lyrics helpers (called once per row of get_data)
+EXCLUDED = {"bulk_load", "close_connection", "enable_instrumentation", "disable_instrumentation", "decode_lyrics", "lyrics_codec"}
+
+
+
+class MethodStats:
+
+    __slots__ = ("calls", "errors", "seconds", "sql_seconds", "buckets", "rows_written", "rows_fetched", "bytes_fetched", "commits")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.sql_seconds = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.rows_written = 0
+        self.rows_fetched = 0
+        self.bytes_fetched = 0
+        self.commits = 0
+
+
+    def observe(self, seconds: float) -> None:
+        self.seconds += seconds
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+
+
+    def to_dict(self) -> dict:
+        result = {name: getattr(self, name) for name in self.__slots__ if name != "buckets"}
+        result["python_seconds"] = max(self.seconds - self.sql_seconds, 0.0)
+        result["histogram"] = dict(zip([str(bound) for bound in BUCKETS] + ["+Inf"], self.buckets))
+        return result
+
+
+
+class Instrumentation:
+    """
+    Metrics of one SongsDB connection. SQL issued outside of any instrumented method is recorded
+    under the "<none>" method.
+    """
+
+    def __init__(self, slow_query_threshold: float = 0.5, slow_log_path: str = None):
+        if slow_query_threshold < 0:
+            raise ValueError("slow_query_threshold must be non negative.")
+        self.slow_query_threshold = slow_query_threshold
+        self.slow_log_path = slow_log_path
+        self.methods = {}
+        self.slow_queries = deque(maxlen=SLOW_LOG_SIZE)
+        self.slow_query_count = 0
+        self.started_at = time()
+        self.local = threading.local()
+
+
+    def stats(self, method: str) -> MethodStats:
+        stats = self.methods.get(method)
+        if stats is None:
+            stats = self.methods[method] = MethodStats()
+        return stats
+
+
+    @property
+    def current(self) -> MethodStats:
+        stack = getattr(self.local, "stack", None)
+        return stack[-1] if stack else self.stats("<none>")
+
+
+    def enter(self, stats: MethodStats) -> None:
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        stack.append(stats)
+
+
+    def exit(self) -> None:
+        self.local.stack.pop()
+
+
+    def reset(self) -> None:
+        self.methods.clear()
+        self.slow_queries.clear()
+        self.slow_query_count = 0
+        self.started_at = time()
+
+
+    def log_slow_query(self, query: str, seconds: float, rows: int, plan: list) -> None:
+        entry = {"timestamp": time(), "seconds": seconds, "rows": rows, "query": " ".join(query.split()), "plan": plan}
+        self.slow_queries.append(entry)
+        self.slow_query_count += 1
+        if self.slow_log_path is not None:
+            with open(self.slow_log_path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(entry) + "\n")
+
+
+    # ================== EXPORT ==================
+
+    def to_dict(self) -> dict:
+        methods = {name: stats.to_dict() for name, stats in sorted(self.methods.items())}
+        totals = {key: sum(stats[key] for stats in methods.values())
+                  for key in ("calls", "errors", "sql_seconds", "rows_written", "rows_fetched", "bytes_fetched", "commits")}
+        return {"started_at": self.started_at, "slow_query_threshold": self.slow_query_threshold, "totals": totals,
+                "methods": methods, "slow_query_count": self.slow_query_count, "slow_queries": list(self.slow_queries)}
+
+
+    def to_json(self, path: str = None, indent: int = 2) -> str:
+        text = json.dumps(self.to_dict(), indent=indent)
+        if path is not None:
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(text)
+        return text
+
+
+    def to_prometheus(self, prefix: str = "songsdb") -> str:
+        """
+        Prometheus text exposition format.
+        """
+        counters = [("calls_total", "calls", "Calls of the method."),
+                    ("errors_total", "errors", "Calls of the method that raised."),
+                    ("sql_seconds_total", "sql_seconds", "Time spent in SQLite calls made by the method."),
+                    ("rows_written_total", "rows_written", "Rows inserted, updated or deleted by the method."),
+                    ("rows_fetched_total", "rows_fetched", "Rows fetched by the method."),
+                    ("bytes_fetched_total", "bytes_fetched", "Bytes of the values fetched by the method."),
+                    ("commits_total", "commits", "Commits issued by the method.")]
+        lines = []
+        for metric, attribute, help_text in counters:
+            lines += [f"# HELP {prefix}_{metric} {help_text}", f"# TYPE {prefix}_{metric} counter"]
+            lines += [f'{prefix}_{metric}{{method="{name}"}} {getattr(stats, attribute)}' for name, stats in sorted(self.methods.items())]
+
+        lines += [f"# HELP {prefix}_method_seconds Latency of the method.", f"# TYPE {prefix}_method_seconds histogram"]
+        for name, stats in sorted(self.methods.items()):
+            if not any(stats.buckets):
+                continue
+            cumulative = 0
+            for bound, count in zip([str(bound) for bound in BUCKETS] + ["+Inf"], stats.buckets):
+                cumulative += count
+                lines.append(f'{prefix}_method_seconds_bucket{{method="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_method_seconds_sum{{method="{name}"}} {stats.seconds}')
+            lines.append(f'{prefix}_method_seconds_count{{method="{name}"}} {cumulative}')
+
+        lines += [f"# HELP {prefix}_slow_queries_total get_query_database calls above the slow query threshold.",
+                  f"# TYPE {prefix}_slow_queries_total counter", f"{prefix}_slow_queries_total {self.slow_query_count}"]
+        return "\n".join(lines) + "\n"
+
+
+
+# ================== SQLITE PROXIES ==================
+
+def _value_bytes(row) -> int:
+    return sum(len(value) if isinstance(value, (str, bytes)) else 8 for value in row)
+
+
+class CursorProxy:
+    """
+    sqlite3.Cursor recording the time of its calls, the rows it writes and fetches.
+    """
+
+    def __init__(self, cursor, instrumentation: Instrumentation):
+        self._cursor = cursor
+        self._instrumentation = instrumentation
+
+
+    def _written(self, stats: MethodStats, start: float) -> None:
+        stats.sql_seconds += perf_counter() - start
+        if self._cursor.rowcount > 0:
+            stats.rows_written += self._cursor.rowcount
+
+
+    def _fetched(self, stats: MethodStats, start: float, rows: list) -> None:
+        stats.sql_seconds += perf_counter() - start
+        stats.rows_fetched += len(rows)
+        stats.bytes_fetched += sum(_value_bytes(row) for row in rows)
+
+
+    def execute(self, query: str, params=()) -> "CursorProxy":
+        stats, start = self._instrumentation.current, perf_counter()
+        self._cursor.execute(query, params)
+        self._written(stats, start)
+        return self
+
+
+    def executemany(self, query: str, rows) -> "CursorProxy":
+        stats, start = self._instrumentation.current, perf_counter()
+        self._cursor.executemany(query, rows)
+        self._written(stats, start)
+        return self
+
+
+    def executescript(self, script: str) -> "CursorProxy":
+        stats, start = self._instrumentation.current, perf_counter()
+        self._cursor.executescript(script)
+        stats.sql_seconds += perf_counter() - start
+        return self
+
+
+    def fetchone(self):
+        stats, start = self._instrumentation.current, perf_counter()
+        row = self._cursor.fetchone()
+        self._fetched(stats, start, [] if row is None else [row])
+        return row
+
+
+    def fetchmany(self, size: int = None) -> list:
+        stats, start = self._instrumentation.current, perf_counter()
+        rows = self._cursor.fetchmany(self._cursor.arraysize if size is None else size)
+        self._fetched(stats, start, rows)
+        return rows
+
+
+    def fetchall(self) -> list:
+        stats, start = self._instrumentation.current, perf_counter()
+        rows = self._cursor.fetchall()
+        self._fetched(stats, start, rows)
+        return rows
+
+
+    def __iter__(self):
+        return self
+
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+
+    def __getattr__(self, name: str):
+        return getattr(self._cursor, name)
+
+
+
+class ConnectionProxy:
+    """
+    sqlite3.Connection whose cursors are CursorProxy and whose commits are counted.
+    """
+
+    def __init__(self, conn, instrumentation: Instrumentation):
+        self._conn = conn
+        self._instrumentation = instrumentation
+
+
+    def cursor(self) -> CursorProxy:
+        return CursorProxy(self._conn.cursor(), self._instrumentation)
+
+
+    def execute(self, query: str, params=()) -> CursorProxy:
+        return self.cursor().execute(query, params)
+
+
+    def executemany(self, query: str, rows) -> CursorProxy:
+        return self.cursor().executemany(query, rows)
+
+
+    def executescript(self, script: str) -> CursorProxy:
+        return self.cursor().executescript(script)
+
+
+    def commit(self) -> None:
+        stats, start = self._instrumentation.current, perf_counter()
+        self._conn.commit()
+        stats.sql_seconds += perf_counter() - start
+        stats.commits += 1
+
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            self._instrumentation.current.commits += 1
+        return self._conn.__exit__(*exc_info)
+
+
+    def __getattr__(self, name: str):
+        return getattr(self._conn, name)
+
+
+
+# ================== METHOD WRAPPERS ==================
+
+def _timed_generator(instrumentation: Instrumentation, stats: MethodStats, generator, seconds: float):
+    # the method is "running" (and its SQL attributed to it) only while the generator is advanced,
+    # its latency is observed once the generator is exhausted or closed
+    try:
+        while True:
+            instrumentation.enter(stats)
+            start = perf_counter()
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+            except Exception:
+                stats.errors += 1
+                raise
+            finally:
+                seconds += perf_counter() - start
+                instrumentation.exit()
+            yield item
+    finally:
+        generator.close()
+        stats.observe(seconds)
+
+
+def _wrap(db, name: str, method):
+    instrumentation = db.instrumentation
+
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        stats = instrumentation.stats(name)
+        stats.calls += 1
+        instrumentation.enter(stats)
+        start = perf_counter()
+        try:
+            result = method(*args, **kwargs)
+        except Exception:
+            stats.errors += 1
+            stats.observe(perf_counter() - start)
+            raise
+        finally:
+            instrumentation.exit()
+        seconds = perf_counter() - start
+        if inspect.isgenerator(result):
+            return _timed_generator(instrumentation, stats, result, seconds)
+        stats.observe(seconds)
+        if name == "get_query_database" and seconds >= instrumentation.slow_query_threshold:
+            _log_slow_query(db, args[0] if args else kwargs["query"], seconds, len(result))
+        return result
+    return wrapper
+
+
+def _log_slow_query(db, query: str, seconds: float, rows: int) -> None:
+    try:
+        plan = db.explain(query)
+    except Exception as exception:     # the query ran, but is not explainable (e.g. several statements)
+        plan = [f"EXPLAIN QUERY PLAN failed: {exception}"]
+    db.instrumentation.log_slow_query(query, seconds, rows, plan)
+
+
+def instrumented_methods(cls) -> list:
+    return [name for name, member in inspect.getmembers(cls, inspect.isfunction)
+            if not name.startswith("_") and name not in EXCLUDED]
+
+
+def install(db, instrumentation: Instrumentation) -> None:
+    db.instrumentation = instrumentation
+    db.conn = ConnectionProxy(db.conn, instrumentation)
+    db.cursor = CursorProxy(db.cursor, instrumentation)
+    for name in instrumented_methods(type(db)):
+        setattr(db, name, _wrap(db, name, getattr(db, name)))
+
+
+def uninstall(db) -> None:
+    for name in instrumented_methods(type(db)):
+        db.__dict__.pop(name, None)
+    if isinstance(db.conn, ConnectionProxy):
+        db.conn = db.conn._conn
+    if isinstance(db.cursor, CursorProxy):
+        db.cursor = db.cursor._cursor
@@ -0,0 +1,210 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from html.parser import HTMLParser
+from time import monotonic
+
+from db_management.db import SongsDB, LyricsInfo
+from db_management.pipeline import GeniusClient
+
+
+
+# --- LYRICS STAGE ---
+#
+# Fetching (Genius search + the lyrics page) stays on threads, the CPU-bound HTML -> text extraction
+# runs in a process pool, and SongsDB.lyrics_insert_many stores the text compressed (see compression.py).
+
+
+LYRICS_CONTAINER = "Lyrics__Container"
+CONTAINER_START = re.compile(r'<div\b[^>]*\bclass="(?:[^"]*\s)?' + LYRICS_CONTAINER)
+SECTION_HEADER = re.compile(r"\[.*?\]")
+CHUNK = 8192
+
+
+class _LyricsParser(HTMLParser):
+    """
+    Collects the text nodes inside <div class="Lyrics__Container..."> (nested divs included).
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.depth = 0
+        self.opened = False
+        self.parts = []
+        self.text = []      # a text node can arrive in pieces when it spans two fed chunks
+
+
+    def _flush(self):
+        if self.text:
+            self.parts.append("".join(self.text))
+            self.text = []
+
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        if tag != "div":
+            return
+        if self.depth:
+            self.depth += 1
+        elif any(name == "class" and value and any(item.startswith(LYRICS_CONTAINER) for item in value.split())
+                 for name, value in attrs):
+            self.depth = 1
+            self.opened = True
+
+
+    def handle_endtag(self, tag):
+        self._flush()
+        if tag == "div" and self.depth:
+            self.depth -= 1
+
+
+    def handle_data(self, data):
+        if self.depth:
+            self.text.append(data)
+
+
+
+def extract_lyrics(html: str) -> str:
+    """
+    Lyrics text of a Genius song page, "" when it has none (instrumentals). Like the notebook's
+    BeautifulSoup version the text nodes are joined with spaces and [Section] headers are removed,
+    but every lyrics container is read, not only the first one. Only the containers are parsed,
+    the page around them is skipped with a regex search.
+    """
+    parser = _LyricsParser()
+    match = CONTAINER_START.search(html)
+    while match is not None:
+        parser.reset()
+        parser.opened = False
+        pos = match.start()
+        match = None
+        while pos < len(html):
+            parser.feed(html[pos:pos + CHUNK])
+            pos += CHUNK
+            if parser.opened and not parser.depth:
+                # container closed - jump to the next one, unparsed input included (a tag cut by the chunk)
+                match = CONTAINER_START.search(html, pos - len(parser.rawdata))
+                break
+    return SECTION_HEADER.sub("", " ".join(parser.parts))
+
+
+
+def search_title(title: str) -> str:
+    """
+    Title without the " - Remastered" / "(feat. ...)" suffixes, which make the Genius search miss.
+    """
+    if " - " in title:
+        title = title.split(" - ")[0]
+    if "(" in title and title[0] != "(":
+        title = title.split("(")[0]
+    return " ".join(title.split())
+
+
+
+class LyricsPipeline:
+    """
+    Runs the "lyrics" ingest_jobs: claims songs, fetches their pages on `workers` threads, extracts the
+    text in `processes` worker processes and writes each claimed chunk with one lyrics_insert_many.
+    Songs without a matching Genius hit get "" (as the notebook stored them), fetch errors fail the job.
+    """
+
+    def __init__(self, db_path: str, genius: GeniusClient, workers: int = 30, processes: int = None,
+                 claim_size: int = 200, worker_id: str = None, lease: float = 600, max_attempts: int = 3):
+        self.db_path = db_path
+        self.genius = genius
+        self.workers = workers
+        self.processes = processes or os.cpu_count()
+        self.claim_size = claim_size
+        self.worker_id = worker_id or f"{os.getpid()}-{id(self):x}"
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+
+    def run(self, song_ids: list = None) -> dict:
+        """
+        Over song_ids when given, otherwise over the claimed "lyrics" jobs. Returns the run statistics.
+        """
+        stats = {"keys": 0, "written": 0, "empty": 0, "failed": 0, "rejected": [], "errors": [],
+                 "requests": 0, "seconds": 0.0}
+        requests_before = self.genius.requests_count
+        start = monotonic()
+        db = SongsDB(self.db_path)
+        try:
+            with ThreadPoolExecutor(self.workers) as fetchers, ProcessPoolExecutor(self.processes) as parsers:
+                for batch in (self._batches(song_ids) if song_ids is not None else self._claimed_batches(db)):
+                    stats["keys"] += len(batch)
+                    self._run_batch(db, batch, song_ids is None, fetchers, parsers, stats)
+        finally:
+            db.close_connection()
+        stats["requests"] = self.genius.requests_count - requests_before
+        stats["seconds"] = monotonic() - start
+        return stats
+
+
+    def _batches(self, song_ids: list):
+        for idx in range(0, len(song_ids), self.claim_size):
+            yield song_ids[idx:idx + self.claim_size]
+
+
+    def _claimed_batches(self, db: SongsDB):
+        if not db.jobs_seeded("lyrics"):
+            db.seed_jobs("lyrics")
+        while True:
+            claimed = db.claim_jobs("lyrics", self.claim_size, self.worker_id, self.lease, self.max_attempts)
+            if not claimed:
+                return
+            yield claimed
+
+
+    def _run_batch(self, db: SongsDB, batch: list, jobs: bool, fetchers, parsers, stats: dict) -> None:
+        songs = self._songs(db, batch)
+        failed = {song_id: "artist not stored yet" for song_id in batch if song_id not in songs}
+
+        # each page goes to the process pool as soon as it is downloaded
+        fetches = {fetchers.submit(self._fetch_page, title, artist): song_id for song_id, (title, artist) in songs.items()}
+        parses = {}
+        lyrics = []
+        for future in as_completed(fetches):
+            song_id = fetches[future]
+            try:
+                html = future.result()
+            except Exception as exception:
+                failed[song_id] = repr(exception)
+                continue
+            if html:
+                parses[parsers.submit(extract_lyrics, html)] = song_id
+            else:
+                lyrics.append(LyricsInfo(song_id, ""))
+        for future in as_completed(parses):
+            try:
+                lyrics.append(LyricsInfo(parses[future], future.result()))
+            except Exception as exception:
+                failed[parses[future]] = repr(exception)
+
+        # the lyrics and the status of their jobs are committed together
+        rejected = db.lyrics_insert_many(lyrics, commit=False)
+        stats["written"] += len(lyrics) - len(rejected)
+        stats["empty"] += sum(1 for item in lyrics if not item.lyrics)
+        stats["rejected"].extend(rejected)
+        stats["failed"] += len(failed)
+        stats["errors"].extend(failed.items())
+        if jobs:
+            for song_id, error in failed.items():
+                db.fail_jobs("lyrics", [song_id], error, commit=False)
+            # rejected rows are already stored, their jobs are done as well
+            db.complete_jobs("lyrics", (item.song_id for item in lyrics), commit=False)
+        db.conn.commit()
+
+
+    @staticmethod
+    def _songs(db: SongsDB, song_ids: list) -> dict:
+        # song_id -> (title, artist name), songs whose artist is not stored yet are left out
+        cursor = db.conn.execute(f"""SELECT s.song_spotify_id, s.title, a.name FROM songs s
+                                     JOIN artists a ON s.artist_spotify_id = a.artist_spotify_id
+                                     WHERE s.song_spotify_id IN ({", ".join("?" * len(song_ids))})""", song_ids)
+        return {song_id: (title, artist) for song_id, title, artist in cursor}
+
+
+    def _fetch_page(self, title: str, artist: str) -> str:
+        url = self.genius.song_url(search_title(title), artist)
+        return self.genius.get_text(url) if url else ""
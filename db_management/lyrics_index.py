@@ -0,0 +1,379 @@
+import json
+import os
+import re
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from db_management.genres import GenreClassifier
+
+
+
+# --- LYRICS TERM INDEX ---
+#
+# Lyrics tokenized once into a term-count matrix kept on disk in CSR form, append-only:
+#
+#   <path>/_manifest.json    rows / nnz / terms written and the last data_changes.seq indexed
+#   <path>/vocabulary.txt    one term per line, line number = column
+#   <path>/song_ids.txt      one song id per line, line number = row
+#   <path>/indptr.bin        int64,  rows + 1
+#   <path>/indices.bin       int32,  nnz (column of every stored count)
+#   <path>/counts.bin        uint16, nnz
+#
+# The .bin files are memory-mapped for reading. New / changed lyrics (data_changes) are appended as new
+# rows, the last row of a song wins, a deleted lyrics row appends an empty one. Songs whose last row is
+# empty (instrumentals, deleted lyrics) are not part of the results. Anything past the manifest sizes
+# (an interrupted update) is cut off on the next update.
+#
+# compact() does not overwrite the files: it writes the next generation next to them ("indices.3.bin",
+# "song_ids.3.txt", the generation of every file is in the manifest) and the manifest switches to it,
+# the old generation is deleted afterwards. An interrupted compaction leaves the index as it was.
+
+
+MANIFEST = "_manifest.json"
+VOCABULARY = "vocabulary.txt"
+SONG_IDS = "song_ids.txt"
+# the files rewritten by compact(), in any generation
+GENERATION_FILE = re.compile(r"(?:indptr|indices|counts)(?:\.\d+)?\.bin|song_ids(?:\.\d+)?\.txt")
+
+# the default token_pattern (and lowercasing) of sklearn's CountVectorizer / TfidfVectorizer
+TOKEN = re.compile(r"(?u)\b\w\w+\b")
+UNKNOWN = "unknown"
+KEYS = ("release_year", "parent_genre")
+
+
+def tokenize(text: str) -> list:
+    return TOKEN.findall(text.lower()) if text else []
+
+
+
+class LyricsIndex:
+
+    ARRAYS = {"indptr": np.int64, "indices": np.int32, "counts": np.uint16}
+
+
+    def __init__(self, path: str):
+        self.path = path
+        self.manifest = self._read_manifest()
+        self.vocabulary = self._read_lines(VOCABULARY, self.manifest["terms"])
+        self.term_ids = {term: idx for idx, term in enumerate(self.vocabulary)}
+        self.song_ids = self._read_lines(SONG_IDS, self.manifest["rows"])
+
+
+    def __len__(self) -> int:
+        """
+        Number of indexed songs (live rows).
+        """
+        return len(self.live_rows())
+
+
+    # ================== UPDATE ==================
+
+    def update(self, db, chunksize: int = 5000, compact_ratio: float = 1.0) -> int:
+        """
+        Indexes the lyrics changed since the previous update (all of them the first time).
+        Compacts the files when the superseded rows outnumber compact_ratio * live rows.
+        Returns the number of rows appended.
+        """
+        last_change = db.last_change()
+        if not db.changes_available(self.manifest["last_change"]) or not self._truncate():
+            self._reset()
+            self._truncate()
+        if self.manifest["rows"] == 0 and self.manifest["last_change"] == 0:
+            cursor = db.conn.execute("SELECT song_spotify_id, lyrics FROM lyrics ORDER BY rowid")
+            documents = (row for rows in iter(lambda: cursor.fetchmany(chunksize), []) for row in rows)
+        else:
+            changed = [row[0] for row in db.conn.execute("""SELECT DISTINCT entity_id FROM data_changes
+                                                             WHERE table_name = 'lyrics' AND seq > ? AND seq <= ?""",
+                                                         (self.manifest["last_change"], last_change))]
+            documents = self._changed_documents(db, changed)
+
+        appended = 0
+        batch = []
+        for song_id, lyrics in documents:
+            batch.append((song_id, db.decode_lyrics(lyrics)))
+            if len(batch) == chunksize:
+                appended += self._append(batch)
+                batch = []
+        if batch:
+            appended += self._append(batch)
+
+        self.manifest["last_change"] = last_change
+        self._write_manifest()
+        db.set_changes_marker("lyrics_index_seq", self.path, last_change)
+        db.prune_changes()
+        if self.manifest["rows"] - len(self.live_rows()) > compact_ratio * max(len(self.live_rows()), 1):
+            self.compact()
+        return appended
+
+
+    @staticmethod
+    def _changed_documents(db, song_ids: list):
+        for idx in range(0, len(song_ids), 500):
+            chunk = song_ids[idx:idx + 500]
+            stored = dict(db.conn.execute(f"SELECT song_spotify_id, lyrics FROM lyrics WHERE song_spotify_id IN ({', '.join('?' * len(chunk))})",
+                                          chunk).fetchall())
+            for song_id in chunk:
+                yield song_id, stored.get(song_id)     # None (deleted) -> empty row
+
+
+    def _append(self, documents: list) -> int:
+        indptr, indices, counts = [], [], []
+        nnz = self.manifest["nnz"]
+        new_terms = []
+        for _, text in documents:
+            terms = Counter(tokenize(text))
+            columns = []
+            for term, count in terms.items():
+                column = self.term_ids.get(term)
+                if column is None:
+                    column = self.term_ids[term] = len(self.vocabulary)
+                    self.vocabulary.append(term)
+                    new_terms.append(term)
+                columns.append((column, min(count, 65535)))
+            columns.sort()
+            indices.extend(column for column, _ in columns)
+            counts.extend(count for _, count in columns)
+            nnz += len(columns)
+            indptr.append(nnz)
+        self.song_ids.extend(song_id for song_id, _ in documents)
+
+        if self.manifest["rows"] == 0:
+            indptr.insert(0, 0)
+        self._append_array("indptr", indptr)
+        self._append_array("indices", indices)
+        self._append_array("counts", counts)
+        self._append_lines(VOCABULARY, new_terms)
+        self._append_lines(SONG_IDS, [song_id for song_id, _ in documents])
+
+        self.manifest["rows"] += len(documents)
+        self.manifest["nnz"] = nnz
+        self.manifest["terms"] = len(self.vocabulary)
+        return len(documents)
+
+
+    def compact(self) -> None:
+        """
+        Rewrites the files with the live rows only (the vocabulary is kept, so columns do not move).
+        """
+        rows = self.live_rows()
+        indptr, indices, counts = self.arrays()
+        starts, ends = indptr[rows], indptr[rows + 1]
+        lengths = ends - starts
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        keep = np.arange(offsets[-1]) + np.repeat(starts - offsets[:-1], lengths)
+        arrays = {"indptr": offsets,
+                  "indices": np.asarray(indices[keep]), "counts": np.asarray(counts[keep])}
+        song_ids = [self.song_ids[row] for row in rows]
+
+        generation = max(self.manifest.get("generations", {}).values(), default=0) + 1
+        for name, values in arrays.items():
+            values.astype(self.ARRAYS[name]).tofile(self._file(name, generation))
+        with open(self._file(SONG_IDS, generation), "w", encoding="utf-8") as file:
+            file.writelines(song_id + "\n" for song_id in song_ids)
+
+        # the manifest is the switch to the new generation
+        self.song_ids = song_ids
+        self.manifest["generations"] = {name: generation for name in list(arrays) + [SONG_IDS]}
+        self.manifest["rows"] = len(song_ids)
+        self.manifest["nnz"] = int(offsets[-1])
+        self._write_manifest()
+        self._remove_stale()
+
+
+    # ================== READ ==================
+
+    def arrays(self) -> tuple:
+        """
+        (indptr, indices, counts) as read-only memory maps.
+        """
+        lengths = {"indptr": self.manifest["rows"] + 1 if self.manifest["rows"] else 0,
+                   "indices": self.manifest["nnz"], "counts": self.manifest["nnz"]}
+        return tuple(np.memmap(self._file(name), dtype=dtype, mode="r", shape=(lengths[name],)) if lengths[name]
+                     else np.zeros(1 if name == "indptr" else 0, dtype=dtype)
+                     for name, dtype in self.ARRAYS.items())
+
+
+    def live_rows(self) -> np.ndarray:
+        """
+        Row of the latest version of every song, in row order, without the empty rows.
+        """
+        latest = {song_id: row for row, song_id in enumerate(self.song_ids)}
+        rows = np.sort(np.fromiter(latest.values(), dtype=np.int64, count=len(latest)))
+        indptr = self.arrays()[0]
+        return rows[indptr[rows + 1] > indptr[rows]] if len(rows) else rows
+
+
+    def matrix(self):
+        """
+        scipy.sparse.csr_matrix over the memory maps (all rows, superseded ones included - select live_rows()),
+        f.ex. as input of sklearn's TfidfTransformer.
+        """
+        from scipy.sparse import csr_matrix
+        indptr, indices, counts = self.arrays()
+        return csr_matrix((counts, indices, indptr), shape=(self.manifest["rows"], len(self.vocabulary)))
+
+
+    def term_counts(self, terms: list, rows: np.ndarray = None, chunk_nnz: int = 1 << 22) -> tuple:
+        """
+        (counts of every term per row, shape (len(rows), len(terms)), total tokens per row) for rows
+        (live_rows() by default). Reads the matrix in slices of about chunk_nnz stored values.
+        """
+        rows = self.live_rows() if rows is None else np.asarray(rows, dtype=np.int64)
+        indptr, indices, counts = self.arrays()
+        lookup = np.full(len(self.vocabulary), -1, dtype=np.int64)
+        for position, term in enumerate(terms):
+            if term in self.term_ids:
+                lookup[self.term_ids[term]] = position
+
+        n_rows = self.manifest["rows"]
+        per_term = np.zeros((n_rows, len(terms)), dtype=np.int64)
+        tokens = np.zeros(n_rows, dtype=np.int64)
+        row = 0
+        while row < n_rows:
+            # as many rows as fit in chunk_nnz values (at least one)
+            end = max(int(np.searchsorted(indptr, indptr[row] + chunk_nnz, side="right")) - 1, row + 1)
+            end = min(end, n_rows)
+            start_value, end_value = int(indptr[row]), int(indptr[end])
+            values = np.asarray(counts[start_value:end_value], dtype=np.int64)
+            cumulative = np.concatenate([[0], np.cumsum(values)])
+            tokens[row:end] = cumulative[indptr[row + 1:end + 1] - start_value] - cumulative[indptr[row:end] - start_value]
+
+            positions = lookup[indices[start_value:end_value]]
+            selected = np.flatnonzero(positions >= 0)
+            if len(selected):
+                value_rows = np.searchsorted(indptr[row:end + 1], start_value + selected, side="right") - 1
+                per_term[row:end] += np.bincount(value_rows * len(terms) + positions[selected], weights=values[selected],
+                                                 minlength=(end - row) * len(terms)).astype(np.int64).reshape(end - row, len(terms))
+            row = end
+        return per_term[rows], tokens[rows]
+
+
+    def term_frequency(self, db, terms: list, by: tuple = ("release_year",), normalize: str = None,
+                       classifier: GenreClassifier = None) -> pd.DataFrame:
+        """
+        Occurrences of terms per group of by (release_year and / or parent_genre), straight from the
+        sparse counts. Columns: songs, tokens, one per term and "total" (all the terms together).
+        normalize="song" divides the counts by the number of songs, "token" by the number of tokens.
+        """
+        by = (by,) if isinstance(by, str) else tuple(by)
+        if not by or any(key not in KEYS for key in by):
+            raise ValueError(f"by must be a non-empty subset of {KEYS}.")
+        if normalize not in (None, "song", "token"):
+            raise ValueError("normalize must be None, 'song' or 'token'.")
+        terms = [term.lower() for term in terms]
+
+        rows = self.live_rows()
+        per_term, tokens = self.term_counts(terms, rows)
+        data = pd.DataFrame(per_term, columns=terms)
+        data["total"] = per_term.sum(axis=1)
+        data["tokens"] = tokens
+        data["songs"] = 1
+        labels = self._labels(db, [self.song_ids[row] for row in rows], by, classifier)
+        for key in by:
+            data[key] = labels[key].to_numpy()
+
+        grouped = data.groupby(list(by), observed=True).sum()
+        if normalize is not None:
+            grouped[terms + ["total"]] = grouped[terms + ["total"]].div(grouped["songs" if normalize == "song" else "tokens"], axis=0)
+        return grouped[["songs", "tokens"] + terms + ["total"]]
+
+
+    @staticmethod
+    def _labels(db, song_ids: list, by: tuple, classifier: GenreClassifier) -> pd.DataFrame:
+        cursor = db.conn.execute("""SELECT s.song_spotify_id, substr(s.release_date, 1, 4), a.genres FROM songs s
+                                    LEFT JOIN artists a ON s.artist_spotify_id = a.artist_spotify_id""")
+        songs = pd.DataFrame(cursor.fetchall(), columns=["song_id", "release_year", "genres"]).set_index("song_id")
+        labels = songs.reindex(song_ids)
+        labels["release_year"] = labels["release_year"].fillna(UNKNOWN)
+        if "parent_genre" in by:
+            classifier = classifier if classifier is not None else GenreClassifier(db=db)
+            genres = classifier.classify_series(labels["genres"].fillna(""))
+            labels["parent_genre"] = genres.astype(object).fillna(UNKNOWN).to_numpy()
+        return labels
+
+
+    # ================== FILES ==================
+
+    def _file(self, name: str, generation: int = None) -> str:
+        # "<name>.bin" or "song_ids.txt" in generation 0, "<name>.<generation>.bin" / "song_ids.<generation>.txt" after
+        if generation is None:
+            generation = self.manifest.get("generations", {}).get(name, 0)
+        stem, extension = os.path.splitext(name) if name.endswith(".txt") else (name, ".bin")
+        return os.path.join(self.path, f"{stem}.{generation}{extension}" if generation else stem + extension)
+
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(os.path.join(self.path, MANIFEST), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {"last_change": 0, "rows": 0, "nnz": 0, "terms": 0, "token_pattern": TOKEN.pattern, VOCABULARY: 0, SONG_IDS: 0}
+
+
+    def _write_manifest(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        for name in (VOCABULARY, SONG_IDS):
+            self.manifest[name] = os.path.getsize(self._file(name))
+        tmp = os.path.join(self.path, MANIFEST + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as file:
+            json.dump(self.manifest, file, indent=2, sort_keys=True)
+        os.replace(tmp, os.path.join(self.path, MANIFEST))
+
+
+    def _read_lines(self, name: str, count: int) -> list:
+        if not count:
+            return []
+        with open(self._file(name), "r", encoding="utf-8") as file:
+            return [line.rstrip("\n") for _, line in zip(range(count), file)]
+
+
+    def _append_lines(self, name: str, lines: list) -> None:
+        with open(self._file(name), "a", encoding="utf-8") as file:
+            file.writelines(line + "\n" for line in lines)
+
+
+    def _append_array(self, name: str, values: list) -> None:
+        with open(self._file(name), "ab") as file:
+            np.asarray(values, dtype=self.ARRAYS[name]).tofile(file)
+
+
+    def _reset(self) -> None:
+        # the change log was pruned past the index, it is built again from scratch
+        if os.path.exists(os.path.join(self.path, MANIFEST)):
+            os.remove(os.path.join(self.path, MANIFEST))
+        self.__init__(self.path)
+
+
+    def _truncate(self) -> bool:
+        """
+        Drops whatever an interrupted update appended past the manifest and the files of the other
+        generations. Files are only ever shortened: False when one is shorter than the manifest, the
+        index cannot be repaired and has to be rebuilt.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        self._remove_stale()
+        sizes = {"indptr": (self.manifest["rows"] + 1 if self.manifest["rows"] else 0) * 8,
+                 "indices": self.manifest["nnz"] * 4, "counts": self.manifest["nnz"] * 2,
+                 VOCABULARY: self.manifest[VOCABULARY], SONG_IDS: self.manifest[SONG_IDS]}
+        sizes = {self._file(name): size for name, size in sizes.items()}
+        current = {name: os.path.getsize(name) if os.path.exists(name) else 0 for name in sizes}
+        if any(current[name] < size for name, size in sizes.items()):
+            return False
+        for name, size in sizes.items():
+            if current[name] > size:
+                with open(name, "r+b") as file:
+                    file.truncate(size)
+        return True
+
+
+    def _remove_stale(self) -> None:
+        # files of a generation the manifest does not point to: replaced by compact(), or written by an interrupted one
+        current = {os.path.basename(self._file(name)) for name in list(self.ARRAYS) + [SONG_IDS]}
+        for entry in os.listdir(self.path):
+            if GENERATION_FILE.fullmatch(entry) and entry not in current:
+                try:
+                    os.remove(os.path.join(self.path, entry))
+                except PermissionError:
+                    pass    # still memory-mapped (Windows), removed by the next update
@@ -0,0 +1,300 @@
+import hashlib
+import html
+import json
+import random
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep
+from urllib.parse import urlparse, parse_qs
+
+
+
+# --- LOCAL STAND-IN FOR THE SPOTIFY / GENIUS APIS ---
+#
+# Serves canned JSON in the shapes the enrichment reads, so the pipeline can be run and measured
+# without network access:
+#
+#   /v1/search?q=track: T artist: A     /v1/tracks?ids=...     /v1/artists?ids=...
+#   /v1/albums?ids=...                  /v1/audio-features?ids=...
+#   /search?q=...                       (Genius)
+#   /songs/<id>                         (Genius lyrics page, HTML)
+#   /charts/singles-chart/<YYYYMMDD>/7501/   (Official Charts week, HTML with ETag / Last-Modified,
+#                                              304 to a matching If-None-Match or If-Modified-Since)
+#
+# Objects come from `fixtures` ({"tracks": {id: obj}, "artists": ..., "albums": ..., "audio-features": ...,
+# "search": {q: obj}, "genius": {q: obj}, "pages": {id: html}, "charts": {week: html}}) or are generated
+# deterministically from the id.
+# Ids starting with "missing" return null, like the real API does for unknown ids.
+# rate_limit (requests/s) makes the server answer 429 with Retry-After, latency delays every answer.
+
+
+CHART_PAGE = re.compile(r"^/charts/singles-chart/(\d{8})/7501/$")
+
+GENRES = ["dance pop,pop", "rock,classic rock", "hip hop,rap", "soul,motown", "country", "indie rock,alternative", ""]
+
+
+def _number(key: str, modulo: int) -> int:
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:8], 16) % modulo
+
+
+def synthetic_artist(artist_id: str) -> dict:
+    return {"id": artist_id, "name": f"Artist {artist_id}", "genres": [genre for genre in GENRES[_number(artist_id, len(GENRES))].split(",") if genre],
+            "popularity": _number(artist_id + "p", 100), "followers": {"total": _number(artist_id + "f", 10 ** 7)}}
+
+
+def synthetic_album(album_id: str, tracks: int = 3) -> dict:
+    year = 1960 + _number(album_id, 64)
+    return {"id": album_id, "name": f"Album {album_id}", "release_date": f"{year}-{1 + _number(album_id + 'm', 12):02d}-{1 + _number(album_id + 'd', 28):02d}",
+            "genres": [], "popularity": _number(album_id + "p", 100),
+            "tracks": {"total": tracks, "items": [{"id": f"{album_id}t{idx}", "name": f"Track {idx}", "artists": [{"id": f"ar{_number(album_id, 5000)}"}]}
+                                                  for idx in range(tracks)]}}
+
+
+def synthetic_track(track_id: str) -> dict:
+    album_id = f"al{_number(track_id, 20000)}"
+    return {"id": track_id, "name": f"Song {track_id}", "popularity": _number(track_id + "p", 100),
+            "artists": [{"id": f"ar{_number(track_id, 5000)}"}] + ([{"id": "ar0"}] if _number(track_id, 5) == 0 else []),
+            "album": {"id": album_id, "release_date": synthetic_album(album_id, 0)["release_date"]}}
+
+
+def synthetic_features(track_id: str) -> dict:
+    value = lambda name: _number(track_id + name, 10000) / 10000
+    return {"id": track_id, "acousticness": value("a"), "danceability": value("d"), "energy": value("e"),
+            "instrumentalness": value("i"), "liveness": value("l"), "loudness": -60 * value("lo"),
+            "speechiness": value("s"), "tempo": 60 + 140 * value("t"), "valence": value("v"),
+            "mode": _number(track_id + "mo", 2), "key": _number(track_id + "k", 13) - 1, "duration_ms": 60000 + _number(track_id, 300000)}
+
+
+def synthetic_search(query: str) -> dict:
+    return {"tracks": {"items": [synthetic_track("tr" + hashlib.md5(query.encode("utf-8")).hexdigest()[:16])]}}
+
+
+def synthetic_genius(query: str) -> dict:
+    song = hashlib.md5(query.encode("utf-8")).hexdigest()[:12]
+    artist = query.split(" ", 1)[-1]
+    return {"response": {"hits": [{"result": {"primary_artist_names": artist, "url": f"/songs/{song}",
+                                              "release_date_components": {"year": 1990}}}]}}
+
+
+# a small vocabulary with Zipf-like word frequencies and a few phrases shared between songs,
+# so that synthetic lyrics compress roughly like real ones
+WORDS = ("i you the me my to and a it love oh baby in we your be no all on so know yeah don't it's what "
+         "just like get can't got now go one time is heart night up down never na way tonight feel come "
+         "want say let take back right there out make dance world girl boy away home stay fire light dream "
+         "cry tell need hold life little gonna wanna good eyes run said see alone forever hands again body").split()
+PHRASES = ["oh oh oh", "na na na na", "yeah yeah yeah", "I love you baby", "all night long", "don't let me go",
+           "hold me tight", "one more time", "in the middle of the night", "you and me", "come on come on"]
+ZIPF = [1 / rank for rank in range(1, len(WORDS) + 1)]
+
+
+def synthetic_lyrics(song_id: str) -> list:
+    """
+    Lines of deterministic lyrics with [Verse] / [Chorus] headers.
+    """
+    rng = random.Random(song_id)
+    line = lambda: " ".join(rng.choice(PHRASES) if rng.random() < 0.1 else rng.choices(WORDS, ZIPF)[0]
+                            for _ in range(rng.randint(4, 9))).capitalize()
+    chorus = [line() for _ in range(4)]
+    lines = []
+    for verse in range(1, rng.randint(2, 4) + 1):
+        lines += [f"[Verse {verse}]"] + [line() for _ in range(rng.randint(4, 8))] + ["[Chorus]"] + chorus
+    return lines
+
+
+def synthetic_lyrics_page(song_id: str, filler: int = 20000) -> str:
+    """
+    HTML shaped like a Genius song page: the lyrics split in two Lyrics__Container divs with <br/>,
+    links and nested spans, surrounded by filler markup and scripts.
+    """
+    rng = random.Random(song_id + "page")
+    lines = synthetic_lyrics(song_id)
+    half = len(lines) // 2
+
+    def container(part: list) -> str:
+        body = "<br/>".join(f'<a href="/{rng.randint(1, 10 ** 6)}" class="ReferentFragment"><span>{text}</span></a>'
+                            if rng.random() < 0.2 else text for text in part)
+        return f'<div data-lyrics-container="true" class="Lyrics__Container-sc-1ynbvzw-1 kUgSbL">{body}</div>'
+
+    noise = "".join(f'<div class="Filler__Item-sc-{idx}"><span>{rng.random()}</span></div>' for idx in range(filler // 60))
+    return ("<!DOCTYPE html><html><head><title>Lyrics</title><style>.Lyrics__Container-sc-1ynbvzw-1{padding:0}</style>"
+            f"<script>window.__PRELOADED_STATE__ = {json.dumps({'id': song_id, 'pad': 'x' * filler})};</script></head>"
+            f"<body><div class=\"Header\">{noise}</div><main><div class=\"SongPage__Section\">{container(lines[:half])}"
+            f"<div class=\"InreadAd\"><span>Ad</span></div>{container(lines[half:])}</div></main>"
+            f"<footer>{noise}</footer></body></html>")
+
+
+
+def synthetic_chart_page(week: str, entries: int = 100, filler: int = 20000) -> str:
+    """
+    HTML shaped like an Official Charts week: div.chart-item with the title and the artist in the
+    class-less span of a.chart-name / a.chart-artist, ad items in between and filler markup around.
+    Songs come from a window sliding 15 songs a week, so consecutive weeks share many of their songs.
+    """
+    rng = random.Random(week)
+    base = datetime.strptime(week, "%Y%m%d").toordinal() // 7 * 15
+    songs = rng.sample(range(base, base + 200), entries)
+    items = []
+    for position, song in enumerate(songs, 1):
+        title = html.escape(f"Song {song}" + (" (FEAT. Guest & Co)" if song % 11 == 0 else ""))
+        artist = html.escape(f"Artist {song % 997}" + (" & The Band" if song % 7 == 0 else ""))
+        items.append(f'<div class="chart-item"><div class="chart-item-content"><div class="chart-key"><strong>{position}</strong></div>'
+                     f'<div class="description block"><p><a class="chart-name font-bold inline-block" href="/songs/{song}/">'
+                     f'<span class="movement-icon">New</span><span>{title}</span></a>'
+                     f'<a class="chart-artist text-lg inline-block" href="/artist/{song % 997}/"><span>{artist}</span></a></p></div></div></div>')
+        if position % 25 == 0:
+            items.append('<div class="chart-item chart-ad"><div class="ad-slot"><span>Advertisement</span></div></div>')
+    noise = "".join(f'<div class="Filler__Item-{idx}"><span>{rng.random()}</span></div>' for idx in range(filler // 60))
+    return (f"<!DOCTYPE html><html><head><title>Official Singles Chart {week}</title></head><body><header>{noise}</header>"
+            f'<main><div class="chart-items">{"".join(items)}</div></main><footer>{noise}</footer></body></html>')
+
+
+def chart_validators(week: str, page: str) -> dict:
+    # the page published on the Friday after the week
+    published = datetime.strptime(week, "%Y%m%d").replace(tzinfo=timezone.utc) + timedelta(days=7)
+    return {"ETag": '"%s"' % hashlib.md5(page.encode("utf-8")).hexdigest(),
+            "Last-Modified": format_datetime(published, usegmt=True)}
+
+
+
+class MockAPIServer:
+    """
+    Local HTTP server with canned Spotify / Genius answers. Use as a context manager:
+
+        with MockAPIServer(rate_limit=50) as server:
+            client = SpotifyClient("token", base_url=server.url + "/v1")
+    """
+
+    def __init__(self, fixtures: dict = None, rate_limit: float = None, latency: float = 0.0, retry_after: float = 0.2,
+                 host: str = "127.0.0.1", port: int = 0):
+        self.fixtures = fixtures or {}
+        self.rate_limit = rate_limit
+        self.latency = latency
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.requests_count = 0
+        self.throttled_count = 0
+        self.not_modified_count = 0
+        self.window_start = monotonic()
+        self.window_count = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+    def start(self) -> "MockAPIServer":
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def __enter__(self) -> "MockAPIServer":
+        return self.start()
+
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+    def answer(self, path: str, params: dict):
+        """
+        (status, JSON-able body) for a request, lyrics and chart pages answer an HTML str.
+        """
+        ids = [item for item in params.get("ids", [""])[0].split(",") if item]
+        query = params.get("q", [""])[0]
+        lookups = {
+            "/v1/tracks": ("tracks", synthetic_track),
+            "/v1/artists": ("artists", synthetic_artist),
+            "/v1/albums": ("albums", synthetic_album),
+            "/v1/audio-features": ("audio-features", synthetic_features),
+        }
+        if path in lookups:
+            name, generate = lookups[path]
+            objects = [None if item.startswith("missing") else self.fixtures.get(name, {}).get(item) or generate(item) for item in ids]
+            return 200, {name.replace("-", "_"): objects}
+        if path == "/v1/search":
+            return 200, self.fixtures.get("search", {}).get(query) or synthetic_search(query)
+        if path == "/search":
+            return 200, self.fixtures.get("genius", {}).get(query) or synthetic_genius(query)
+        if path.startswith("/songs/"):
+            song = path[len("/songs/"):]
+            return 200, self.fixtures.get("pages", {}).get(song) or synthetic_lyrics_page(song)
+        chart = CHART_PAGE.match(path)
+        if chart:
+            return 200, self.fixtures.get("charts", {}).get(chart.group(1)) or synthetic_chart_page(chart.group(1))
+        return 404, {"error": {"status": 404, "message": "Not found."}}
+
+
+    def _throttle(self) -> bool:
+        with self.lock:
+            self.requests_count += 1
+            if self.rate_limit is None:
+                return False
+            now = monotonic()
+            if now - self.window_start >= 1.0:
+                self.window_start, self.window_count = now, 0
+            self.window_count += 1
+            if self.window_count > self.rate_limit:
+                self.throttled_count += 1
+                return True
+            return False
+
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if mock.latency:
+                    sleep(mock.latency)
+                if mock._throttle():
+                    self._send(429, {"error": {"status": 429, "message": "API rate limit exceeded"}},
+                               {"Retry-After": str(mock.retry_after)})
+                    return
+                url = urlparse(self.path)
+                status, body = mock.answer(url.path, parse_qs(url.query))
+                chart = CHART_PAGE.match(url.path)
+                if status != 200 or not chart:
+                    self._send(status, body)
+                    return
+                validators = chart_validators(chart.group(1), body)
+                etag = self.headers.get("If-None-Match")
+                if (etag == validators["ETag"] if etag is not None
+                        else self.headers.get("If-Modified-Since") == validators["Last-Modified"]):
+                    with mock.lock:
+                        mock.not_modified_count += 1
+                    self._send(304, "", validators)
+                    return
+                self._send(status, body, validators)
+
+
+            def _send(self, status: int, body, headers: dict = None):
+                html = isinstance(body, str)
+                payload = (body if html else json.dumps(body)).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8" if html else "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,601 @@
+import json
+import os
+import queue
+import random
+import threading
+from time import monotonic, sleep
+
+import requests
+
+from db_management.cache import ResponseCache
+from db_management.db import SongsDB, IDSongInfo, ArtistInfo, AlbumInfo, SongFeaturesBatch
+
+
+
+SPOTIFY_API = "https://api.spotify.com/v1"
+GENIUS_API = "https://api.genius.com"
+
+
+
+class APIException(Exception):
+    """
+    Request that still failed after all the retries.
+    """
+
+
+
+# --- RATE LIMITING ---
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket with an adaptive rate (additive increase, multiplicative decrease).
+    A 429 halves the rate and pauses every caller for Retry-After, each success raises it back
+    a little, up to max_rate.
+    """
+
+    def __init__(self, rate: float, max_rate: float = None, min_rate: float = 0.5, burst: float = None):
+        self.rate = float(rate)
+        self.max_rate = float(max_rate if max_rate is not None else rate)
+        self.min_rate = float(min_rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self.tokens = self.burst
+        self.updated = monotonic()
+        self.paused_until = 0.0
+        self.throttled_count = 0
+        self.lock = threading.Lock()
+
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+
+    def succeeded(self) -> None:
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.01)
+
+
+    def throttled(self, retry_after: float = None) -> None:
+        with self.lock:
+            self.throttled_count += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0.0
+            if retry_after:
+                self.paused_until = max(self.paused_until, monotonic() + retry_after)
+
+
+
+# --- API CLIENTS ---
+
+
+class APIClient:
+    """
+    GET with rate limiting and retries: 429 waits for Retry-After (adaptive limiter),
+    5xx and connection errors back off exponentially with jitter.
+    With a ResponseCache, cached answers are returned without touching the limiter or the network.
+    """
+
+    def __init__(self, base_url: str, headers: dict = None, limiter: RateLimiter = None,
+                 max_retries: int = 5, backoff: float = 0.5, timeout: float = 10, cache: ResponseCache = None):
+        self.base_url = base_url.rstrip("/")
+        self.headers = headers or {}
+        self.limiter = limiter if limiter is not None else RateLimiter(10)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.cache = cache
+        self.local = threading.local()   # one requests.Session per worker thread
+        self.stats_lock = threading.Lock()
+        self.requests_count = 0
+        self.retries_count = 0
+
+
+    def get(self, path: str, params: dict = None) -> dict:
+        return json.loads(self.get_text(path, params))
+
+
+    def get_text(self, path: str, params: dict = None) -> str:
+        url = path if path.startswith("http") else self.base_url + path
+        if self.cache is None:
+            return self._request(url, path, params)
+        key = self.cache.key(url, params)
+        body = self.cache.get(key)
+        if body is None:
+            if self.cache.offline:
+                raise APIException(path, "not in the offline cache")
+            body = self._request(url, path, params)
+            self.cache.put(key, url, body)
+        return body
+
+
+    def get_ids(self, path: str, ids: list, field: str) -> dict:
+        """
+        Batch endpoint (?ids=a,b,c) answering {field: [object or None, ...]}. Objects are cached one by one,
+        so a later batch with a different mix of ids only requests the ones that are not cached.
+        """
+        url = self.base_url + path
+        if self.cache is None:
+            return json.loads(self._request(url, path, {"ids": ",".join(ids)}))
+        keys = {obj_id: self.cache.key(url, {"id": obj_id}) for obj_id in ids}
+        cached = self.cache.get_many(list(keys.values()))
+        objects = {obj_id: json.loads(cached[key]) for obj_id, key in keys.items() if key in cached}
+        missing = [obj_id for obj_id in dict.fromkeys(ids) if obj_id not in objects]
+        if missing:
+            if self.cache.offline:
+                raise APIException(path, "not in the offline cache", missing)
+            fetched = json.loads(self._request(url, path, {"ids": ",".join(missing)}))[field]
+            objects.update(zip(missing, fetched))
+            self.cache.put_many([(keys[obj_id], url, json.dumps(objects[obj_id])) for obj_id in missing])
+        return {field: [objects[obj_id] for obj_id in ids]}
+
+
+    def _request(self, url: str, path: str, params: dict = None) -> str:
+        return self._response(url, path, params).text
+
+
+    def _response(self, url: str, path: str, params: dict = None, headers: dict = None) -> requests.Response:
+        """
+        The first answer below 400 (304 Not Modified of a conditional request included), extra headers
+        are sent next to the client ones.
+        """
+        headers = {**self.headers, **headers} if headers else self.headers
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with self.stats_lock:
+                    self.retries_count += 1
+            self.limiter.acquire()
+            with self.stats_lock:
+                self.requests_count += 1
+            try:
+                response = self._session().get(url, params=params, headers=headers, timeout=self.timeout)
+            except requests.RequestException as exception:
+                error = exception
+                sleep(self._backoff(attempt))
+                continue
+
+            if response.status_code == 429:
+                error = APIException(path, 429)
+                self.limiter.throttled(_retry_after(response))
+                continue
+            if response.status_code >= 500:
+                error = APIException(path, response.status_code)
+                sleep(self._backoff(attempt))
+                continue
+            if response.status_code >= 400:
+                raise APIException(path, response.status_code, response.text[:200])
+            self.limiter.succeeded()
+            return response
+        raise APIException(path, "retries exhausted", *getattr(error, "args", ()))
+
+
+    def _session(self) -> requests.Session:
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+
+    def _backoff(self, attempt: int) -> float:
+        return self.backoff * 2 ** attempt * (0.5 + random.random())
+
+
+
+class SpotifyClient(APIClient):
+    """
+    The Spotify Web API endpoints used by the enrichment (raw JSON, same shapes as spotipy returns).
+    """
+
+    def __init__(self, token: str, base_url: str = SPOTIFY_API, **kwargs):
+        super().__init__(base_url, {"Authorization": "Bearer " + token}, **kwargs)
+
+
+    def search_track(self, title: str, artist: str) -> dict:
+        return self.get("/search", {"q": f"track: {title} artist: {artist}", "type": "track", "limit": 1})
+
+
+    def tracks(self, ids: list) -> dict:
+        return self.get_ids("/tracks", ids, "tracks")
+
+
+    def artists(self, ids: list) -> dict:
+        return self.get_ids("/artists", ids, "artists")
+
+
+    def albums(self, ids: list) -> dict:
+        return self.get_ids("/albums", ids, "albums")
+
+
+    def audio_features(self, ids: list) -> dict:
+        return self.get_ids("/audio-features", ids, "audio_features")
+
+
+
+class GeniusClient(APIClient):
+
+    def __init__(self, token: str, base_url: str = GENIUS_API, **kwargs):
+        super().__init__(base_url, {"Authorization": "Bearer " + token}, **kwargs)
+
+
+    def search(self, title: str, artist: str) -> dict:
+        return self.get("/search", {"q": f"{title} {artist}"})
+
+
+    def song_url(self, title: str, artist: str) -> str:
+        """
+        URL of the first hit whose primary artist matches, "" when there is none.
+        """
+        for hit in self.search(title, artist)["response"]["hits"]:
+            result = hit.get("result") or {}
+            if (result.get("primary_artist_names") or "").lower() == artist.lower():
+                return result.get("url") or ""
+        return ""
+
+
+
+def _retry_after(response) -> float:
+    try:
+        return float(response.headers.get("Retry-After", 1))
+    except ValueError:
+        return 1.0
+
+
+
+# --- STAGES ---
+# Each stage fetches one batch of keys and returns (kind, record) pairs for the writer.
+
+
+def _track_song(track: dict, album: dict = None, popularity: int = None) -> IDSongInfo:
+    album = album if album is not None else track["album"]
+    return IDSongInfo(track["id"], album["id"], track["artists"][0]["id"], track["name"], album["release_date"],
+                      int(len(track["artists"]) > 1), track["popularity"] if popularity is None else popularity)
+
+
+def fetch_search(client: SpotifyClient, keys: list) -> list:
+    records = []
+    for title, artist in keys:
+        items = client.search_track(title, artist)["tracks"]["items"]
+        if items:
+            records.append(("songs", _track_song(items[0])))
+    return records
+
+
+def fetch_artists(client: SpotifyClient, keys: list) -> list:
+    return [("artists", ArtistInfo(artist["id"], artist["name"], ",".join(artist["genres"]),
+                                   artist["popularity"], artist["followers"]["total"]))
+            for artist in client.artists(keys)["artists"] if artist is not None]
+
+
+def fetch_albums(client: SpotifyClient, keys: list) -> list:
+    records = []
+    for album in client.albums(keys)["albums"]:
+        if album is None:
+            continue
+        records.append(("albums", AlbumInfo(album["id"], album["name"], album["release_date"], album["tracks"]["total"],
+                                            ",".join(album["genres"]), album["popularity"])))
+        # album tracks come without popularity, filled later by the popularity stage
+        records.extend(("songs", _track_song(track, album, -1)) for track in album["tracks"]["items"])
+    return records
+
+
+def fetch_features(client: SpotifyClient, keys: list) -> list:
+    return [("features", features) for features in client.audio_features(keys)["audio_features"] if features is not None]
+
+
+def fetch_popularity(client: SpotifyClient, keys: list) -> list:
+    return [("popularity", (track["id"], track["popularity"])) for track in client.tracks(keys)["tracks"] if track is not None]
+
+
+# stage -> (fetch function, keys per request) - the batch limits of the Spotify endpoints
+STAGES = {
+    "search": (fetch_search, 1),
+    "artists": (fetch_artists, 50),
+    "albums": (fetch_albums, 20),
+    "features": (fetch_features, 100),
+    "popularity": (fetch_popularity, 50),
+}
+
+
+
+# --- PIPELINE ---
+
+
+class EnrichmentPipeline:
+    """
+    Worker threads fetch batches of keys from a bounded queue and hand the records to one writer
+    thread (the only one touching SQLite), which writes them with the *_insert_many methods.
+    Both queues are bounded, so a slow writer slows the fetching down instead of filling the memory.
+
+    Without explicit keys a stage runs from the ingest_jobs table: keys are claimed in chunks, marked
+    done / failed in the same transaction as their records, and newly stored songs enqueue the
+    artists / albums / features / popularity jobs they need. A restart (or another process with the
+    same database) continues with what is still pending.
+    """
+
+    _DONE = object()
+
+    # key of a record of each kind, as reported in stats["rejected"]
+    RECORD_KEYS = {
+        "songs": lambda song: song.song_id,
+        "artists": lambda artist: artist.artist_id,
+        "albums": lambda album: album.album_id,
+        "features": lambda features: features.get("id") if isinstance(features, dict) else None,
+        "popularity": lambda row: row[0],
+    }
+
+
+    def __init__(self, db_path: str, spotify: SpotifyClient, workers: int = 8, queue_size: int = 64,
+                 write_batch_size: int = 1000, flush_interval: float = 1.0, worker_id: str = None,
+                 claim_size: int = 2000, lease: float = 600, max_attempts: int = 3):
+        self.db_path = db_path
+        self.spotify = spotify
+        self.workers = workers
+        self.queue_size = queue_size
+        self.write_batch_size = write_batch_size
+        self.flush_interval = flush_interval
+        self.worker_id = worker_id or f"{os.getpid()}-{id(self):x}"
+        self.claim_size = claim_size
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+
+    def pending_keys(self, stage: str) -> list:
+        """
+        Full backlog of a stage, read with the backlog queries (no job bookkeeping).
+        """
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage '{stage}', expected one of {list(STAGES)}.")
+        db = SongsDB(self.db_path)
+        try:
+            keys = [row[0] for row in db.get_query_database(db.JOB_SEEDS[stage])]
+            return self._fetch_keys(db, stage, keys) if stage == "search" else keys
+        finally:
+            db.close_connection()
+
+
+    def run(self, stage: str, keys: list = None) -> dict:
+        """
+        Runs one stage, over keys when given, otherwise over the claimed ingest_jobs of the stage.
+        Returns the run statistics.
+        """
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage '{stage}', expected one of {list(STAGES)}.")
+        fetch, size = STAGES[stage]
+
+        stats = {"stage": stage, "keys": 0, "batches": 0, "failed_batches": 0, "records": 0,
+                 "written": 0, "rejected": [], "errors": [], "requests": 0, "retries": 0, "throttled": 0, "cache_hits": 0}
+        requests_before = self.spotify.requests_count
+        retries_before = self.spotify.retries_count
+        throttled_before = self.spotify.limiter.throttled_count
+        cache = self.spotify.cache
+        hits_before = cache.hits if cache is not None else 0
+        lock = threading.Lock()
+        work = queue.Queue(self.queue_size)
+        results = queue.Queue(self.queue_size)
+        start = monotonic()
+
+        def worker():
+            while True:
+                item = work.get()
+                if item is self._DONE:
+                    return
+                job_keys, batch = item
+                try:
+                    records = fetch(self.spotify, batch)
+                except Exception as exception:
+                    with lock:
+                        stats["failed_batches"] += 1
+                        stats["errors"].append((batch, repr(exception)))
+                    results.put((job_keys, None, repr(exception)))
+                    continue
+                with lock:
+                    stats["batches"] += 1
+                    stats["records"] += len(records)
+                results.put((job_keys, records, None))
+
+        writer_errors = []
+        writer = threading.Thread(target=self._write, args=(stage, results, stats, writer_errors), name=f"{stage}-writer")
+        writer.start()
+        workers = [threading.Thread(target=worker, name=f"{stage}-worker-{idx}") for idx in range(self.workers)]
+        for thread in workers:
+            thread.start()
+
+        try:
+            for job_keys, batch in (self._batches(keys, size) if keys is not None else self._claimed_batches(stage, size)):
+                stats["keys"] += len(batch)
+                work.put((job_keys, batch))
+        finally:
+            for _ in workers:
+                work.put(self._DONE)
+            for thread in workers:
+                thread.join()
+            results.put(self._DONE)
+            writer.join()
+        if writer_errors:
+            raise writer_errors[0]
+
+        stats["seconds"] = monotonic() - start
+        stats["requests"] = self.spotify.requests_count - requests_before
+        stats["retries"] = self.spotify.retries_count - retries_before
+        stats["throttled"] = self.spotify.limiter.throttled_count - throttled_before
+        stats["cache_hits"] = cache.hits - hits_before if cache is not None else 0
+        return stats
+
+
+    @staticmethod
+    def _batches(keys: list, size: int):
+        keys = list(keys)
+        for idx in range(0, len(keys), size):
+            yield None, keys[idx:idx + size]
+
+
+    def _claimed_batches(self, stage: str, size: int):
+        db = SongsDB(self.db_path)
+        try:
+            if not db.jobs_seeded(stage):
+                db.seed_jobs(stage)
+            while True:
+                claimed = db.claim_jobs(stage, self.claim_size, self.worker_id, self.lease, self.max_attempts)
+                if not claimed:
+                    return
+                fetch_keys = self._fetch_keys(db, stage, claimed) if stage == "search" else claimed
+                for idx in range(0, len(claimed), size):
+                    yield claimed[idx:idx + size], fetch_keys[idx:idx + size]
+        finally:
+            db.close_connection()
+
+
+    @staticmethod
+    def _fetch_keys(db: SongsDB, stage: str, keys: list) -> list:
+        # search jobs are keyed by scraped_songs.id, the API needs (title, artist)
+        songs = {}
+        for idx in range(0, len(keys), 500):
+            chunk = [int(key) for key in keys[idx:idx + 500]]
+            cursor = db.conn.execute(f"SELECT id, title, artist FROM scraped_songs WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+            songs.update((str(song_id), (title, artist)) for song_id, title, artist in cursor)
+        return [songs.get(str(key), ("", "")) for key in keys]
+
+
+    def _write(self, stage: str, results: queue.Queue, stats: dict, errors: list) -> None:
+        try:
+            self._write_results(stage, results, stats)
+        except Exception as exception:
+            # the writer cannot go on (f.ex. the database cannot be opened): keep reading the results,
+            # the workers would block on the full queue otherwise, run() raises the error at the end
+            errors.append(exception)
+            while results.get() is not self._DONE:
+                pass
+
+
+    def _write_results(self, stage: str, results: queue.Queue, stats: dict) -> None:
+        db = SongsDB(self.db_path)   # sqlite connections belong to the thread that opened them
+        buffers = {"songs": [], "artists": [], "albums": [], "features": [], "popularity": []}
+        done, failed = [], []
+        pending = 0
+        last_flush = monotonic()
+        try:
+            while True:
+                try:
+                    item = results.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    item = None
+                if item is self._DONE:
+                    break
+                if item is not None:
+                    job_keys, records, error = item
+                    if records is None:
+                        failed.append((job_keys, error))
+                    else:
+                        for kind, record in records:
+                            buffers[kind].append(record)
+                        pending += len(records)
+                        if job_keys is not None:
+                            done.extend(job_keys)
+                if pending >= self.write_batch_size or ((pending or done or failed) and monotonic() - last_flush >= self.flush_interval):
+                    self._flush_or_fail(db, stage, buffers, done, failed, stats)
+                    pending = 0
+                    last_flush = monotonic()
+            self._flush_or_fail(db, stage, buffers, done, failed, stats)
+        finally:
+            db.close_connection()
+
+
+    def _flush_or_fail(self, db: SongsDB, stage: str, buffers: dict, done: list, failed: list, stats: dict) -> None:
+        """
+        _flush, or when it raises (f.ex. a disk I/O error): the flush is rolled back, its records are
+        reported as rejected and its jobs failed (retried up to max_attempts), and the writer goes on.
+        """
+        try:
+            self._flush(db, stage, buffers, done, failed, stats)
+            return
+        except Exception as exception:
+            db.conn.rollback()
+            error = repr(exception)
+        keys = [self.RECORD_KEYS[kind](record) for kind, records in buffers.items() for record in records]
+        stats["rejected"].extend(keys)
+        stats["errors"].append((list(done) if done else keys, error))
+        for job_keys, job_error in failed:
+            if job_keys is not None:
+                db.fail_jobs(stage, job_keys, job_error, commit=False)
+        db.fail_jobs(stage, done, error, commit=False)
+        db.conn.commit()
+        for kind in buffers:
+            buffers[kind] = []
+        done.clear()
+        failed.clear()
+
+
+    def _flush(self, db: SongsDB, stage: str, buffers: dict, done: list, failed: list, stats: dict) -> None:
+        # one transaction: the records, the downstream jobs and the status of the flushed jobs
+        # parents first, so a reader never sees songs of an album that is not stored yet
+        features, malformed = self._features_batch(buffers["features"])
+        writes = (
+            ("artists", db.artists_insert_many),
+            ("albums", db.albums_insert_many),
+            ("songs", db.songs_insert_many),
+            ("features", lambda records, commit: [key for key, _ in malformed] + db.songs_features_insert_many(features, commit=commit)),
+            ("popularity", db.update_song_popularity_many),
+        )
+        written, rejected = 0, []
+        for kind, insert_many in writes:
+            records = buffers[kind]
+            if records:
+                rejected_keys = insert_many(records, commit=False)
+                written += len(records) - len(rejected_keys)
+                rejected.extend(rejected_keys)
+                if kind == "songs":
+                    self._enqueue_downstream(db, records)
+
+        for job_keys, error in failed:
+            if job_keys is not None:
+                db.fail_jobs(stage, job_keys, error, commit=False)
+        # the job of a malformed features record fails with its error (its key is the song id of the job)
+        failing = dict(malformed)
+        for key in failing.keys() & set(done):
+            db.fail_jobs(stage, [key], failing[key], commit=False)
+        db.complete_jobs(stage, [key for key in done if key not in failing], commit=False)
+        db.conn.commit()
+        # counted and cleared once committed, a failed flush is reported by _flush_or_fail instead
+        stats["written"] += written
+        stats["rejected"].extend(rejected)
+        stats["errors"].extend(([key], error) for key, error in malformed)
+        for kind in buffers:
+            buffers[kind] = []
+        done.clear()
+        failed.clear()
+
+
+    def _features_batch(self, records: list) -> tuple:
+        """
+        SongFeaturesBatch of the features records and the (key, error) of the malformed ones. Those are
+        left out one by one, like the rejected rows of a batched insert, the others are still written.
+        """
+        try:
+            return SongFeaturesBatch.from_dicts(records), []
+        except (KeyError, TypeError, ValueError, OverflowError):
+            pass
+        batch, malformed = SongFeaturesBatch(), []
+        for record in records:
+            try:
+                batch.append(record)
+            except (KeyError, TypeError, ValueError, OverflowError) as exception:
+                malformed.append((self.RECORD_KEYS["features"](record), repr(exception)))
+        return batch, malformed
+
+
+    @staticmethod
+    def _enqueue_downstream(db: SongsDB, songs: list) -> None:
+        db.enqueue_jobs("features", (song.song_id for song in songs), commit=False)
+        db.enqueue_jobs("artists", {song.artist_id for song in songs}, commit=False)
+        db.enqueue_jobs("albums", {song.album_id for song in songs}, commit=False)
+        db.enqueue_jobs("popularity", (song.song_id for song in songs if song.popularity == -1), commit=False)
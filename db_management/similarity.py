@@ -0,0 +1,546 @@
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from db_management.db import SongsDB
+from db_management.genres import GenreClassifier
+
+
+
+# --- SIMILAR SONGS INDEX ---
+#
+# The audio features of every song, standardized with the mean / standard deviation of the first build,
+# as float32 vectors on disk - append-only like the lyrics index (db_management/lyrics_index.py):
+#
+#   <path>/_manifest.json    features, mean / scale, rows written, partitions, last data_changes.seq indexed
+#   <path>/song_ids.txt      one song id per line, line number = row
+#   <path>/vectors.bin       float32, rows x features
+#   <path>/partitions.bin    int32, rows (partition of every row, -1 for a song without features anymore)
+#   <path>/centroids.bin     float32, partitions x features
+#
+# The vectors are split into about sqrt(rows) partitions by a k-means on a sample (an inverted file):
+# a query ranks the centroids and scans only the rows of its nprobe closest partitions. Songs changed
+# later (data_changes) are appended to the partition of their closest centroid, the last row of a song
+# wins. Filters (release year, parent genre) are resolved in SQL, when they leave few songs those are
+# scanned exhaustively. Distances are euclidean between standardized vectors.
+#
+# compact() and train() do not overwrite files: the rewritten ones get the next generation ("vectors.3.bin",
+# "song_ids.3.txt", the generation of every file is in the manifest) and the manifest switches to them,
+# the old generation is deleted afterwards. An interrupted compaction or training leaves the index as it was.
+
+
+MANIFEST = "_manifest.json"
+SONG_IDS = "song_ids.txt"
+# the files rewritten by compact() / train(), in any generation
+GENERATION_FILE = re.compile(r"(?:vectors|partitions|centroids)(?:\.\d+)?\.bin|song_ids(?:\.\d+)?\.txt")
+KEYS = ("release_year", "parent_genre")
+
+NPROBE = 8
+EXACT_LIMIT = 50000         # candidates (after the filters) scanned exhaustively below this
+SAMPLE = 100000             # rows the partitions are trained on
+MAX_PARTITIONS = 4096
+ITERATIONS = 10
+GROWTH = 4                  # the partitions are retrained once the index has grown GROWTH times
+SCAN_VALUES = 1 << 24       # distances computed at once in an exhaustive scan
+FILTER_CACHE = 16           # candidate rows kept per distinct filters
+
+
+
+def _distances(queries: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    # squared euclidean distances, shape (len(queries), len(vectors))
+    distances = (queries * queries).sum(axis=1)[:, None] - 2 * queries @ vectors.T + (vectors * vectors).sum(axis=1)[None, :]
+    return np.maximum(distances, 0, out=distances)
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray, chunksize: int = 8192) -> np.ndarray:
+    norms = (centroids * centroids).sum(axis=1)
+    nearest = np.empty(len(vectors), dtype=np.int32)
+    for idx in range(0, len(vectors), chunksize):
+        nearest[idx:idx + chunksize] = (norms - 2 * np.asarray(vectors[idx:idx + chunksize]) @ centroids.T).argmin(axis=1)
+    return nearest
+
+
+def _kmeans(sample: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    centroids = sample[rng.choice(len(sample), k, replace=False)].copy()
+    for _ in range(ITERATIONS):
+        labels = _nearest(sample, centroids)
+        counts = np.bincount(labels, minlength=k)
+        filled = counts > 0
+        for column in range(sample.shape[1]):
+            centroids[filled, column] = np.bincount(labels, weights=sample[:, column], minlength=k)[filled] / counts[filled]
+        # an empty partition restarts on a random point
+        centroids[~filled] = sample[rng.choice(len(sample), int((~filled).sum()))]
+    return centroids
+
+
+
+class SimilarityIndex:
+
+    ARRAYS = {"vectors": np.float32, "partitions": np.int32, "centroids": np.float32}
+
+
+    def __init__(self, path: str, features: tuple = SongsDB.AUDIO_FEATURES):
+        """
+        features are only used by the first build, an existing index keeps its own.
+        """
+        self.path = path
+        self.manifest = self._read_manifest(features)
+        self.features = tuple(self.manifest["features"])
+        self.song_ids = self._read_song_ids()
+        self._lookup = None     # (sorted song ids, their latest row), see _rows_of
+        self._lists = None      # (live rows ordered by partition, partition offsets)
+        self._filters = {}      # (filters, genre map version, last change) -> candidate rows
+        self._arrays = self._centroids = None
+
+
+    def __len__(self) -> int:
+        """
+        Number of indexed songs.
+        """
+        return len(self.live_rows())
+
+
+    # ================== UPDATE ==================
+
+    def update(self, db, chunksize: int = 50000, compact_ratio: float = 1.0) -> int:
+        """
+        Indexes the songs_features changed since the previous update (all of them the first time).
+        Compacts the files when the superseded rows outnumber compact_ratio * live rows and retrains
+        the partitions when the index outgrew them. Returns the number of rows appended.
+        """
+        last_change = db.last_change()
+        if not db.changes_available(self.manifest["last_change"]) or not self._truncate():
+            self._reset()
+            self._truncate()
+        appended = 0
+        if self.manifest["rows"] == 0 and self.manifest["last_change"] == 0:
+            self._fit_scaler(db)
+            for song_ids, data in db.get_features_chunks(self.features, chunksize):
+                appended += self._append(song_ids, data)
+        else:
+            changed = [row[0] for row in db.conn.execute("""SELECT DISTINCT entity_id FROM data_changes
+                                                             WHERE table_name = 'songs_features' AND seq > ? AND seq <= ?""",
+                                                         (self.manifest["last_change"], last_change))]
+            found = set()
+            for song_ids, data in db.get_features_chunks(self.features, chunksize, changed):
+                found.update(song_ids)
+                appended += self._append(song_ids, data)
+            # deleted songs / features set back to NULL: an empty row hides the previous ones
+            removed = [song_id for song_id in changed if song_id not in found]
+            if removed:
+                appended += self._append(removed, None)
+
+        self.manifest["last_change"] = last_change
+        self._write_manifest()
+        db.set_changes_marker("similarity_seq", self.path, last_change)
+        db.prune_changes()
+        live = len(self.live_rows())
+        if self.manifest["rows"] - live > compact_ratio * max(live, 1):
+            self.compact()
+        elif live and (self.manifest["partitions"] == 0 or live > GROWTH * self.manifest["trained_rows"]):
+            self.train()
+        return appended
+
+
+    def _fit_scaler(self, db) -> None:
+        where = " AND ".join(f"{feature} IS NOT NULL" for feature in self.features)
+        row = db.conn.execute(f"""SELECT {", ".join(f"AVG({feature}), AVG({feature} * {feature})" for feature in self.features)}
+                                  FROM songs_features WHERE {where}""").fetchone()
+        if row[0] is None:
+            return      # no complete rows yet, the manifest keeps mean 0 / scale 1
+        mean = np.array(row[0::2], dtype=np.float64)
+        scale = np.sqrt(np.maximum(np.array(row[1::2], dtype=np.float64) - mean ** 2, 0))
+        scale[scale == 0] = 1.0
+        self.manifest["mean"], self.manifest["scale"] = mean.tolist(), scale.tolist()
+
+
+    def normalize(self, data) -> np.ndarray:
+        """
+        Standardized float32 vectors of raw feature rows (columns in the order of self.features).
+        """
+        data = np.asarray(data, dtype=np.float64).reshape(-1, len(self.features))
+        return ((data - np.array(self.manifest["mean"])) / np.array(self.manifest["scale"])).astype(np.float32)
+
+
+    def _append(self, song_ids: list, data) -> int:
+        if data is None:
+            vectors = np.zeros((len(song_ids), len(self.features)), dtype=np.float32)
+            partitions = np.full(len(song_ids), -1, dtype=np.int32)
+        else:
+            vectors = self.normalize(data)
+            partitions = _nearest(vectors, self.centroids()) if self.manifest["partitions"] else np.zeros(len(song_ids), dtype=np.int32)
+        self._append_array("vectors", vectors)
+        self._append_array("partitions", partitions)
+        with open(self._file(SONG_IDS), "a", encoding="utf-8") as file:
+            file.writelines(song_id + "\n" for song_id in song_ids)
+
+        self.song_ids = np.concatenate([self.song_ids, np.array([song_id.encode("utf-8") for song_id in song_ids], dtype="S")])
+        self.manifest["rows"] += len(song_ids)
+        self._lookup = self._lists = self._arrays = None
+        self._filters = {}
+        return len(song_ids)
+
+
+    def train(self, seed: int = 0) -> None:
+        """
+        (Re)computes the partitions: about sqrt(live rows) centroids by k-means on a sample of the
+        live vectors, then the closest centroid of every row.
+        """
+        rows = self.live_rows()
+        if not len(rows):
+            return
+        rng = np.random.default_rng(seed)
+        n_partitions = int(np.clip(round(np.sqrt(len(rows))), 1, MAX_PARTITIONS))
+        vectors, partitions = self.arrays()
+        sample = np.asarray(vectors[np.sort(rng.choice(rows, min(len(rows), max(SAMPLE, n_partitions)), replace=False))])
+        centroids = _kmeans(sample, n_partitions, rng)
+
+        assigned = _nearest(vectors, centroids)
+        assigned[np.asarray(partitions) < 0] = -1
+        generation = self._next_generation()
+        for name, values in (("centroids", centroids), ("partitions", assigned)):
+            values.astype(self.ARRAYS[name]).tofile(self._file(name, generation))
+        # the manifest is the switch to the new generation
+        self.manifest.setdefault("generations", {}).update(centroids=generation, partitions=generation)
+        self.manifest["partitions"] = n_partitions
+        self.manifest["trained_rows"] = len(rows)
+        self._lists = self._arrays = self._centroids = None
+        self._filters = {}
+        self._write_manifest()
+        self._remove_stale()
+
+
+    def compact(self) -> None:
+        """
+        Rewrites the files with the live rows only, then retrains the partitions.
+        """
+        rows = self.live_rows()
+        vectors, partitions = self.arrays()
+        generation = self._next_generation()
+        with open(self._file("vectors", generation), "wb") as file:
+            for idx in range(0, len(rows), 65536):
+                np.asarray(vectors[rows[idx:idx + 65536]]).tofile(file)
+        # the live rows keep their partition, the index stays consistent until train() is done
+        np.asarray(partitions[rows]).tofile(self._file("partitions", generation))
+        song_ids = self.song_ids[rows]
+        with open(self._file(SONG_IDS, generation), "wb") as file:
+            file.writelines(song_id + b"\n" for song_id in song_ids)
+
+        # the manifest is the switch to the new generation
+        self.song_ids = song_ids
+        self.manifest.setdefault("generations", {}).update({name: generation for name in ("vectors", "partitions", SONG_IDS)})
+        self.manifest["rows"] = len(song_ids)
+        self._lookup = self._lists = self._arrays = None
+        self._filters = {}
+        self._write_manifest()
+        self._remove_stale()
+        self.train()
+
+
+    # ================== READ ==================
+
+    def arrays(self) -> tuple:
+        """
+        (vectors, partitions) as read-only memory maps.
+        """
+        if self._arrays is None:
+            rows = self.manifest["rows"]
+            if not rows:
+                return np.zeros((0, len(self.features)), dtype=np.float32), np.zeros(0, dtype=np.int32)
+            # plain ndarray views: indexing an np.memmap subclass costs more than the lookups themselves
+            self._arrays = (np.memmap(self._file("vectors"), dtype=np.float32, mode="r", shape=(rows, len(self.features))).view(np.ndarray),
+                            np.memmap(self._file("partitions"), dtype=np.int32, mode="r", shape=(rows,)).view(np.ndarray))
+        return self._arrays
+
+
+    def centroids(self) -> np.ndarray:
+        if self._centroids is None:
+            self._centroids = np.fromfile(self._file("centroids"), dtype=np.float32).reshape(self.manifest["partitions"], len(self.features))
+        return self._centroids
+
+
+    def _latest(self) -> tuple:
+        if self._lookup is None:
+            order = np.argsort(self.song_ids, kind="stable")
+            ordered = self.song_ids[order]
+            # equal ids keep their row order, the last one of every run is the latest row
+            last = np.ones(len(ordered), dtype=bool)
+            last[:-1] = ordered[1:] != ordered[:-1]
+            self._lookup = (ordered[last], order[last])
+        return self._lookup
+
+
+    def live_rows(self) -> np.ndarray:
+        """
+        Latest row of every song, in row order, without the songs removed since.
+        """
+        rows = np.sort(self._latest()[1])
+        return rows[np.asarray(self.arrays()[1][rows]) >= 0] if len(rows) else rows
+
+
+    def _rows_of(self, song_ids: list) -> np.ndarray:
+        # latest row of every song id, -1 when the song is not indexed
+        ids, rows = self._latest()
+        keys = np.array([song_id.encode("utf-8") for song_id in song_ids], dtype="S")
+        if not len(ids) or not len(keys):
+            return np.full(len(keys), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(ids, keys), len(ids) - 1)
+        found = np.where(ids[positions] == keys, rows[positions], -1)
+        found[found >= 0] = np.where(np.asarray(self.arrays()[1][found[found >= 0]]) >= 0, found[found >= 0], -1)
+        return found
+
+
+    def _inverted_lists(self) -> tuple:
+        if self._lists is None:
+            rows = self.live_rows()
+            partitions = np.asarray(self.arrays()[1][rows])
+            order = np.argsort(partitions, kind="stable")
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(partitions, minlength=self.manifest["partitions"]))])
+            self._lists = (rows[order], offsets)
+        return self._lists
+
+
+    # ================== SEARCH ==================
+
+    def similar(self, song_id: str, k: int = 10, db=None, filters: dict = None, nprobe: int = NPROBE,
+                exact: bool = False, classifier: GenreClassifier = None) -> pd.DataFrame:
+        """
+        The k songs closest to song_id. Columns: rank, song_spotify_id, distance.
+        See similar_many for the filters.
+        """
+        return self.similar_many([song_id], k, db, filters, nprobe, exact, classifier).drop(columns="query_id")
+
+
+    def similar_many(self, song_ids: list, k: int = 10, db=None, filters: dict = None, nprobe: int = NPROBE,
+                     exact: bool = False, classifier: GenreClassifier = None) -> pd.DataFrame:
+        """
+        The k songs closest to each of song_ids (the song itself left out), answered as one batch.
+        filters restricts the results, f.ex. {"release_year": range(1990, 2000), "parent_genre": "rock"}
+        (a value or a collection of values per key of KEYS) and needs db. nprobe is the number of
+        partitions scanned per query, exact=True scans every song.
+        Columns: query_id, rank, song_spotify_id, distance.
+        """
+        song_ids = list(song_ids)
+        own = self._rows_of(song_ids)
+        if (own < 0).any():
+            missing = [song_id for song_id, row in zip(song_ids, own) if row < 0]
+            raise ValueError(f"{len(missing)} songs are not in the similarity index, f.ex. '{missing[0]}'.")
+        vectors = self.arrays()[0]
+        queries = np.asarray(vectors[own])
+
+        rows, distances = self._search(queries, k + 1, self._candidates(db, filters, classifier), nprobe, exact)
+        # the song itself (when found) or else the farthest result is dropped
+        keep = rows != own[:, None]
+        keep &= np.cumsum(keep, axis=1) <= k
+        return self._results(np.array(song_ids, dtype=object), rows[keep].reshape(-1, k), distances[keep].reshape(-1, k))
+
+
+    def nearest(self, data, k: int = 10, db=None, filters: dict = None, nprobe: int = NPROBE,
+                exact: bool = False, classifier: GenreClassifier = None) -> pd.DataFrame:
+        """
+        The k songs closest to raw feature rows (columns in the order of self.features), query_id is
+        the position of the row.
+        """
+        queries = self.normalize(data)
+        rows, distances = self._search(queries, k, self._candidates(db, filters, classifier), nprobe, exact)
+        return self._results(np.arange(len(queries)), rows, distances)
+
+
+    def _results(self, query_ids: np.ndarray, rows: np.ndarray, distances: np.ndarray) -> pd.DataFrame:
+        found = rows >= 0
+        return pd.DataFrame({
+            "query_id": np.repeat(query_ids, rows.shape[1])[found.ravel()],
+            "rank": np.tile(np.arange(1, rows.shape[1] + 1), len(rows))[found.ravel()],
+            "song_spotify_id": np.char.decode(self.song_ids[rows[found]], "utf-8").astype(object),
+            "distance": np.sqrt(distances[found]),
+        })
+
+
+    def _candidates(self, db, filters: dict, classifier: GenreClassifier):
+        # sorted live rows matching the filters, None without filters. Cached until the next data change.
+        if not filters:
+            return None
+        if db is None:
+            raise ValueError("filters need db.")
+        if any(key not in KEYS for key in filters):
+            raise ValueError(f"filters keys must be in {KEYS}.")
+        values = {key: sorted({str(value)} if isinstance(value, (str, int)) else {str(item) for item in value})
+                  for key, value in filters.items()}
+        classifier = classifier if classifier is not None else GenreClassifier(db=db) if "parent_genre" in values else None
+        key = (json.dumps(values, sort_keys=True), classifier.version if classifier is not None else None, db.last_change())
+        if key in self._filters:
+            return self._filters[key]
+
+        joins, conditions, params = "", [], []
+        if "release_year" in values:
+            conditions.append(f"substr(s.release_date, 1, 4) IN ({', '.join('?' * len(values['release_year']))})")
+            params.extend(values["release_year"])
+        if "parent_genre" in values:
+            # the few distinct genres strings are classified here, the songs are then selected by artist genres
+            genres = pd.Series([row[0] for row in db.conn.execute("SELECT DISTINCT genres FROM artists WHERE genres IS NOT NULL")], dtype=object)
+            matching = genres[classifier.classify_series(genres).isin(values["parent_genre"]).to_numpy()].tolist()
+            joins = "JOIN artists a ON s.artist_spotify_id = a.artist_spotify_id"
+            conditions.append(f"a.genres IN ({', '.join('?' * len(matching))})" if matching else "0")
+            params.extend(matching)
+        song_ids = [row[0] for row in db.conn.execute(f"SELECT s.song_spotify_id FROM songs s {joins} WHERE {' AND '.join(conditions)}", params)]
+        rows = self._rows_of(song_ids)
+        if len(self._filters) >= FILTER_CACHE:
+            self._filters.pop(next(iter(self._filters)))
+        self._filters[key] = np.unique(rows[rows >= 0])
+        return self._filters[key]
+
+
+    def _search(self, queries: np.ndarray, k: int, candidates: np.ndarray = None, nprobe: int = NPROBE,
+                exact: bool = False) -> tuple:
+        """
+        (rows, squared distances), both (len(queries), k) sorted by distance, of the closest live rows
+        (among candidates when given). Missing results are -1 / inf.
+        """
+        best_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        best_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        if not len(queries):
+            return best_rows, best_distances
+        vectors = self.arrays()[0]
+
+        if exact or not self.manifest["partitions"] or (candidates is not None and len(candidates) <= EXACT_LIMIT):
+            rows = self.live_rows() if candidates is None else candidates
+            step = max(SCAN_VALUES // len(queries), 1024)
+            everyone = np.arange(len(queries))
+            for idx in range(0, len(rows), step):
+                chunk = rows[idx:idx + step]
+                self._merge(best_rows, best_distances, everyone, chunk, _distances(queries, np.asarray(vectors[chunk])))
+            return self._sorted(best_rows, best_distances)
+
+        centroids = self.centroids()
+        nprobe = min(nprobe, len(centroids))
+        probes = np.argpartition(_distances(queries, centroids), nprobe - 1, axis=1)[:, :nprobe]
+        # queries grouped by probed partition, every partition is read once for the whole batch
+        query_ids = np.repeat(np.arange(len(queries)), nprobe)
+        partitions = probes.ravel()
+        order = np.argsort(partitions, kind="stable")
+        partitions, query_ids = partitions[order], query_ids[order]
+        bounds = np.flatnonzero(np.diff(partitions)) + 1
+        mask = None
+        if candidates is not None:
+            mask = np.zeros(self.manifest["rows"], dtype=bool)
+            mask[candidates] = True
+
+        lists, offsets = self._inverted_lists()
+        for group in np.split(np.arange(len(partitions)), bounds):
+            partition = partitions[group[0]]
+            rows = lists[offsets[partition]:offsets[partition + 1]]
+            if mask is not None:
+                rows = rows[mask[rows]]
+            if len(rows):
+                queries_of = query_ids[group]
+                self._merge(best_rows, best_distances, queries_of, rows, _distances(queries[queries_of], np.asarray(vectors[rows])))
+
+        # with filters the probed partitions can hold less than k candidates: those queries scan all of them
+        short = np.flatnonzero(best_rows[:, -1] < 0)
+        if len(short):
+            best_rows[short], best_distances[short] = self._search(queries[short], k, candidates, nprobe, exact=True)
+        return self._sorted(best_rows, best_distances)
+
+
+    @staticmethod
+    def _merge(best_rows: np.ndarray, best_distances: np.ndarray, queries: np.ndarray, rows: np.ndarray, distances: np.ndarray) -> None:
+        k = best_rows.shape[1]
+        merged_distances = np.concatenate([best_distances[queries], distances], axis=1)
+        merged_rows = np.concatenate([best_rows[queries], np.broadcast_to(rows, distances.shape)], axis=1)
+        top = np.argpartition(merged_distances, k - 1, axis=1)[:, :k]
+        best_distances[queries] = np.take_along_axis(merged_distances, top, axis=1)
+        best_rows[queries] = np.take_along_axis(merged_rows, top, axis=1)
+
+
+    @staticmethod
+    def _sorted(rows: np.ndarray, distances: np.ndarray) -> tuple:
+        order = np.argsort(distances, axis=1, kind="stable")
+        return np.take_along_axis(rows, order, axis=1), np.take_along_axis(distances, order, axis=1)
+
+
+    # ================== FILES ==================
+
+    def _file(self, name: str, generation: int = None) -> str:
+        # "<name>.bin" or "song_ids.txt" in generation 0, "<name>.<generation>.bin" / "song_ids.<generation>.txt" after
+        if generation is None:
+            generation = self.manifest.get("generations", {}).get(name, 0)
+        stem, extension = os.path.splitext(name) if name.endswith(".txt") else (name, ".bin")
+        return os.path.join(self.path, f"{stem}.{generation}{extension}" if generation else stem + extension)
+
+
+    def _next_generation(self) -> int:
+        return max(self.manifest.get("generations", {}).values(), default=0) + 1
+
+
+    def _read_manifest(self, features: tuple) -> dict:
+        try:
+            with open(os.path.join(self.path, MANIFEST), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {"features": list(features), "mean": [0.0] * len(features), "scale": [1.0] * len(features),
+                    "last_change": 0, "rows": 0, "partitions": 0, "trained_rows": 0, SONG_IDS: 0}
+
+
+    def _write_manifest(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        self.manifest[SONG_IDS] = os.path.getsize(self._file(SONG_IDS))
+        tmp = os.path.join(self.path, MANIFEST + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as file:
+            json.dump(self.manifest, file, indent=2, sort_keys=True)
+        os.replace(tmp, os.path.join(self.path, MANIFEST))
+
+
+    def _read_song_ids(self) -> np.ndarray:
+        if not self.manifest["rows"]:
+            return np.zeros(0, dtype="S1")
+        with open(self._file(SONG_IDS), "rb") as file:
+            data = file.read(self.manifest[SONG_IDS])
+        return np.array(data.split(b"\n")[:self.manifest["rows"]], dtype="S")
+
+
+    def _append_array(self, name: str, values: np.ndarray) -> None:
+        with open(self._file(name), "ab") as file:
+            np.asarray(values, dtype=self.ARRAYS[name]).tofile(file)
+
+
+    def _reset(self) -> None:
+        # the change log was pruned past the index, it is built again from scratch (same features)
+        if os.path.exists(os.path.join(self.path, MANIFEST)):
+            os.remove(os.path.join(self.path, MANIFEST))
+        self.__init__(self.path, self.features)
+
+
+    def _truncate(self) -> bool:
+        """
+        Drops whatever an interrupted update appended past the manifest and the files of the other
+        generations. Files are only ever shortened: False when one is shorter than the manifest, the
+        index cannot be repaired and has to be rebuilt.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        self._remove_stale()
+        rows = self.manifest["rows"]
+        sizes = {self._file("vectors"): rows * len(self.features) * 4, self._file("partitions"): rows * 4,
+                 self._file("centroids"): self.manifest["partitions"] * len(self.features) * 4,
+                 self._file(SONG_IDS): self.manifest[SONG_IDS]}
+        current = {name: os.path.getsize(name) if os.path.exists(name) else 0 for name in sizes}
+        if any(current[name] < size for name, size in sizes.items()):
+            return False
+        for name, size in sizes.items():
+            if current[name] > size:
+                with open(name, "r+b") as file:
+                    file.truncate(size)
+        return True
+
+
+    def _remove_stale(self) -> None:
+        # files of a generation the manifest does not point to: replaced by compact() / train(), or written by an interrupted one
+        current = {os.path.basename(self._file(name)) for name in list(self.ARRAYS) + [SONG_IDS]}
+        for entry in os.listdir(self.path):
+            if GENERATION_FILE.fullmatch(entry) and entry not in current:
+                try:
+                    os.remove(os.path.join(self.path, entry))
+                except PermissionError:
+                    pass    # still memory-mapped (Windows), removed by the next update
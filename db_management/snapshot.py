@@ -0,0 +1,187 @@
+import json
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+
+# --- COLUMNAR SNAPSHOT OF THE JOINED DATASET ---
+#
+# Layout:   <path>/release_year=<YYYY>/part.parquet   (zstd, one file per release year)
+#           <path>/release_year=unknown/part.parquet  (songs without release_date)
+#           <path>/_manifest.json                     (last data_changes.seq exported + row counts)
+
+
+MANIFEST = "_manifest.json"
+PART = "part.parquet"
+UNKNOWN_YEAR = "unknown"
+
+SCHEMA = pa.schema([
+    ("song_id", pa.string()),
+    ("song_title", pa.string()),
+    ("song_release_date", pa.string()),
+    ("featured", pa.int8()),
+    ("song_popularity", pa.int16()),
+    ("acousticness", pa.float32()),
+    ("danceability", pa.float32()),
+    ("energy", pa.float32()),
+    ("instrumentalness", pa.float32()),
+    ("liveness", pa.float32()),
+    ("loudness", pa.float32()),
+    ("speechiness", pa.float32()),
+    ("tempo", pa.float32()),
+    ("valence", pa.float32()),
+    ("mode", pa.int8()),
+    ("key", pa.int8()),
+    ("duration_ms", pa.int32()),
+    ("artist_name", pa.string()),
+    ("artist_genres", pa.string()),
+    ("artist_popularity", pa.int16()),
+    ("artist_followers", pa.int32()),
+    ("album_name", pa.string()),
+    ("album_release_date", pa.string()),
+    ("album_total_tracks", pa.int16()),
+    ("album_popularity", pa.int16()),
+    ("lyrics", pa.string()),
+])
+
+
+
+def export_snapshot(db, path: str, chunksize: int = 50000, full: bool = False) -> list:
+    """
+    Writes the denormalized songs join of db (SongsDB) to path, one parquet partition per release year.
+    Only the partitions touched by data_changes since the previous export are rewritten,
+    unless there is no manifest yet or full=True. Returns the list of rewritten years.
+    """
+    manifest = _read_manifest(path)
+    last_change = db.last_change()
+
+    if full or manifest is None or not db.changes_available(manifest["last_change"]):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        manifest = {"last_change": 0, "years": {}}
+        years = None
+    else:
+        years = {year or UNKNOWN_YEAR for year in db.changed_release_years(manifest["last_change"], last_change)}
+        if not years:
+            db.set_changes_marker("snapshot_seq", path, last_change)
+            db.prune_changes()
+            return []
+
+    written = _write_partitions(db, path, years, chunksize)
+    for year in (years if years is not None else written):
+        if year in written:
+            manifest["years"][year] = written[year]
+        else:   # no songs left in that year
+            manifest["years"].pop(year, None)
+            shutil.rmtree(_partition_dir(path, year), ignore_errors=True)
+
+    manifest["last_change"] = last_change
+    _write_manifest(path, manifest)
+    db.set_changes_marker("snapshot_seq", path, last_change)
+    db.prune_changes()
+    return sorted(years if years is not None else written)
+
+
+
+def load_snapshot(path: str, columns: list = None, years: list = None) -> pd.DataFrame:
+    """
+    Reads a snapshot written by export_snapshot. Files are memory-mapped and only the requested
+    columns (and release year partitions) are read. "release_year" can be requested as a column.
+    """
+    manifest = _read_manifest(path)
+    if manifest is None:
+        raise FileNotFoundError(f"No snapshot manifest in {path}.")
+
+    wanted = manifest["years"] if years is None else [str(year) for year in years if str(year) in manifest["years"]]
+    file_columns = None if columns is None else [column for column in columns if column != "release_year"]
+    with_year = columns is None or "release_year" in columns
+
+    frames = []
+    for year in sorted(wanted):
+        table = pq.read_table(os.path.join(_partition_dir(path, year), PART), columns=file_columns, memory_map=True)
+        frame = table.to_pandas()
+        if with_year:
+            frame["release_year"] = year
+        frames.append(frame)
+
+    if not frames:
+        return pd.DataFrame(columns=(columns if columns is not None else SCHEMA.names + ["release_year"]))
+    data = pd.concat(frames, ignore_index=True)
+    if with_year:
+        data["release_year"] = data["release_year"].astype("category")
+    if "artist_genres" in data.columns:
+        data["artist_genres"] = data["artist_genres"].astype("category")
+    return data
+
+
+
+def _write_partitions(db, path: str, years: set, chunksize: int) -> dict:
+    # one ordered pass over idx_songs_release_year, a single open writer at a time
+    year = "substr(s.release_date, 1, 4)"
+    where = ""
+    params = ()
+    if years is not None:
+        known = sorted(year_ for year_ in years if year_ != UNKNOWN_YEAR)
+        conditions = [f"{year} IN ({', '.join('?' * len(known))})"] if known else []
+        if UNKNOWN_YEAR in years:
+            conditions.append(f"{year} IS NULL")
+        where = " OR ".join(conditions)
+        params = tuple(known)
+    query = db._data_query(True, True, where=where, order_by=year, release_year=True)
+
+    written = {}
+    writer, current = None, None
+    try:
+        for chunk in db._data_chunks(query, chunksize, params):
+            chunk["release_year"] = chunk["release_year"].fillna(UNKNOWN_YEAR)
+            for chunk_year, part in chunk.groupby("release_year", sort=False):
+                if chunk_year != current:
+                    _close(writer, path, current)
+                    current = chunk_year
+                    os.makedirs(_partition_dir(path, current), exist_ok=True)
+                    writer = pq.ParquetWriter(_tmp_part(path, current), SCHEMA, compression="zstd")
+                    written[current] = 0
+                part = part.drop(columns="release_year").astype({"artist_genres": object})
+                writer.write_table(pa.Table.from_pandas(part, schema=SCHEMA, preserve_index=False))
+                written[current] += len(part)
+        _close(writer, path, current)
+    except BaseException:
+        if writer is not None:
+            writer.close()
+        raise
+    return written
+
+
+
+def _close(writer, path: str, year: str) -> None:
+    if writer is not None:
+        writer.close()
+        os.replace(_tmp_part(path, year), os.path.join(_partition_dir(path, year), PART))
+
+
+def _partition_dir(path: str, year: str) -> str:
+    return os.path.join(path, f"release_year={year}")
+
+
+def _tmp_part(path: str, year: str) -> str:
+    return os.path.join(_partition_dir(path, year), PART + ".tmp")
+
+
+def _read_manifest(path: str):
+    try:
+        with open(os.path.join(path, MANIFEST), "r", encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def _write_manifest(path: str, manifest: dict) -> None:
+    os.makedirs(path, exist_ok=True)
+    tmp = os.path.join(path, MANIFEST + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(tmp, os.path.join(path, MANIFEST))
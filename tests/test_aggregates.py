@@ -0,0 +1,54 @@
+from db_management.aggregates import check_aggregates, feature_stats, refresh_aggregates
+from db_management.db import SongsDB, ArtistInfo, IDSongInfo
+from db_management.genres import GenreClassifier
+
+
+
+GENRE_MAP = {"pop": "pop", "rock": "rock", "hip hop": "hip hop"}
+
+
+def features(song_id: str, idx: int) -> tuple:
+    return (song_id, 0.1 * (idx % 10), 0.5, 0.2 + 0.01 * idx, 0.0, 0.1, -5.0 - idx, 0.05, 100.0 + idx, 0.3, idx % 2, idx % 12, 200000 + idx)
+
+
+def populate(db: SongsDB, start: int, end: int) -> None:
+    # the artists already stored are rejected
+    db.artists_insert_many([ArtistInfo(f"ar{idx}", f"Artist {idx}", genres, 1, 1)
+                            for idx, genres in enumerate(["dance pop", "hard rock", "hip hop", ""])])
+    dates = ["1975-06-13", "1975", "1980-01-04", None]
+    db.songs_insert_many([IDSongInfo(f"song{idx}", f"al{idx}", f"ar{idx % 4}", f"Title {idx}", dates[idx % 4], 0, idx)
+                          for idx in range(start, end)])
+    db.conn.executemany(db.SONGS_FEATURES_INSERT, [features(f"song{idx}", idx) for idx in range(start, end)])
+    db.conn.commit()
+
+
+def test_refresh_matches_full_recomputation(tmp_path):
+    db = SongsDB(str(tmp_path / "songs.db"))
+    classifier = GenreClassifier(GENRE_MAP, db=db)
+    populate(db, 0, 40)
+    assert check_aggregates(db, classifier) == []
+
+    # new songs, a moved song, a deleted one and a changed artist are applied incrementally
+    populate(db, 40, 60)
+    db.conn.execute("UPDATE songs SET release_date = '1999-12-31' WHERE song_spotify_id = 'song0'")
+    db.conn.execute("DELETE FROM songs_features WHERE song_spotify_id = 'song5'")
+    db.conn.execute("UPDATE artists SET genres = 'pop' WHERE artist_spotify_id = 'ar3'")
+    db.conn.commit()
+    assert sorted(refresh_aggregates(db, classifier)) == ["1975", "1980", "1999", "unknown"]
+    assert check_aggregates(db, classifier) == []
+
+    stats = feature_stats(db, classifier=classifier)
+    assert stats["count"].sum() == 59
+    db.close_connection()
+
+
+def test_genre_map_versions_do_not_overwrite_each_other(tmp_path):
+    db = SongsDB(str(tmp_path / "songs.db"))
+    populate(db, 0, 20)
+    first = GenreClassifier(GENRE_MAP, db=db)
+    second = GenreClassifier(dict(GENRE_MAP, rock="pop"), db=db)
+    assert check_aggregates(db, first) == []
+    assert check_aggregates(db, second) == []
+    assert db.get_genre_mapping(first.version)["hard rock"] == "rock"
+    assert db.get_genre_mapping(second.version)["hard rock"] == "pop"
+    db.close_connection()
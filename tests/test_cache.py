@@ -0,0 +1,33 @@
+import os
+
+from db_management.cache import ResponseCache
+
+
+
+def test_size_shared_between_instances(tmp_path):
+    path = str(tmp_path / "http_cache.db")
+    body = os.urandom(600).hex()     # does not compress
+    first, second = ResponseCache(path, max_bytes=10 ** 6), ResponseCache(path, max_bytes=10 ** 6)
+    first.put_many([(f"a{idx}", "https://api/v1/tracks/a", body) for idx in range(10)])
+    second.put_many([(f"b{idx}", "https://api/v1/tracks/b", body) for idx in range(10)])
+    assert first.size == second.size == sum(row[0] for row in first.conn.execute("SELECT size FROM responses"))
+
+    # replacing an entry does not count it twice
+    second.put("a0", "https://api/v1/tracks/a", body)
+    assert first.size == second.size == sum(row[0] for row in first.conn.execute("SELECT size FROM responses"))
+
+    # eviction sees the entries of both instances
+    second.max_bytes = first.size // 2
+    second.put("c0", "https://api/v1/tracks/c", body)
+    assert first.size <= second.max_bytes * 0.9
+    assert first.get("a1") is None and first.get("c0") == body
+    first.close()
+    second.close()
+
+
+def test_purge_expired(tmp_path):
+    cache = ResponseCache(str(tmp_path / "http_cache.db"), ttls={"/tracks": -1, "/audio-features": None})
+    cache.put_many([("t0", "https://api/v1/tracks/t0", "{}"), ("f0", "https://api/v1/audio-features/f0", "{}")])
+    assert cache.purge_expired() == 1
+    assert cache.stats()["entries"] == 1 and cache.size == cache.conn.execute("SELECT size FROM responses").fetchone()[0]
+    cache.close()
@@ -0,0 +1,68 @@
+from datetime import date
+
+from db_management.charts import ChartClient, ChartScraper, parse_chart, week_dates
+from db_management.db import SongsDB
+from db_management.mock_api import MockAPIServer, synthetic_chart_page
+from db_management.pipeline import RateLimiter
+
+
+
+def item(name: str = None, artist: str = None) -> str:
+    links = ""
+    if name is not None:
+        links += f'<a class="chart-name font-bold" href="/songs/1/"><span class="movement-icon">New</span>{name}</a>'
+    if artist is not None:
+        links += f'<a class="chart-artist" href="/artist/1/">{artist}</a>'
+    return f'<div class="chart-item"><div class="chart-item-content">{links}</div></div>'
+
+
+def test_parse_chart_edge_cases():
+    page = ("<main>"
+            + item("<span>Song &amp; Dance</span>", "<span>  The\n <b>Band</b> </span>")
+            + item("<span>No Artist</span>")
+            + item(artist="<span>No Title</span>")
+            + '<div class="chart-item chart-ad"><span>Advertisement</span></div>'
+            + item("<span class=\"label\">Label</span><span>Caf&eacute; &#39;75</span>", "<span>Artist&nbsp;X</span>")
+            + item("<span class=\"label\">only classed spans</span>", "<span>Artist</span>")
+            + '<div class="chart-items-footer"><a class="chart-name"><span>Not An Item</span></a></div>'
+            + "</main>")
+    assert parse_chart(page) == [("Song & Dance", "The Band"), ("Café '75", "Artist X")]
+
+
+def test_parse_synthetic_chart_page():
+    entries = parse_chart(synthetic_chart_page("20240105"))
+    assert len(entries) == 100
+    assert all(title.startswith("Song ") and artist.startswith("Artist ") for title, artist in entries)
+    assert any("&" in artist for _, artist in entries) and not any("&amp;" in artist for _, artist in entries)
+    assert parse_chart(synthetic_chart_page("20240105", entries=3, filler=0)) == entries[:3]
+
+
+def test_week_dates():
+    # weeks are keyed by their Friday, whatever the day of the run
+    assert week_dates(date(2024, 1, 1), date(2024, 1, 19)) == ["20240105", "20240112", "20240119"]
+    assert week_dates(date(2024, 1, 5), date(2024, 1, 18)) == ["20240105", "20240112"]
+    assert week_dates(date(2024, 1, 6), date(2024, 1, 11)) == []
+
+
+def test_scraper_revalidates_with_conditional_requests(tmp_path):
+    path = str(tmp_path / "songs.db")
+    start, end = date(2024, 1, 1), date(2024, 2, 29)
+    with MockAPIServer() as server:
+        scraper = ChartScraper(path, ChartClient(server.url, limiter=RateLimiter(10000)), workers=4)
+        stats = scraper.run(start, end)
+        assert (stats["weeks"], stats["fetched"], stats["entries"], stats["failed"]) == (8, 8, 800, 0)
+
+        # only the weeks of the last refresh_days are asked again, and they did not change
+        stats = scraper.run(start, end)
+        assert (stats["weeks"], stats["not_modified"], stats["fetched"]) == (2, 2, 0)
+        assert server.not_modified_count == 2
+
+        server.fixtures["charts"] = {"20240112": "<main>" + item("<span>Changed</span>", "<span>Someone</span>") + "</main>"}
+        stats = scraper.run(start, end, revalidate=True)
+        assert (stats["weeks"], stats["not_modified"], stats["fetched"], stats["new_songs"]) == (8, 7, 1, 1)
+        assert server.not_modified_count == 9
+
+    db = SongsDB(path)
+    assert db.conn.execute("SELECT COUNT(*) FROM chart_positions").fetchone()[0] == 701
+    assert db.conn.execute("SELECT title, artist FROM chart_positions WHERE week = '20240112'").fetchall() == [("Changed", "Someone")]
+    db.close_connection()
@@ -0,0 +1,54 @@
+import numpy as np
+
+from db_management.clustering import STATE, SongClusterer
+from db_management.db import SongsDB, SongFeaturesBatch
+from db_management.mock_api import synthetic_features
+
+
+
+def features_db(tmp_path, songs: int = 600) -> str:
+    db_path = str(tmp_path / "songs.db")
+    db = SongsDB(db_path)
+    db.songs_features_insert_many(SongFeaturesBatch.from_dicts([synthetic_features(f"song{idx}") for idx in range(songs)]))
+    db.close_connection()
+    return db_path
+
+
+def test_shuffled_chunks_cover_every_song_once(tmp_path):
+    db = SongsDB(features_db(tmp_path))
+    chunks = list(db.get_features_chunks(chunksize=64, shuffle=True, seed=1))
+    song_ids = [song_id for ids, _ in chunks for song_id in ids]
+    assert sorted(song_ids) == sorted(f"song{idx}" for idx in range(600))
+    assert song_ids != [f"song{idx}" for idx in range(600)]
+    db.close_connection()
+
+
+def test_save_drops_superseded_model(tmp_path):
+    db_path = features_db(tmp_path)
+    first = SongClusterer(db_path, n_clusters=2, chunksize=128, epochs=2).fit()
+    first.save()
+    assert first.assign() == 600
+
+    second = SongClusterer(db_path, n_clusters=3, chunksize=128, epochs=2).fit()
+    second.save()
+    assert second.assign() == 600
+    db = SongsDB(db_path)
+    assert db.conn.execute("SELECT model_id FROM cluster_models").fetchall() == [(second.model_id,)]
+    assert db.conn.execute("SELECT DISTINCT model_id FROM song_clusters").fetchall() == [(second.model_id,)]
+    markers = [row[0] for row in db.conn.execute("SELECT name FROM analytics_state WHERE name LIKE ?", (STATE + "%",))]
+    assert markers == [STATE + second.model_id]
+    # nothing holds the log back anymore
+    assert db.conn.execute("SELECT COUNT(*) FROM data_changes").fetchone()[0] == 0
+    db.close_connection()
+
+    SongClusterer.drop_model(db_path, second.model_id)
+    db = SongsDB(db_path)
+    assert db.conn.execute("SELECT COUNT(*) FROM song_clusters").fetchone()[0] == 0
+    assert db.conn.execute("SELECT COUNT(*) FROM analytics_state WHERE name LIKE ?", (STATE + "%",)).fetchone()[0] == 0
+    db.close_connection()
+
+
+def test_fit_is_reproducible(tmp_path):
+    db_path = features_db(tmp_path)
+    centers = [SongClusterer(db_path, n_clusters=3, chunksize=128, epochs=2).fit().kmeans.cluster_centers_ for _ in range(2)]
+    assert np.allclose(centers[0], centers[1])
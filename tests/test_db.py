@@ -0,0 +1,149 @@
+import sqlite3
+
+import pytest
+
+from db_management.db import SongsDB, ArtistInfo, LyricsInfo, SongFeaturesBatch
+from db_management.mock_api import synthetic_features
+
+
+
+def make_db(tmp_path) -> SongsDB:
+    return SongsDB(str(tmp_path / "songs.db"))
+
+
+def artists(*ids: str) -> list:
+    return [ArtistInfo(artist_id, f"Artist {artist_id}", "pop", 1, 1) for artist_id in ids]
+
+
+def test_insert_many_rejects_only_the_failing_rows(tmp_path):
+    db = make_db(tmp_path)
+    db.artists_insert_many(artists("ar0"))
+    rows = artists("ar0", "ar1", "ar2", "ar3", "ar4")
+    rows[2].genres = ["not", "bindable"]
+    rows[3].followers = 1 << 70
+    assert db.artists_insert_many(rows, batch_size=2) == ["ar0", "ar2", "ar3"]
+    assert db.conn.execute("SELECT artist_spotify_id FROM artists ORDER BY 1").fetchall() == [("ar0",), ("ar1",), ("ar4",)]
+    db.close_connection()
+
+
+def test_insert_many_raises_other_errors(tmp_path):
+    db = make_db(tmp_path)
+    db.artists_insert_many(artists("ar0"))
+    other = SongsDB(db.db_path)
+    other.conn.execute("BEGIN IMMEDIATE")     # holds the write lock
+    db.conn.execute("PRAGMA busy_timeout = 0")
+    with pytest.raises(sqlite3.OperationalError, match="locked"):
+        db.artists_insert_many(artists("ar0", "ar1"))
+    other.conn.rollback()
+    assert not db.conn.in_transaction
+    assert db.artists_insert_many(artists("ar1")) == []
+    other.close_connection()
+    db.close_connection()
+
+
+def test_features_batch_keeps_null_ints(tmp_path):
+    records = [synthetic_features("s0"), dict(synthetic_features("s1"), mode=None, key=None, duration_ms=None),
+               dict(synthetic_features("s2"), energy=None, key=-1)]
+    batch = SongFeaturesBatch.from_dicts(records)
+    batch.append(dict(synthetic_features("s3"), duration_ms=None))
+    frame = batch.to_frame()
+    assert frame["mode"].isna().tolist() == [False, True, False, False]
+    assert frame["duration_ms"].isna().tolist() == [False, True, False, True]
+    assert frame["key"].tolist()[2] == -1 and frame["energy"].isna().tolist()[2]
+
+    db = make_db(tmp_path)
+    assert db.songs_features_insert_many(batch) == []
+    stored = db.conn.execute("SELECT song_spotify_id, mode, key, duration_ms FROM songs_features ORDER BY 1").fetchall()
+    assert stored[1] == ("s1", None, None, None)
+    assert stored[2][2] == -1 and stored[3][3] is None
+    assert stored[0] == ("s0", records[0]["mode"], records[0]["key"], records[0]["duration_ms"])
+    db.close_connection()
+
+
+def test_changes_kept_without_markers(tmp_path):
+    db = make_db(tmp_path)
+    db.artists_insert_many(artists("ar0", "ar1"))
+    assert db.prune_changes() == 0
+    assert db.conn.execute("SELECT COUNT(*) FROM data_changes").fetchone()[0] == 2
+    assert db.changes_available(0)
+    db.close_connection()
+
+
+def test_changes_pruned_up_to_slowest_marker(tmp_path):
+    db = make_db(tmp_path)
+    db.artists_insert_many(artists("ar0", "ar1", "ar2"))
+    db.conn.execute("INSERT INTO analytics_state (name, value) VALUES ('fast_seq', 3), ('slow_seq', 1)")
+    assert db.prune_changes() == 1
+    assert not db.changes_available(0) and db.changes_available(1)
+    db.close_connection()
+
+
+def test_bulk_load_invalidates_instead_of_logging(tmp_path):
+    db = make_db(tmp_path)
+    db.artists_insert_many(artists("ar0"))
+    since = db.last_change()
+    with db.bulk_load():
+        db.artists_insert_many(artists(*(f"ar{idx}" for idx in range(1, 1001))))
+    # one row for the whole load, and the consumers behind it rebuild
+    assert db.conn.execute("SELECT COUNT(*) FROM data_changes WHERE table_name = 'artists'").fetchone()[0] == 1
+    assert not db.changes_available(since) and db.changes_available(db.last_change())
+
+    # the triggers are back after the block
+    db.artists_insert_many(artists("ar1001"))
+    assert db.conn.execute("SELECT entity_id FROM data_changes ORDER BY seq DESC LIMIT 1").fetchone() == ("ar1001",)
+    db.close_connection()
+
+
+def test_genre_mapping_keeps_every_version(tmp_path):
+    db = make_db(tmp_path)
+    db.genre_mapping_insert_many({"dance pop": "pop"}, "v1")
+    db.genre_mapping_insert_many({"dance pop": "dance"}, "v2")
+    assert db.get_genre_mapping("v1") == {"dance pop": "pop"}
+    assert db.get_genre_mapping("v2") == {"dance pop": "dance"}
+    db.close_connection()
+
+
+def test_genre_mapping_migrated_from_genres_key(tmp_path):
+    db = make_db(tmp_path)
+    db.conn.executescript("""DROP TABLE genre_mapping;
+                             CREATE TABLE genre_mapping (genres TEXT PRIMARY KEY, parent_genre TEXT, map_version TEXT NOT NULL);
+                             INSERT INTO genre_mapping VALUES ('dance pop', 'pop', 'v1');
+                             PRAGMA user_version = 2;""")
+    db.close_connection()
+
+    db = make_db(tmp_path)
+    db.genre_mapping_insert_many({"dance pop": "dance"}, "v2")
+    assert db.get_genre_mapping("v1") == {"dance pop": "pop"}
+    assert db.get_genre_mapping("v2") == {"dance pop": "dance"}
+    db.close_connection()
+
+
+def test_uncommitted_insert_error_leaves_no_transaction_open(tmp_path):
+    db = make_db(tmp_path)
+    with pytest.raises(sqlite3.OperationalError):
+        db._insert_many("INSERT INTO missing VALUES (?)", [(1,)], lambda row: row[0], 10, commit=False)
+    assert not db.conn.in_transaction
+
+    # in the caller's transaction only the failed batch is undone
+    assert db.artists_insert_many(artists("ar0"), commit=False) == []
+    with pytest.raises(sqlite3.OperationalError):
+        db._insert_many("INSERT INTO missing VALUES (?)", [(1,)], lambda row: row[0], 10, commit=False)
+    assert db.conn.in_transaction
+    db.conn.commit()
+    assert db.conn.execute("SELECT artist_spotify_id FROM artists").fetchall() == [("ar0",)]
+    db.close_connection()
+
+
+def test_raw_queries_read_decompressed_lyrics(tmp_path):
+    db = make_db(tmp_path)
+    texts = {f"s{idx}": f"verse {idx}\n" + "la la la, we sing along all night long\n" * 20 for idx in range(50)}
+    db.lyrics_insert_many(LyricsInfo(song_id, text) for song_id, text in texts.items())
+    db.train_lyrics_dictionary()
+    db.lyrics_insert_many([LyricsInfo("short", "hey")])
+    db.compress_lyrics()
+    assert isinstance(db.conn.execute("SELECT lyrics FROM lyrics WHERE song_spotify_id = 's0'").fetchone()[0], bytes)
+
+    texts["short"] = "hey"
+    assert dict(db.get_query_database("SELECT song_spotify_id, lyrics FROM lyrics")) == texts
+    assert dict(db.conn.execute("SELECT song_spotify_id, decompress_lyrics(lyrics) FROM lyrics")) == texts
+    db.close_connection()
@@ -0,0 +1,57 @@
+import numpy as np
+
+from db_management.db import SongsDB, IDSongInfo, SongFeaturesBatch
+from db_management.duplicates import _components, find_duplicates, normalize_title
+
+
+
+def features(song_id: str, value: float) -> dict:
+    return dict({column: value for column in SongFeaturesBatch.FLOAT_COLUMNS}, id=song_id, mode=1, key=5, duration_ms=200000)
+
+
+def populate(db: SongsDB, songs: list) -> None:
+    # songs: (song id, artist id, title, popularity, feature value)
+    db.songs_insert_many(IDSongInfo(song_id, "al0", artist_id, title, "1965-08-06", 0, popularity)
+                         for song_id, artist_id, title, popularity, _ in songs)
+    db.songs_features_insert_many(SongFeaturesBatch.from_dicts([features(song[0], song[4]) for song in songs]))
+
+
+def test_normalize_title():
+    assert normalize_title("Yesterday - Remastered 2009") == ("yesterday", True)
+    assert normalize_title("Café del Mar (feat. Someone)") == ("cafe del mar", True)
+    assert normalize_title("Rock & Roll") == ("rock and roll", False)
+    assert normalize_title("Yesterday (Remix)") == ("yesterday remix", False)
+    assert normalize_title("(Live)") == ("live", False)
+
+
+def test_components_follow_chains():
+    labels = _components(8, np.array([[5, 7], [3, 5], [0, 3], [2, 1]]))
+    assert labels.tolist() == [0, 1, 1, 0, 4, 0, 6, 0]
+
+
+def test_duplicates_are_connected_components(tmp_path):
+    db = SongsDB(str(tmp_path / "songs.db"))
+    populate(db, [("s0", "ar0", "Yesterday - Remastered 2009", 90, 0.5),
+                  ("s1", "ar0", "Yesterday", 10, 0.5),
+                  ("s2", "ar0", "Yesterday (Live)", 50, 0.5),
+                  ("s3", "ar0", "Yesterday (Mono)", 20, 0.5),
+                  ("s4", "ar0", "Yesterday (Remix)", 30, 0.5),
+                  ("s5", "ar1", "Yesterday", 80, 0.5),
+                  ("s6", "ar1", "Help!", 70, 0.0),
+                  ("s7", "ar1", "Help! - Live", 60, 1.0)])
+
+    # with a window of 1 only neighbours are compared: s0..s3 are linked through chains of pairs
+    for window in (1, 10):
+        duplicates = find_duplicates(db, window=window).set_index("song_id")
+        assert sorted(duplicates.index) == ["s0", "s1", "s2", "s3"]
+        # the song without a version tag is canonical, even when less popular
+        assert (duplicates["canonical_id"] == "s1").all()
+        assert duplicates.loc["s1", "score"] == 1.0
+
+    # the features of the live Help! are too far away - without a distance limit it is a duplicate
+    loose = find_duplicates(db, max_feature_distance=np.inf).set_index("song_id")
+    assert loose.loc["s7", "canonical_id"] == "s6"
+
+    assert db.refresh_duplicates() == 3
+    assert db.conn.execute("SELECT COUNT(*) FROM song_duplicates").fetchone()[0] == 4
+    db.close_connection()
@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+
+from db_management.db import SongsDB
+from db_management.genres import GenreClassifier
+
+
+
+GENRE_MAP = {"rock": "rock", "post-rock": "experimental", "pop": "pop", "k-pop": "k-pop", "hip hop": "hip hop"}
+
+
+def test_longest_key_wins():
+    classifier = GenreClassifier(GENRE_MAP)
+    assert classifier.classify("post-rock") == "experimental"
+    assert classifier.classify("k-pop") == "k-pop"
+    # most matches first, then the first match
+    assert classifier.classify("dance pop,pop,post-rock") == "pop"
+    assert classifier.classify("post-rock,rock") == "experimental"
+    assert classifier.classify("Hip Hop,rock") == "hip hop"
+    assert classifier.classify("jazz") is None
+    assert classifier.classify("") is None and classifier.classify(None) is None
+
+
+def test_classify_series():
+    classifier = GenreClassifier(GENRE_MAP)
+    genres = pd.Series(["k-pop,pop", None, "jazz", "post-rock", "k-pop,pop"], index=[10, 11, 12, 13, 14], name="genres")
+    result = classifier.classify_series(genres)
+    assert list(result.cat.categories) == sorted(set(GENRE_MAP.values()))
+    assert result.index.equals(genres.index) and result.name == "genres"
+    assert result.astype(object).where(result.notna(), None).tolist() == ["k-pop", None, None, "experimental", "k-pop"]
+    assert classifier.classify_series(pd.Series([], dtype=object)).empty
+
+
+def test_mapping_cached_per_map_version(tmp_path, monkeypatch):
+    db = SongsDB(str(tmp_path / "songs.db"))
+    GenreClassifier(GENRE_MAP, db=db).classify_series(pd.Series(["post-rock", "dance pop", "jazz"]))
+    other = GenreClassifier(dict(GENRE_MAP, **{"post-rock": "rock"}), db=db)
+    assert other.cache == {}
+    assert other.classify("post-rock") == "rock"
+
+    # the same map is answered from genre_mapping without matching again
+    def fail(self, genres):
+        raise AssertionError(f"{genres!r} matched again")
+    monkeypatch.setattr(GenreClassifier, "_match", fail)
+    cached = GenreClassifier(GENRE_MAP, db=db)
+    assert cached.cache == {"post-rock": "experimental", "dance pop": "pop", "jazz": None}
+    assert cached.classify_series(pd.Series(["jazz", "dance pop"])).tolist()[1] == "pop"
+    with pytest.raises(AssertionError):
+        cached.classify("rock")
+    db.close_connection()
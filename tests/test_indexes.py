@@ -0,0 +1,195 @@
+import os
+
+import numpy as np
+import pytest
+
+from db_management.db import SongsDB, LyricsInfo, SongFeaturesBatch
+from db_management.lyrics_index import LyricsIndex
+from db_management.similarity import SimilarityIndex
+
+
+
+WORDS = ["love", "night", "heart", "dance", "rain", "fire", "road", "home"]
+
+
+def lyrics(idx: int, version: int = 0) -> str:
+    return " ".join(WORDS[(idx + version + position) % len(WORDS)] for position in range(idx % 5 + 3))
+
+
+def lyrics_db(tmp_path) -> SongsDB:
+    db = SongsDB(str(tmp_path / "songs.db"))
+    db.lyrics_insert_many(LyricsInfo(f"s{idx}", lyrics(idx)) for idx in range(200))
+    return db
+
+
+def rewrite_lyrics(db: SongsDB, version: int) -> None:
+    db.conn.executemany("UPDATE lyrics SET lyrics = ? WHERE song_spotify_id = ?",
+                        ((lyrics(idx, version), f"s{idx}") for idx in range(0, 200, 2)))
+    db.conn.commit()
+
+
+def lyrics_state(index: LyricsIndex) -> dict:
+    # song id -> (term counts, tokens) of its live row
+    rows = index.live_rows()
+    per_term, tokens = index.term_counts(WORDS, rows)
+    return {index.song_ids[row]: (counts, total) for row, counts, total in zip(rows, per_term.tolist(), tokens.tolist())}
+
+
+def test_lyrics_index_compaction_and_reopen(tmp_path):
+    db = lyrics_db(tmp_path)
+    path = str(tmp_path / "lyrics_index")
+    index = LyricsIndex(path)
+    index.update(db)
+    for version in range(1, 4):
+        rewrite_lyrics(db, version)
+        index.update(db, compact_ratio=10)
+    assert index.manifest["rows"] == 500
+
+    expected = lyrics_state(index)
+    index.compact()
+    assert index.manifest["rows"] == 200
+    assert lyrics_state(index) == lyrics_state(LyricsIndex(path)) == expected
+    # the previous generation is gone
+    assert sorted(entry for entry in os.listdir(path) if entry.endswith(".bin")) == ["counts.1.bin", "indices.1.bin", "indptr.1.bin"]
+    db.close_connection()
+
+
+def test_lyrics_index_interrupted_compaction(tmp_path, monkeypatch):
+    db = lyrics_db(tmp_path)
+    path = str(tmp_path / "lyrics_index")
+    index = LyricsIndex(path)
+    index.update(db)
+    rewrite_lyrics(db, 1)
+    index.update(db, compact_ratio=10)
+    expected = lyrics_state(index)
+
+    def crash():
+        raise OSError("killed before the manifest")
+    monkeypatch.setattr(index, "_write_manifest", crash)
+    with pytest.raises(OSError):
+        index.compact()
+
+    # the manifest still points to the previous generation, whose files are untouched
+    reopened = LyricsIndex(path)
+    assert lyrics_state(reopened) == expected
+    rewrite_lyrics(db, 2)
+    reopened.update(db, compact_ratio=10)
+    assert not any(".1." in entry for entry in os.listdir(path))
+    assert lyrics_state(reopened) == lyrics_state(fresh_lyrics_index(db, tmp_path))
+    db.close_connection()
+
+
+def test_lyrics_index_short_file_is_rebuilt(tmp_path):
+    db = lyrics_db(tmp_path)
+    path = str(tmp_path / "lyrics_index")
+    LyricsIndex(path).update(db)
+    indices = os.path.join(path, "indices.bin")
+    size = os.path.getsize(indices)
+    with open(indices, "r+b") as file:
+        file.truncate(size // 2)
+
+    index = LyricsIndex(path)
+    rewrite_lyrics(db, 1)
+    index.update(db)
+    # rebuilt instead of zero-extended
+    assert np.asarray(index.arrays()[2]).min() > 0
+    assert lyrics_state(index) == lyrics_state(fresh_lyrics_index(db, tmp_path))
+    db.close_connection()
+
+
+def fresh_lyrics_index(db: SongsDB, tmp_path) -> LyricsIndex:
+    index = LyricsIndex(str(tmp_path / "fresh_lyrics_index"))
+    index.update(db)
+    return index
+
+
+
+def features(rng: np.random.Generator, song_ids: list) -> list:
+    # songs around 20 centers, so the partitions mean something
+    centers = np.random.default_rng(0).uniform(0, 1, (20, 9))
+    values = np.clip(centers[rng.integers(0, 20, len(song_ids))] + rng.normal(0, 0.05, (len(song_ids), 9)), 0, 1)
+    columns = SongFeaturesBatch.FLOAT_COLUMNS
+    return [dict(zip(columns, row), id=song_id, mode=1, key=5, duration_ms=200000) for song_id, row in zip(song_ids, values.tolist())]
+
+
+def features_db(tmp_path, songs: int = 3000) -> SongsDB:
+    db = SongsDB(str(tmp_path / "songs.db"))
+    db.songs_features_insert_many(SongFeaturesBatch.from_dicts(features(np.random.default_rng(1), [f"s{idx}" for idx in range(songs)])))
+    return db
+
+
+def rewrite_features(db: SongsDB, seed: int) -> None:
+    for row in features(np.random.default_rng(seed), [f"s{idx}" for idx in range(0, 3000, 2)]):
+        db.conn.execute(f"UPDATE songs_features SET {', '.join(f'{column} = ?' for column in SongFeaturesBatch.FLOAT_COLUMNS)} WHERE song_spotify_id = ?",
+                        [row[column] for column in SongFeaturesBatch.FLOAT_COLUMNS] + [row["id"]])
+    db.conn.commit()
+
+
+def files(index: SimilarityIndex) -> tuple:
+    # (files in the directory, files the manifest points to)
+    current = {os.path.basename(index._file(name)) for name in ("vectors", "partitions", "centroids", "song_ids.txt")}
+    return set(os.listdir(index.path)) - {"_manifest.json"}, current
+
+
+def neighbours(index: SimilarityIndex, exact: bool = True) -> dict:
+    results = index.similar_many([f"s{idx}" for idx in range(0, 3000, 30)], k=10, exact=exact)
+    return {query: list(group["song_spotify_id"]) for query, group in results.groupby("query_id")}
+
+
+def test_similarity_recall(tmp_path):
+    db = features_db(tmp_path)
+    index = SimilarityIndex(str(tmp_path / "similarity"))
+    index.update(db)
+    assert index.manifest["partitions"] > 1
+    exact, approximate = neighbours(index), neighbours(index, exact=False)
+    recall = np.mean([len(set(exact[query]) & set(approximate[query])) / 10 for query in exact])
+    assert recall >= 0.9
+    db.close_connection()
+
+
+def test_similarity_compaction_and_reopen(tmp_path):
+    db = features_db(tmp_path)
+    path = str(tmp_path / "similarity")
+    index = SimilarityIndex(path)
+    index.update(db)
+    for seed in range(2, 4):
+        rewrite_features(db, seed)
+        index.update(db, compact_ratio=10)
+    assert index.manifest["rows"] == 6000
+
+    expected = neighbours(index)
+    index.compact()
+    assert index.manifest["rows"] == 3000
+    assert neighbours(index) == neighbours(SimilarityIndex(path)) == expected
+    on_disk, current = files(index)
+    assert on_disk == current and "vectors.bin" not in current
+    db.close_connection()
+
+
+def test_similarity_interrupted_compaction(tmp_path, monkeypatch):
+    db = features_db(tmp_path)
+    path = str(tmp_path / "similarity")
+    index = SimilarityIndex(path)
+    index.update(db)
+    rewrite_features(db, 2)
+    index.update(db, compact_ratio=10)
+    expected = neighbours(index)
+
+    def crash():
+        raise OSError("killed before the manifest")
+    monkeypatch.setattr(index, "_write_manifest", crash)
+    with pytest.raises(OSError):
+        index.compact()
+
+    reopened = SimilarityIndex(path)
+    on_disk, current = files(reopened)
+    assert on_disk > current
+    assert neighbours(reopened) == expected
+    rewrite_features(db, 3)
+    reopened.update(db, compact_ratio=10)
+    assert files(reopened)[0] == files(reopened)[1]
+    assert len(reopened) == 3000 and neighbours(reopened) == neighbours(SimilarityIndex(path))
+    # the rewritten songs are indexed with their current features
+    stored = db.conn.execute(f"SELECT {', '.join(reopened.features)} FROM songs_features WHERE song_spotify_id = 's0'").fetchone()
+    assert np.allclose(reopened.arrays()[0][reopened._rows_of(["s0"])[0]], reopened.normalize(stored))
+    db.close_connection()
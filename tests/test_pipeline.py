@@ -0,0 +1,94 @@
+import sqlite3
+import threading
+
+from db_management.db import SongsDB, AlbumInfo, ArtistInfo
+from db_management.mock_api import MockAPIServer, synthetic_features
+from db_management.pipeline import EnrichmentPipeline, RateLimiter, SpotifyClient
+
+
+
+# "mode" cannot be stored in the features batch, the record is rejected on its own by the writer thread
+MALFORMED = dict(synthetic_features("bad"), mode="not a number")
+
+
+def run_with_timeout(pipeline: EnrichmentPipeline, stage: str, keys: list = None, timeout: float = 60) -> dict:
+    outcome = {}
+    thread = threading.Thread(target=lambda: outcome.update(stats=pipeline.run(stage, keys)), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "run() did not return after the writer failed"
+    return outcome["stats"]
+
+
+def make_pipeline(db_path: str, server: MockAPIServer) -> EnrichmentPipeline:
+    spotify = SpotifyClient("token", base_url=server.url + "/v1", limiter=RateLimiter(1000), max_retries=0)
+    return EnrichmentPipeline(db_path, spotify, workers=2, queue_size=1, write_batch_size=1, flush_interval=0.05)
+
+
+def test_malformed_record_with_keys(tmp_path):
+    db_path = str(tmp_path / "songs.db")
+    SongsDB(db_path).close_connection()
+    with MockAPIServer(fixtures={"audio-features": {"bad": MALFORMED}}) as server:
+        # the malformed record comes first, the later batches queue up behind its flush
+        pipeline = make_pipeline(db_path, server)
+        stats = run_with_timeout(pipeline, "features", ["bad"] + [f"good{idx}" for idx in range(1000)])
+
+    assert "bad" in stats["rejected"]
+    assert any("bad" in keys for keys, _ in stats["errors"])
+    db = SongsDB(db_path)
+    stored = {row[0] for row in db.conn.execute("SELECT song_spotify_id FROM songs_features")}
+    db.close_connection()
+    assert "bad" not in stored
+    assert stats["written"] == len(stored) == 1001 - 1       # only the malformed record is left out
+
+
+def test_malformed_record_fails_its_jobs(tmp_path):
+    db_path = str(tmp_path / "songs.db")
+    db = SongsDB(db_path)
+    db.seed_jobs("features")
+    db.enqueue_jobs("features", ["good1", "bad", "good2"])
+    db.close_connection()
+    with MockAPIServer(fixtures={"audio-features": {"bad": MALFORMED}}) as server:
+        stats = run_with_timeout(make_pipeline(db_path, server), "features")
+
+    assert "bad" in stats["rejected"]
+    db = SongsDB(db_path)
+    status, error = db.conn.execute("SELECT status, last_error FROM ingest_jobs WHERE stage = 'features' AND entity_key = 'bad'").fetchone()
+    counts = db.get_job_counts("features")
+    db.close_connection()
+    assert status == "failed" and "not a number" in error
+    assert counts == {("features", "done"): 2, ("features", "failed"): 1}
+
+
+def test_malformed_features_rejected_one_by_one():
+    records = [synthetic_features("good0"), dict(synthetic_features("bad"), mode=300), MALFORMED,
+               dict(synthetic_features("good1"), key=None)]
+    batch, malformed = EnrichmentPipeline(":memory:", None)._features_batch(records)
+
+    assert [key for key, _ in malformed] == ["bad", "bad"]
+    rows = list(batch.rows())
+    assert [row[0] for row in rows] == ["good0", "good1"]
+    assert rows[1][11] is None and rows[0][10] == records[0]["mode"]
+
+
+def test_failed_flush_stores_nothing(tmp_path, monkeypatch):
+    # the records, their downstream jobs and the job status are one transaction
+    db_path = str(tmp_path / "songs.db")
+    db = SongsDB(db_path)
+    db.artists_insert_many([ArtistInfo("ar0", "Artist ar0", "", 1, 1)])
+    db.enqueue_jobs("artists", ["ar1", "ar2"])
+
+    def albums_insert_many(albums, commit):
+        raise sqlite3.OperationalError("disk I/O error")
+    monkeypatch.setattr(db, "albums_insert_many", albums_insert_many)
+    pipeline = EnrichmentPipeline(db_path, None)
+    buffers = {"songs": [], "albums": [AlbumInfo("al0", "Album al0", "1975", 1, "", 1)], "popularity": [], "features": [synthetic_features("s0")],
+               "artists": [ArtistInfo("ar0", "Artist ar0", "", 1, 1), ArtistInfo("ar1", "Artist ar1", "", 1, 1)]}
+    stats = {"written": 0, "rejected": [], "errors": []}
+    pipeline._flush_or_fail(db, "artists", buffers, ["ar1", "ar2"], [], stats)
+
+    assert db.conn.execute("SELECT artist_spotify_id FROM artists").fetchall() == [("ar0",)]
+    assert db.get_job_counts("artists") == {("artists", "failed"): 2}
+    assert stats["written"] == 0 and set(stats["rejected"]) == {"ar0", "ar1", "al0", "s0"}
+    assert all(not records for records in buffers.values())
+    db.close_connection()
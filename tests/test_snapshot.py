@@ -0,0 +1,73 @@
+import os
+
+from db_management.db import SongsDB, AlbumInfo, ArtistInfo, IDSongInfo, LyricsInfo, SongFeaturesBatch
+from db_management.mock_api import synthetic_features
+from db_management.snapshot import export_snapshot, load_snapshot
+
+
+
+DATES = ["1975-06-13", "1980", "1990-01-04", None]
+
+
+def populate(tmp_path) -> SongsDB:
+    db = SongsDB(str(tmp_path / "songs.db"))
+    db.artists_insert_many(ArtistInfo(f"ar{idx}", f"Artist {idx}", "pop", 1, 1) for idx in range(3))
+    db.albums_insert_many(AlbumInfo(f"al{idx}", f"Album {idx}", "1975", 10, "", 1) for idx in range(4))
+    # ar0 sings in 1975 and 1990 only
+    db.songs_insert_many(IDSongInfo(f"s{idx}", f"al{idx % 4}", f"ar{0 if idx % 4 in (0, 2) else 1 + idx % 2}", f"Title {idx}",
+                                    DATES[idx % 4], 0, idx) for idx in range(40))
+    db.songs_features_insert_many(SongFeaturesBatch.from_dicts([synthetic_features(f"s{idx}") for idx in range(40)]))
+    db.lyrics_insert_many(LyricsInfo(f"s{idx}", f"la la {idx}") for idx in range(0, 40, 3))
+    return db
+
+
+def snapshot(path: str):
+    data = load_snapshot(path)
+    data["release_year"] = data["release_year"].astype(str)
+    data["artist_genres"] = data["artist_genres"].astype(object)
+    return data.sort_values("song_id").reset_index(drop=True)
+
+
+def test_incremental_export_rewrites_changed_years(tmp_path):
+    db = populate(tmp_path)
+    path = str(tmp_path / "snapshot")
+    assert export_snapshot(db, path) == ["1975", "1980", "1990", "unknown"]
+    assert export_snapshot(db, path) == []
+
+    db.conn.execute("UPDATE songs_features SET energy = 0.5 WHERE song_spotify_id = 's1'")
+    db.conn.commit()
+    assert export_snapshot(db, path) == ["1980"]
+
+    db.conn.execute("UPDATE artists SET followers = 99 WHERE artist_spotify_id = 'ar0'")
+    db.conn.commit()
+    assert export_snapshot(db, path) == ["1975", "1990"]
+
+    # a moved song is rewritten in its old and its new year
+    db.conn.execute("UPDATE songs SET release_date = '2001-02-03' WHERE song_spotify_id = 's4'")
+    db.lyrics_insert_many([LyricsInfo("s5", "new lyrics")])
+    db.conn.commit()
+    assert export_snapshot(db, path) == ["1975", "1980", "2001"]
+
+    # a year without songs left is dropped
+    db.conn.execute("DELETE FROM songs WHERE release_date IS NULL")
+    db.conn.commit()
+    assert export_snapshot(db, path) == ["unknown"]
+    assert not os.path.exists(os.path.join(path, "release_year=unknown"))
+
+    full = str(tmp_path / "full")
+    export_snapshot(db, full, full=True)
+    incremental, expected = snapshot(path), snapshot(full)
+    assert len(incremental) == 30
+    assert incremental.equals(expected)
+    db.close_connection()
+
+
+def test_export_after_bulk_load_is_full(tmp_path):
+    db = populate(tmp_path)
+    path = str(tmp_path / "snapshot")
+    export_snapshot(db, path)
+    with db.bulk_load():
+        db.conn.execute("UPDATE songs_features SET energy = 0.5 WHERE song_spotify_id = 's1'")
+    assert export_snapshot(db, path) == ["1975", "1980", "1990", "unknown"]
+    assert snapshot(path).set_index("song_id").loc["s1", "energy"] == 0.5
+    db.close_connection()